@@ -0,0 +1,130 @@
+import os
+
+import torch
+
+# Checkpoints of the trained models, so that they can be used outside of the training session (e.g. by serving.py).
+# Every (drug, period, model) run writes one file with the encoder's weights together with the graph it encodes:
+# the normalized node features, the training edges and the node names. Loading a checkpoint is then enough to
+# recompute the node embeddings, without the datasets, the feature statistics or the edge split of the run.
+
+def get_checkpoints_dir(log_to, run_id):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str
+    Returns
+    -------
+    checkpoints_dir : str
+    Folder of the checkpoints saved by a run.
+    '''
+    return log_to + '/checkpoints/' + run_id
+
+def get_checkpoint_path(log_to, run_id, drug, period, model_name):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    Returns
+    -------
+    checkpoint_path : str
+    '''
+    return get_checkpoints_dir(log_to, run_id) + '/' + f'{drug}_{period}_{model_name}.pt'
+
+def save_checkpoint(model, x, edge_index, countries, log_to, run_id, drug, period, model_name):
+    '''
+    Parameters
+    ----------
+    model : torch_geometric.nn.GAE or torch_geometric.nn.VGAE
+        Trained model.
+    x : torch.Tensor
+        Normalized node features the model was trained on.
+    edge_index : torch.Tensor
+        Training edges (the encoder's message passing graph).
+    countries : list of str
+        Name of every node.
+    log_to : str
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    Returns
+    -------
+    file : str
+    Writes the encoder's state dict, its dimensions and the graph to <drug>_<period>_<model_name>.pt.
+    '''
+    checkpoint_path = get_checkpoint_path(log_to, run_id, drug, period, model_name)
+    os.makedirs(os.path.dirname(checkpoint_path), exist_ok = True)
+    torch.save({'drug': drug, 'period': period, 'model_name': model_name,
+                'in_channels': x.size(1), 'out_channels': model.encoder.conv1.out_channels // 2,
+                'state_dict': {name: tensor.cpu() for name, tensor in model.state_dict().items()},
+                'x': x.detach().cpu(), 'edge_index': edge_index.cpu(), 'countries': [str(country) for country in countries]}, checkpoint_path)
+    return checkpoint_path
+
+def load_checkpoint(file, dev = 'cpu'):
+    '''
+    Parameters
+    ----------
+    file : str
+    dev : str or torch.device, optional
+    Returns
+    -------
+    (model, checkpoint) : tuple
+    Rebuilds the model (in eval mode) from a checkpoint written by save_checkpoint; checkpoint holds the graph and the metadata.
+    '''
+    # torch_geometric is only needed once a model is actually loaded
+    import torch_geometric.nn as pyg_nn
+    from models import GAE_Encoder, VGAE_Encoder
+
+    if not os.path.exists(file):
+        raise Exception(f'No checkpoint at {file}!')
+    checkpoint = torch.load(file, map_location = dev)
+    pyg_models = {'GAE': (pyg_nn.GAE, GAE_Encoder), 'VGAE': (pyg_nn.VGAE, VGAE_Encoder)}
+    if checkpoint['model_name'] not in pyg_models:
+        raise Exception(f"Unknown model {checkpoint['model_name']} in {file}!")
+    pyg_model, encoder = pyg_models[checkpoint['model_name']]
+    model = pyg_model(encoder(checkpoint['in_channels'], checkpoint['out_channels'])).to(dev)
+    model.load_state_dict(checkpoint['state_dict'])
+    model.eval()
+    return model, checkpoint
+
+def list_checkpoints(log_to, run_id):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str
+    Returns
+    -------
+    checkpoints : dict
+        {(drug, period, model_name): file} for every checkpoint saved by the run.
+    '''
+    checkpoints_dir = get_checkpoints_dir(log_to, run_id)
+    if not os.path.exists(checkpoints_dir):
+        raise Exception(f'No checkpoints saved by run {run_id}!')
+    checkpoints = dict()
+    for file in sorted(os.listdir(checkpoints_dir)):
+        if file.endswith('.pt'):
+            drug, period, model_name = file[:-len('.pt')].rsplit('_', 2)
+            checkpoints[(drug, period, model_name)] = checkpoints_dir + '/' + file
+    return checkpoints
+
+def get_latest_checkpoints_run(log_to):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    Returns
+    -------
+    run_id : str
+    The latest run with saved checkpoints.
+    '''
+    runs_dir = log_to + '/checkpoints'
+    runs = [run for run in os.listdir(runs_dir) if os.path.isdir(runs_dir + '/' + run)] if os.path.exists(runs_dir) else []
+    if len(runs) == 0:
+        raise Exception(f'No checkpoints saved to {log_to}!')
+    return max(runs, key = lambda run: os.path.getmtime(runs_dir + '/' + run))
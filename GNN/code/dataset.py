@@ -0,0 +1,114 @@
+import os
+import hashlib
+import networkx as nx
+
+from torch_geometric.data import InMemoryDataset, Data
+from torch_geometric.utils.convert import from_networkx
+
+import utils
+
+# Single-file container of all the (drug, period) graphs of a pyg_data folder.
+# The .gml files are parsed once and collated into one processed file (concatenated tensors plus slice offsets);
+# afterwards the whole collection is loaded with a single file read, and any graph is sliced out by index or by (drug, period) key.
+# The processed file is named after a digest of the .gml files (names, sizes and modification times), so it is rebuilt when they change.
+
+class DrugNetworks(InMemoryDataset):
+    '''
+    Parameters
+    ----------
+    root : str
+        Folder of the processed file (written to root/processed).
+    data_path : str
+        Folder of the .gml files, e.g. data_path of config.yaml.
+    transform : callable, optional
+        Applied to every graph on access.
+    pre_transform : callable, optional
+        Applied once to every graph before collating.
+    force_reload : bool, optional
+    Every graph holds x, edge_index, the node names ('countries') and its 'drug' and 'period' (as in utils.get_dataset_info).
+    Graphs are accessed by position (dataset[i]) or by key (dataset['Cocaine', '2010']).
+    '''
+
+    def __init__(self, root, data_path, transform = None, pre_transform = None, force_reload = False):
+        self.data_path = data_path
+        super().__init__(root, transform, pre_transform, log = False, force_reload = force_reload)
+        self.load(self.processed_paths[0])
+        self.key_index = {key: i for i, key in enumerate(self.graph_keys)}
+
+    @property
+    def raw_dir(self):
+        return self.data_path
+
+    @property
+    def raw_file_names(self):
+        return sorted(file for file in os.listdir(self.data_path) if file.endswith('.gml'))
+
+    @property
+    def processed_file_names(self):
+        digest = hashlib.md5()
+        for file in self.raw_file_names:
+            stat = os.stat(os.path.join(self.data_path, file))
+            digest.update(f'{file}:{stat.st_size}:{stat.st_mtime_ns};'.encode())
+        return [f'drug_networks_{digest.hexdigest()[:12]}.pt']
+
+    def download(self):
+        raise Exception(f'No .gml files found in {self.data_path}!')
+
+    def process(self):
+        data_list = []
+        for file in self.raw_file_names:
+            data = from_networkx(nx.read_gml(os.path.join(self.data_path, file)))
+            drug, period = utils.get_dataset_info(file)
+            data = Data(x = data.x.float(), edge_index = data.edge_index, countries = list(data.y), drug = drug, period = period)
+            if self.pre_transform is not None:
+                data = self.pre_transform(data)
+            data_list.append(data)
+        self.save(data_list, self.processed_paths[0])
+
+    @property
+    def graph_keys(self):
+        '''
+        Returns
+        -------
+        keys : list of tuples
+            (drug, period) of every graph, in dataset order.
+        '''
+        return list(zip(self._data.drug, self._data.period))
+
+    def __getitem__(self, idx):
+        if isinstance(idx, tuple) and len(idx) == 2 and isinstance(idx[0], str):
+            key = (idx[0], str(idx[1]))
+            if key not in self.key_index:
+                raise Exception(f'No graph for {key}!')
+            idx = self.key_index[key]
+        return super().__getitem__(idx)
+
+def get_dataset(args, force_reload = False):
+    '''
+    Parameters
+    ----------
+    args : dict
+        Training configuration; uses data_path and dataset_root.
+    force_reload : bool, optional
+    Returns
+    -------
+    dataset : DrugNetworks
+    Loads (building it on first use) the collated container of the graphs in args['data_path'].
+    '''
+    return DrugNetworks(args['dataset_root'], args['data_path'], force_reload = force_reload)
+
+def get_training_graphs(args):
+    '''
+    Parameters
+    ----------
+    args : dict
+        Training configuration.
+    Returns
+    -------
+    graphs : list of tuples
+        (dataset_path, data) pairs for the train_test functions: the graphs of the collated container when args['dataset_root'] is set
+        (with dataset_path None), the .gml files of args['data_path'] otherwise (with data None).
+    '''
+    if args.get('dataset_root', None) is not None:
+        return [(None, data) for data in get_dataset(args)]
+    return [(file, None) for file in utils.get_path_list(args['data_path']) if file.endswith('.gml')]
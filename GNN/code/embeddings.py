@@ -0,0 +1,216 @@
+import os
+import numpy as np
+
+import torch
+
+# Export of the node embeddings z of the trained encoders and analysis of their drift across years.
+# Every (drug, period, model) run writes its embedding matrix to a compressed .npz file, with rows keyed by country ID:
+# the position of the country in the sorted list of all the countries of the collection (the same convention as Countries.get_country_registry).
+# Each year is trained independently, so consecutive years are first aligned by orthogonal Procrustes (on their shared countries)
+# and the movement of every country is then the distance between its aligned embeddings; all the year pairs are solved in one batched SVD.
+
+# Country vocabularies, keyed by the folder of the datasets (or of the collated container)
+vocabulary_cache = dict()
+
+def get_country_vocabulary(args):
+    '''
+    Parameters
+    ----------
+    args : dict
+        Training configuration.
+    Returns
+    -------
+    countries : list of str
+    Sorted list of all the countries (nodes) of the datasets used for training; a country's ID is its position in this list.
+    '''
+    # Only needed when exporting, the drift analysis reads the vocabulary from the files
+    import networkx as nx
+    import dataset
+
+    key = args.get('dataset_root', None) or args['data_path']
+    if key not in vocabulary_cache:
+        names = set()
+        for file, data in dataset.get_training_graphs(args):
+            names.update(data.countries if data is not None else nx.read_gml(file).nodes)
+        vocabulary_cache[key] = sorted(names)
+    return vocabulary_cache[key]
+
+def get_embeddings_dir(log_to, run_id):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str
+    Returns
+    -------
+    embeddings_dir : str
+    Folder of the embeddings exported by a run.
+    '''
+    return log_to + '/embeddings/' + run_id
+
+def export_embeddings(z, countries, vocabulary, log_to, run_id, drug, period, model_name):
+    '''
+    Parameters
+    ----------
+    z : torch.Tensor
+        Node embeddings (nodes x dimensions), in the order of countries.
+    countries : list of str
+        Name of every node.
+    vocabulary : list of str
+        Output of get_country_vocabulary.
+    log_to : str
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    Returns
+    -------
+    file : str
+    Writes the embeddings sorted by country ID as float32, with the int32 IDs and the vocabulary, to <drug>_<period>_<model_name>.npz.
+    '''
+    index = {country: i for i, country in enumerate(vocabulary)}
+    missing = [country for country in countries if country not in index]
+    if len(missing) > 0:
+        raise Exception(f'Countries not in the vocabulary: {missing}')
+    ids = np.array([index[country] for country in countries], dtype = np.int32)
+    order = np.argsort(ids)
+
+    embeddings_dir = get_embeddings_dir(log_to, run_id)
+    os.makedirs(embeddings_dir, exist_ok = True)
+    file = embeddings_dir + '/' + f'{drug}_{period}_{model_name}.npz'
+    np.savez_compressed(file, ids = ids[order], z = z.detach().cpu().numpy().astype(np.float32)[order], vocabulary = np.array(vocabulary))
+    return file
+
+def read_embeddings(log_to, run_id):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str
+    Returns
+    -------
+    (vocabulary, embeddings) : tuple
+    The country vocabulary and {(drug, period, model_name): (ids, z)} for every embedding exported by the run.
+    '''
+    embeddings_dir = get_embeddings_dir(log_to, run_id)
+    if not os.path.exists(embeddings_dir):
+        raise Exception(f'No embeddings exported by run {run_id}!')
+    vocabulary, embeddings = None, dict()
+    for file in sorted(os.listdir(embeddings_dir)):
+        if not file.endswith('.npz'):
+            continue
+        with np.load(embeddings_dir + '/' + file) as archive:
+            if vocabulary is None:
+                vocabulary = archive['vocabulary'].tolist()
+            elif archive['vocabulary'].tolist() != vocabulary:
+                raise Exception(f'{file} was exported with a different vocabulary!')
+            drug, period, model_name = file[:-len('.npz')].rsplit('_', 2)
+            embeddings[(drug, period, model_name)] = (archive['ids'], archive['z'])
+    return vocabulary, embeddings
+
+def stack_embeddings(embeddings, num_countries):
+    '''
+    Parameters
+    ----------
+    embeddings : list of tuples
+        (ids, z) of every period, in order.
+    num_countries : int
+    Returns
+    -------
+    (E, M) : tuple
+        Dense (periods x countries x dimensions) embeddings indexed by country ID, and the (periods x countries) mask of the present countries.
+    '''
+    dims = set(z.shape[1] for _, z in embeddings)
+    if len(dims) > 1:
+        raise Exception('Embeddings of different dimensions!')
+    E = torch.zeros(len(embeddings), num_countries, dims.pop(), dtype = torch.float64)
+    M = torch.zeros(len(embeddings), num_countries, dtype = torch.bool)
+    for t, (ids, z) in enumerate(embeddings):
+        ids = torch.as_tensor(ids, dtype = torch.long)
+        E[t, ids], M[t, ids] = torch.as_tensor(z, dtype = torch.float64), True
+    return E, M
+
+def align_embeddings(E, M, center = True, scale = True):
+    '''
+    Parameters
+    ----------
+    E : torch.Tensor
+        (periods x countries x dimensions), e.g. from stack_embeddings.
+    M : torch.Tensor of bool
+        (periods x countries).
+    center : bool, optional
+        If True, the shared countries of every pair are centered first.
+    scale : bool, optional
+        If True, they are also scaled to unit Frobenius norm, so that movements are comparable across pairs.
+    Returns
+    -------
+    (R, movement, disparity) : tuple
+        For every pair of consecutive periods (t, t + 1): the orthogonal map R[t] minimizing ||A R - B|| over the countries present in both,
+        the movement of every country (the row norms of A R - B; nan for countries missing in either period) and the total squared residual.
+    '''
+    shared = (M[:-1] & M[1:]).unsqueeze(-1).to(E.dtype)
+    A, B = E[:-1] * shared, E[1:] * shared
+    if center:
+        count = shared.sum(dim = 1, keepdim = True).clamp(min = 1)
+        A = (A - A.sum(dim = 1, keepdim = True) / count) * shared
+        B = (B - B.sum(dim = 1, keepdim = True) / count) * shared
+    if scale:
+        A = A / A.norm(dim = (1, 2), keepdim = True).clamp(min = 1e-12)
+        B = B / B.norm(dim = (1, 2), keepdim = True).clamp(min = 1e-12)
+
+    # Orthogonal Procrustes for all pairs at once: A^T B = U S V^T, R = U V^T
+    U, _, Vh = torch.linalg.svd(A.transpose(1, 2) @ B)
+    R = U @ Vh
+    residual = A @ R - B
+    movement = torch.where(shared.squeeze(-1).bool(), residual.norm(dim = -1), torch.tensor(float('nan'), dtype = E.dtype))
+    disparity = (residual ** 2).sum(dim = (1, 2))
+    return R, movement, disparity
+
+def get_drift(log_to, run_id, drug, model_name, center = True, scale = True):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str
+    drug : str
+    model_name : str
+    center : bool, optional
+    scale : bool, optional
+        See align_embeddings.
+    Returns
+    -------
+    drift_df : pd.DataFrame
+        One row per country and pair of consecutive years exported by the run: the country ID and name, the years, its movement
+        and its rank among the countries of the pair (1 is the largest movement). Aggregate periods are ignored.
+    '''
+    import pandas as pd
+
+    vocabulary, embeddings = read_embeddings(log_to, run_id)
+    years = sorted(int(period) for (d, period, m) in embeddings.keys() if d == drug and m == model_name and period.isdigit())
+    if len(years) < 2:
+        raise Exception(f'At least two years of {model_name} embeddings of {drug} are needed!')
+    E, M = stack_embeddings([embeddings[(drug, str(year), model_name)] for year in years], len(vocabulary))
+    _, movement, _ = align_embeddings(E, M, center = center, scale = scale)
+
+    pair, country = torch.nonzero(~torch.isnan(movement), as_tuple = True)
+    drift_df = pd.DataFrame({'Country_ID': country.numpy(), 'Country': [vocabulary[i] for i in country.tolist()],
+                             'From': [years[t] for t in pair.tolist()], 'To': [years[t + 1] for t in pair.tolist()],
+                             'Movement': movement[pair, country].numpy()})
+    drift_df['Rank'] = drift_df.groupby('From')['Movement'].rank(ascending = False, method = 'first').astype(int)
+    return drift_df.sort_values(['From', 'Rank']).reset_index(drop = True)
+
+def get_drift_summary(drift_df):
+    '''
+    Parameters
+    ----------
+    drift_df : pd.DataFrame
+        Output of get_drift.
+    Returns
+    -------
+    summary_df : pd.DataFrame
+        One row per country: the number of year pairs, its mean and maximum movement and the year pair of the maximum, sorted by mean movement.
+    '''
+    grouped = drift_df.groupby(['Country_ID', 'Country'])
+    summary_df = grouped['Movement'].agg(['count', 'mean', 'max']).rename(columns = {'count': 'Pairs', 'mean': 'Mean_movement', 'max': 'Max_movement'})
+    summary_df['Max_from'] = drift_df.loc[grouped['Movement'].idxmax(), 'From'].values
+    return summary_df.sort_values('Mean_movement', ascending = False).reset_index()
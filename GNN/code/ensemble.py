@@ -0,0 +1,183 @@
+import copy
+
+import torch
+from torch.func import stack_module_state, functional_call, vmap
+
+from torch_geometric.utils import train_test_split_edges, negative_sampling
+from torch_geometric.nn.models.autoencoder import MAX_LOGSTD
+
+import utils
+import train_test
+import profiling
+import metrics
+
+import warnings
+
+# Multi-seed ensembles: N copies of a model that differ only in their random seed are trained together.
+# Their parameters are stacked along a leading seed dimension and a single vmapped forward/backward pass
+# serves all of them; Adam is elementwise, so one optimizer over the stacked parameters is equivalent to N independent ones.
+# All seeds share the same edge split (and hence the same normalized adjacency), so the spread reported across seeds
+# reflects initialization, negative sampling and (for VGAE) reparametrization noise.
+
+def get_ensemble(pyg_model, encoder, in_channels, out_channels, seeds, dev):
+    '''
+    Parameters
+    ----------
+    pyg_model : pyg_nn.GAE or pyg_nn.VGAE
+    encoder : GAE_Encoder or VGAE_Encoder
+    in_channels : int
+    out_channels : int
+    seeds : list of int
+    dev : torch.device
+    Returns
+    -------
+    (models, base_model, params, buffers) : tuple
+    Initializes one model per seed, and stacks their parameters and buffers along a leading seed dimension.
+    base_model is a parameter-free (meta) copy used as the template for functional calls.
+    '''
+
+    models = []
+    for seed in seeds:
+        torch.manual_seed(seed)
+        models.append(pyg_model(encoder(in_channels, out_channels)).to(dev))
+    params, buffers = stack_module_state([model.encoder for model in models])
+    base_model = copy.deepcopy(models[0]).to('meta')
+    return models, base_model, params, buffers
+
+def unstack_ensemble(models, params, buffers):
+    '''
+    Parameters
+    ----------
+    models : list of pyg_nn
+    params : dict
+    buffers : dict
+    Returns
+    -------
+    models : list of pyg_nn
+    Copies the trained stacked parameters back into the per-seed models.
+    '''
+
+    with torch.no_grad():
+        for i, model in enumerate(models):
+            model.encoder.load_state_dict({**{name: p[i] for name, p in params.items()}, **{name: b[i] for name, b in buffers.items()}})
+    return models
+
+def encode(base_model, params, buffers, x, edge_index):
+    '''
+    Parameters
+    ----------
+    base_model : pyg_nn.GAE or pyg_nn.VGAE
+    params : dict
+    buffers : dict
+    x : torch.Tensor
+    edge_index : torch.Tensor
+    Returns
+    -------
+    z : torch.Tensor
+    Functional equivalent of model.encode for one seed's parameters (VGAE samples z while training and returns mu otherwise).
+    '''
+
+    z = functional_call(base_model.encoder, (params, buffers), (x, edge_index))
+    if isinstance(z, tuple):
+        mu, logstd = z
+        z = base_model.reparametrize(mu, logstd.clamp(max = MAX_LOGSTD))
+    return z
+
+def train(base_model, params, buffers, optimizer, x, train_pos_edge_index, profiler = None):
+    base_model.train()
+    optimizer.zero_grad()
+    num_seeds = next(iter(params.values())).shape[0]
+    with profiling.phase(profiler, 'forward'):
+        # One set of negative edges per seed, as each model would draw in recon_loss
+        neg_edge_index = torch.stack([negative_sampling(train_pos_edge_index, x.size(0)) for _ in range(num_seeds)])
+
+        def loss_fn(p, b, neg):
+            z = encode(base_model, p, b, x, train_pos_edge_index)
+            return base_model.recon_loss(z, train_pos_edge_index, neg)
+
+        losses = vmap(loss_fn, randomness = 'different')(params, buffers, neg_edge_index)
+    with profiling.phase(profiler, 'backward'):
+        # Seeds do not share parameters, so the gradient of the sum is each seed's own gradient
+        losses.sum().backward()
+        optimizer.step()
+    return losses.detach()
+
+def test(base_model, params, buffers, x, train_pos_edge_index, pos_edge_index, neg_edge_index, profiler = None):
+    base_model.eval()
+    with profiling.phase(profiler, 'test_encode'):
+        with torch.no_grad():
+            z = vmap(lambda p, b: encode(base_model, p, b, x, train_pos_edge_index))(params, buffers)
+    with profiling.phase(profiler, 'test_metrics'):
+        # Inner product decoder for all seeds at once: (seeds x edges)
+        pos_scores = torch.sigmoid((z[:, pos_edge_index[0]] * z[:, pos_edge_index[1]]).sum(dim = -1))
+        neg_scores = torch.sigmoid((z[:, neg_edge_index[0]] * z[:, neg_edge_index[1]]).sum(dim = -1))
+        return metrics.auc_ap(pos_scores, neg_scores)
+
+def train_test_ensemble(pyg_model, encoder, dataset_path, args, run_id = None, verbose = False, data = None):
+
+    # Get strings for reporting, the model logger and the metrics store (see train_test.get_job); the usual logger entries hold the mean over seeds
+    model_name, drug, period, run_id, logger, store_path = train_test.get_job(pyg_model, dataset_path, args, run_id = run_id, data = data)
+    num_seeds = args.get('num_seeds', 10)
+    seeds = list(range(args.get('seed', 0), args.get('seed', 0) + num_seeds))
+
+    job = f'{drug}_{period}_{model_name}_ensemble'
+    profiler = profiling.TrainingProfiler(job) if args.get('profile', False) else None
+
+    # Read and normalize the graph
+    data, countries = train_test.prepare_data(dataset_path, args, data = data, profiler = profiler)
+
+    # Set the parameters
+    channels = args['hidden1_dim']
+    dev = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    with profiling.phase(profiler, 'split'):
+        torch.manual_seed(seeds[0])
+        # train_test_split_edges is deprecated in PyG
+        with warnings.catch_warnings():
+            warnings.filterwarnings('ignore', message = ".*'train_test_split_edges' is deprecated")
+            data = train_test_split_edges(data)
+    x, train_pos_edge_index = data.x.to(dev), data.train_pos_edge_index.to(dev)
+    test_pos_edge_index, test_neg_edge_index = data.test_pos_edge_index.to(dev), data.test_neg_edge_index.to(dev)
+
+    models, base_model, params, buffers = get_ensemble(pyg_model, encoder, data.num_features, channels, seeds, dev)
+    optimizer = torch.optim.Adam(params.values(), lr = args['learning_rate'])
+    num_epochs = args['num_epochs']
+
+    if verbose:
+        print(f'Began training {num_seeds} seeds of {model_name} on {drug} ({period})...')
+
+    for epoch in range(0, num_epochs):
+        with profiling.phase(profiler, 'train'):
+            losses = train(base_model, params, buffers, optimizer, x, train_pos_edge_index, profiler = profiler)
+        with profiling.phase(profiler, 'test'):
+            auc, ap = test(base_model, params, buffers, x, train_pos_edge_index, test_pos_edge_index, test_neg_edge_index, profiler = profiler)
+        if profiler is not None:
+            profiler.add_epoch()
+
+        spread = {'train_loss_std': losses.std().item(), 'test_AUC_std': auc.std().item(), 'test_AP_std': ap.std().item()}
+        train_loss, auc, ap = losses.mean().item(), auc.mean().item(), ap.mean().item()
+        utils.add_to_model_logger(logger, drug, period, model_name, train_loss, auc, ap)
+        utils.add_spread_to_model_logger(logger, drug, period, model_name, spread)
+        utils.add_to_metrics_store(store_path, run_id, drug, period, model_name, epoch, train_loss, auc, ap)
+        utils.add_spread_to_metrics_store(store_path, run_id, drug, period, model_name, epoch, spread)
+
+        if verbose:
+            print('Epoch: {}, train loss: {:.4f}, AUC: {:.4f} ± {:.4f}, AP: {:.4f} ± {:.4f}'.format(epoch, train_loss, auc, spread['test_AUC_std'], ap, spread['test_AP_std']))
+
+    summary = {'num_seeds': num_seeds}
+    if profiler is not None:
+        summary.update(profiler.summary())
+    utils.add_summary_to_metrics_store(store_path, run_id, drug, period, model_name, summary)
+
+    if verbose:
+        print(f"Training and testing complete. Best mean AUC: {max(logger[drug][period][model_name]['test']['AUC'])}")
+
+    # The model of the first seed stands for the ensemble in the exported embeddings and the saved checkpoint
+    models = unstack_ensemble(models, params, buffers)
+    train_test.finalize_model(models[0], x, train_pos_edge_index, countries, args, run_id, drug, period, model_name)
+
+    return models, logger
+
+def train_test_all_ensembles(args, verbose = False):
+
+    # The dict of models holds one list of per-seed models per entry
+    return train_test.train_test_all_graphs(train_test_ensemble, args, verbose = verbose)
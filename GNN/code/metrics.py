@@ -0,0 +1,111 @@
+import torch
+
+# Link prediction metrics computed in torch, on the device of the scores.
+# Every function accepts either one set of scores (1-D) or a batch of score sets (2-D, one row per
+# model/seed/year), padded to a common length and described by boolean masks. AUC and AP follow the
+# definitions of sklearn's roc_auc_score and average_precision_score, ties included.
+
+def pad_scores(score_list):
+    '''
+    Parameters
+    ----------
+    score_list : list of 1-D torch.Tensors
+    Returns
+    -------
+    (scores, mask) : tuple of torch.Tensors
+    Stacks score sets of different lengths into a (batch x max_length) tensor padded with -inf, plus the mask of the real entries.
+    '''
+
+    max_length = max(scores.numel() for scores in score_list)
+    device = score_list[0].device
+    scores = torch.full((len(score_list), max_length), float('-inf'), device = device)
+    mask = torch.zeros((len(score_list), max_length), dtype = torch.bool, device = device)
+    for i, s in enumerate(score_list):
+        scores[i, :s.numel()] = s.reshape(-1).float()
+        mask[i, :s.numel()] = True
+    return scores, mask
+
+def auc_ap(pos_scores, neg_scores, pos_mask = None, neg_mask = None):
+    '''
+    Parameters
+    ----------
+    pos_scores : torch.Tensor (n_pos) or (batch x n_pos)
+    neg_scores : torch.Tensor (n_neg) or (batch x n_neg)
+    pos_mask : torch.Tensor of bool, optional
+        Real (non-padded) positive scores; all of them by default.
+    neg_mask : torch.Tensor of bool, optional
+    Returns
+    -------
+    (auc, ap) : tuple of torch.Tensors
+    Computes ROC AUC and average precision by ranking the positive scores among the sorted positive and negative scores.
+    The outputs are scalars for 1-D inputs and have one entry per row otherwise.
+    '''
+
+    squeeze = pos_scores.dim() == 1
+    if squeeze:
+        pos_scores, neg_scores = pos_scores.unsqueeze(0), neg_scores.unsqueeze(0)
+        pos_mask = None if pos_mask is None else pos_mask.unsqueeze(0)
+        neg_mask = None if neg_mask is None else neg_mask.unsqueeze(0)
+    if pos_mask is None:
+        pos_mask = torch.ones_like(pos_scores, dtype = torch.bool)
+    if neg_mask is None:
+        neg_mask = torch.ones_like(neg_scores, dtype = torch.bool)
+
+    # Padded entries are sent to -inf, i.e. to the front of the sorted rows
+    pos = torch.where(pos_mask, pos_scores.double(), torch.tensor(float('-inf'), dtype = torch.float64, device = pos_scores.device))
+    neg = torch.where(neg_mask, neg_scores.double(), torch.tensor(float('-inf'), dtype = torch.float64, device = neg_scores.device))
+    pos_sorted = torch.sort(pos, dim = 1).values.contiguous()
+    neg_sorted = torch.sort(neg, dim = 1).values.contiguous()
+    pos = pos.contiguous()
+
+    num_pos = pos_mask.sum(dim = 1).double()
+    num_neg = neg_mask.sum(dim = 1).double()
+    neg_pads = (neg_mask.shape[1] - num_neg).unsqueeze(1)
+
+    # AUC: for every positive, the number of negatives scored below it (ties count one half)
+    neg_below = torch.searchsorted(neg_sorted, pos, right = False).double() - neg_pads
+    neg_below_or_tied = torch.searchsorted(neg_sorted, pos, right = True).double() - neg_pads
+    wins = torch.where(pos_mask, (neg_below + neg_below_or_tied) / 2, torch.zeros_like(neg_below))
+    auc = wins.sum(dim = 1) / (num_pos * num_neg)
+
+    # AP: mean over the positives of the precision at their score threshold
+    true_pos = pos_sorted.shape[1] - torch.searchsorted(pos_sorted, pos, right = False).double()
+    false_pos = neg_sorted.shape[1] - torch.searchsorted(neg_sorted, pos, right = False).double()
+    precision = torch.where(pos_mask, true_pos / (true_pos + false_pos), torch.zeros_like(true_pos))
+    ap = precision.sum(dim = 1) / num_pos
+
+    if squeeze:
+        return auc[0], ap[0]
+    return auc, ap
+
+def batched_auc_ap(pos_score_list, neg_score_list):
+    '''
+    Parameters
+    ----------
+    pos_score_list : list of 1-D torch.Tensors
+    neg_score_list : list of 1-D torch.Tensors
+    Returns
+    -------
+    (auc, ap) : tuple of torch.Tensors
+    Evaluates several edge sets (e.g. several seeds or years) in a single batched call.
+    '''
+
+    pos_scores, pos_mask = pad_scores(pos_score_list)
+    neg_scores, neg_mask = pad_scores(neg_score_list)
+    return auc_ap(pos_scores, neg_scores, pos_mask = pos_mask, neg_mask = neg_mask)
+
+def test_scores(model, z, pos_edge_index, neg_edge_index):
+    '''
+    Parameters
+    ----------
+    model : torch_geometric.nn.GAE or VGAE
+    z : torch.Tensor
+    pos_edge_index : torch.Tensor
+    neg_edge_index : torch.Tensor
+    Returns
+    -------
+    (pos_scores, neg_scores) : tuple of torch.Tensors
+    Decodes the positive and negative edges as GAE.test does, without leaving the device.
+    '''
+
+    return model.decoder(z, pos_edge_index, sigmoid = True), model.decoder(z, neg_edge_index, sigmoid = True)
@@ -0,0 +1,124 @@
+import torch
+
+from torch_geometric.data import Data
+from torch_geometric.loader import LinkNeighborLoader
+from torch_geometric.utils import train_test_split_edges
+
+import utils
+import train_test
+import metrics
+
+import warnings
+
+# Minibatch link prediction: every step encodes only the neighborhood sampled around a batch of
+# positive edges (plus as many random negative edges), so memory is bounded by the batch size
+# and the fan-out in num_neighbors rather than by the size of the graph.
+
+def get_loaders(data, args):
+    '''
+    Parameters
+    ----------
+    data : torch_geometric.data.Data
+        Output of train_test_split_edges.
+    args : dict
+    Returns
+    -------
+    (train_loader, test_loader) : tuple of LinkNeighborLoader
+    Creates the neighbor-sampling loaders over the training graph for positive/negative training and test edges.
+    '''
+
+    # Messages are only passed along training edges
+    train_data = Data(x = data.x, edge_index = data.train_pos_edge_index, num_nodes = data.num_nodes)
+
+    num_workers = args.get('num_workers', 0)
+    loader_kwargs = {'num_neighbors': args['num_neighbors'],
+                     'batch_size': args['batch_size'],
+                     'num_workers': num_workers,
+                     'persistent_workers': num_workers > 0}
+
+    # One random negative edge is sampled for every positive training edge
+    train_loader = LinkNeighborLoader(train_data, edge_label_index = data.train_pos_edge_index,
+                                      neg_sampling_ratio = 1.0, shuffle = True, **loader_kwargs)
+
+    # Test edges are fixed: positives labelled 1, negatives labelled 0
+    test_edge_label_index = torch.cat([data.test_pos_edge_index, data.test_neg_edge_index], dim = 1)
+    test_edge_label = torch.cat([torch.ones(data.test_pos_edge_index.size(1)), torch.zeros(data.test_neg_edge_index.size(1))])
+    test_loader = LinkNeighborLoader(train_data, edge_label_index = test_edge_label_index, edge_label = test_edge_label,
+                                     shuffle = False, **loader_kwargs)
+
+    return train_loader, test_loader
+
+def train(epoch, model, optimizer, train_loader, dev):
+    model.train()
+    total_loss = total_examples = 0
+    for batch in train_loader:
+        batch = batch.to(dev)
+        optimizer.zero_grad()
+        z = model.encode(batch.x, batch.edge_index)
+        pos_edge_index = batch.edge_label_index[:, batch.edge_label == 1]
+        neg_edge_index = batch.edge_label_index[:, batch.edge_label == 0]
+        loss = model.recon_loss(z, pos_edge_index, neg_edge_index)
+        loss.backward()
+        optimizer.step()
+        total_loss += loss.item() * pos_edge_index.size(1)
+        total_examples += pos_edge_index.size(1)
+    return total_loss / total_examples
+
+def test(model, test_loader, dev):
+    model.eval()
+    y, pred = [], []
+    with torch.no_grad():
+        for batch in test_loader:
+            batch = batch.to(dev)
+            z = model.encode(batch.x, batch.edge_index)
+            pred.append(model.decoder(z, batch.edge_label_index, sigmoid = True))
+            y.append(batch.edge_label.bool())
+    y, pred = torch.cat(y), torch.cat(pred)
+    auc, ap = metrics.auc_ap(pred[y], pred[~y])
+    return auc.item(), ap.item()
+
+def train_test_model(pyg_model, encoder, dataset_path, args, run_id = None, verbose = False, data = None):
+
+    # Get strings for reporting, the model logger and the metrics store (see train_test.get_job)
+    model_name, drug, period, run_id, logger, store_path = train_test.get_job(pyg_model, dataset_path, args, run_id = run_id, data = data)
+
+    # Read and normalize the graph
+    data, countries = train_test.prepare_data(dataset_path, args, data = data)
+
+    # Set the parameters
+    channels = args['hidden1_dim']
+    dev = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+    # Same encoders as full-batch training, without caching the (per-batch) normalized adjacency
+    model = pyg_model(encoder(data.num_features, channels, cached = False)).to(dev)
+    # train_test_split_edges is deprecated in PyG
+    with warnings.catch_warnings():
+        warnings.filterwarnings('ignore', message = ".*'train_test_split_edges' is deprecated")
+        data = train_test_split_edges(data)
+    train_loader, test_loader = get_loaders(data, args)
+    optimizer = torch.optim.Adam(model.parameters(), lr = args['learning_rate'])
+    num_epochs = args['num_epochs']
+
+    if verbose:
+        print(f'Began minibatch training {model_name} on {drug} ({period})...')
+
+    for epoch in range(0, num_epochs):
+        train_loss = train(epoch, model, optimizer, train_loader, dev)
+        auc, ap = test(model, test_loader, dev)
+        utils.add_to_model_logger(logger, drug, period, model_name, train_loss, auc, ap)
+        utils.add_to_metrics_store(store_path, run_id, drug, period, model_name, epoch, train_loss, auc, ap)
+
+        if verbose:
+            print('Epoch: {}, train loss: {:.4f}, AUC: {:.4f}, AP: {:.4f}'.format(epoch, train_loss, auc, ap))
+
+    # Embeddings (on the full training graph) and checkpoint
+    train_test.finalize_model(model, data.x.to(dev), data.train_pos_edge_index.to(dev), countries, args, run_id, drug, period, model_name)
+
+    if verbose:
+        print(f"Training and testing complete. Best AUC: {max(logger[drug][period][model_name]['test']['AUC'])}")
+
+    return model, logger
+
+def train_test_all_models(args, verbose = False):
+
+    # Return the models
+    return train_test.train_test_all_graphs(train_test_model, args, verbose = verbose)
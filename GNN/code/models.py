@@ -3,22 +3,25 @@ import torch.nn as nn
 import torch.nn.functional as F
 import torch_geometric.nn as pyg_nn
 
+# cached=True reuses the normalized adjacency of the first call, which is only valid for full-batch training;
+# minibatch training on sampled subgraphs must use cached=False
+
 class GAE_Encoder(torch.nn.Module):
-    def __init__(self, in_channels, out_channels):
+    def __init__(self, in_channels, out_channels, cached=True):
         super(GAE_Encoder, self).__init__()
-        self.conv1 = pyg_nn.GCNConv(in_channels, 2 * out_channels, cached=True)
-        self.conv2 = pyg_nn.GCNConv(2 * out_channels, out_channels, cached=True)
+        self.conv1 = pyg_nn.GCNConv(in_channels, 2 * out_channels, cached=cached)
+        self.conv2 = pyg_nn.GCNConv(2 * out_channels, out_channels, cached=cached)
 
     def forward(self, x, edge_index):
         x = F.relu(self.conv1(x, edge_index))
         return self.conv2(x, edge_index)
     
 class VGAE_Encoder(torch.nn.Module):
-    def __init__(self, in_channels, out_channels):
+    def __init__(self, in_channels, out_channels, cached=True):
         super(VGAE_Encoder, self).__init__()
-        self.conv1 = pyg_nn.GCNConv(in_channels, 2 * out_channels, cached=True) 
-        self.conv_mu = pyg_nn.GCNConv(2 * out_channels, out_channels, cached=True)
-        self.conv_logstd = pyg_nn.GCNConv(2 * out_channels, out_channels, cached=True)
+        self.conv1 = pyg_nn.GCNConv(in_channels, 2 * out_channels, cached=cached) 
+        self.conv_mu = pyg_nn.GCNConv(2 * out_channels, out_channels, cached=cached)
+        self.conv_logstd = pyg_nn.GCNConv(2 * out_channels, out_channels, cached=cached)
 
     def forward(self, x, edge_index):
         x = self.conv1(x, edge_index).relu()
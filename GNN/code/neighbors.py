@@ -0,0 +1,273 @@
+import os
+
+import torch
+
+import embeddings
+
+# Approximate nearest-neighbor search over the exported country embeddings (see embeddings.export_embeddings).
+# Embeddings of different (drug, period, model) runs live in unrelated spaces, so the index keeps one inverted-file (IVF) index per space:
+# a k-means coarse quantizer splits the vectors into lists, and a query only scans the vectors of its nprobe closest lists.
+# Vectors are kept contiguous and sorted by list (with offsets, as in a CSR matrix), so that inserts only append and re-sort lazily;
+# new years are added as new spaces without touching the existing ones.
+
+metrics = ['cosine', 'ip']
+
+class IVFIndex():
+    '''
+    Parameters
+    ----------
+    metric : str, optional
+        'cosine' or 'ip' (inner product). The default is 'cosine'.
+    nlist : int or None, optional
+        Number of lists; None uses about sqrt(n) lists for the first n vectors added.
+    nprobe : int, optional
+        Number of lists scanned per query; nprobe >= nlist is an exact search. The default is 4.
+    seed : int, optional
+        Seed of the k-means initialization.
+    Inverted-file index over the vectors of one embedding space, keyed by integer IDs (e.g. country IDs).
+    '''
+
+    def __init__(self, metric = 'cosine', nlist = None, nprobe = 4, seed = 0):
+        if metric not in metrics:
+            raise Exception(f'Invalid metric, choose from {metrics}!')
+        self.metric = metric
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.seed = seed
+        self.centroids = None
+        self.vectors = torch.zeros(0, 0)
+        self.ids = torch.zeros(0, dtype = torch.long)
+        self.lists = torch.zeros(0, dtype = torch.long)
+        self.offsets = None
+
+    def __len__(self):
+        return self.ids.size(0)
+
+    def prepare(self, x):
+        x = torch.as_tensor(x, dtype = torch.float32)
+        return torch.nn.functional.normalize(x, dim = 1) if self.metric == 'cosine' else x
+
+    def train(self, x, num_iterations = 20):
+        '''
+        Parameters
+        ----------
+        x : torch.Tensor
+            Training vectors (already prepared).
+        num_iterations : int, optional
+        Returns
+        -------
+        None
+        Fits the coarse quantizer by (spherical, for cosine) k-means, with the vectors assigned to the centroid of largest inner product.
+        '''
+        nlist = self.nlist if self.nlist is not None else max(1, round(x.size(0) ** 0.5))
+        nlist = min(nlist, x.size(0))
+        generator = torch.Generator().manual_seed(self.seed)
+        centroids = x[torch.randperm(x.size(0), generator = generator)[:nlist]].clone()
+        for _ in range(num_iterations):
+            assignment = (x @ centroids.T).argmax(dim = 1)
+            counts = torch.bincount(assignment, minlength = nlist).unsqueeze(1)
+            sums = torch.zeros_like(centroids).index_add_(0, assignment, x)
+            # Empty lists keep their centroid
+            centroids = torch.where(counts > 0, sums / counts.clamp(min = 1), centroids)
+            if self.metric == 'cosine':
+                centroids = torch.nn.functional.normalize(centroids, dim = 1)
+        self.centroids = centroids
+
+    def add(self, x, ids):
+        '''
+        Parameters
+        ----------
+        x : array-like
+            Vectors (n x dimensions).
+        ids : array-like
+            Their integer IDs.
+        Returns
+        -------
+        None
+        Inserts vectors; the quantizer is trained on the first vectors added. Existing IDs are replaced.
+        '''
+        x, ids = self.prepare(x), torch.as_tensor(ids, dtype = torch.long)
+        if x.size(0) != ids.size(0):
+            raise Exception('Vectors and IDs of different lengths!')
+        if self.centroids is None:
+            self.train(x)
+            self.vectors = torch.zeros(0, x.size(1))
+        elif x.size(1) != self.centroids.size(1):
+            raise Exception(f'Vectors of dimension {x.size(1)} added to an index of dimension {self.centroids.size(1)}!')
+
+        keep = ~torch.isin(self.ids, ids)
+        self.vectors = torch.cat([self.vectors[keep], x])
+        self.ids = torch.cat([self.ids[keep], ids])
+        self.lists = torch.cat([self.lists[keep], (x @ self.centroids.T).argmax(dim = 1)])
+        self.offsets = None
+
+    def sort(self):
+        # Contiguous lists: vectors sorted by list, with the offsets of every list
+        order = torch.argsort(self.lists, stable = True)
+        self.vectors, self.ids, self.lists = self.vectors[order], self.ids[order], self.lists[order]
+        counts = torch.bincount(self.lists, minlength = self.centroids.size(0))
+        self.offsets = torch.cat([torch.zeros(1, dtype = torch.long), counts.cumsum(0)])
+
+    def search(self, q, k = 10, nprobe = None):
+        '''
+        Parameters
+        ----------
+        q : array-like
+            Query vectors (queries x dimensions).
+        k : int, optional
+        nprobe : int, optional
+            Overrides the nprobe of the index.
+        Returns
+        -------
+        (scores, ids) : tuple
+            (queries x k) similarities (cosine or inner product) and IDs of the neighbors, best first; missing neighbors have score -inf and ID -1.
+        '''
+        if len(self) == 0:
+            raise Exception('The index is empty!')
+        if self.offsets is None:
+            self.sort()
+        q = self.prepare(q)
+        nprobe = min(nprobe if nprobe is not None else self.nprobe, self.centroids.size(0))
+
+        # Lists to scan for every query, then one matrix product over the concatenated candidate vectors of each query
+        probes = (q @ self.centroids.T).topk(nprobe, dim = 1).indices
+        scores = torch.full((q.size(0), k), float('-inf'))
+        ids = torch.full((q.size(0), k), -1, dtype = torch.long)
+        for i in range(q.size(0)):
+            candidates = torch.cat([torch.arange(self.offsets[j], self.offsets[j + 1]) for j in probes[i].tolist()])
+            if candidates.numel() == 0:
+                continue
+            candidate_scores = self.vectors[candidates] @ q[i]
+            top = candidate_scores.topk(min(k, candidates.numel()))
+            scores[i, :top.values.numel()], ids[i, :top.values.numel()] = top.values, self.ids[candidates[top.indices]]
+        return scores, ids
+
+    def state_dict(self):
+        return {'metric': self.metric, 'nlist': self.nlist, 'nprobe': self.nprobe, 'seed': self.seed,
+                'centroids': self.centroids, 'vectors': self.vectors, 'ids': self.ids, 'lists': self.lists}
+
+    @classmethod
+    def from_state_dict(cls, state):
+        index = cls(metric = state['metric'], nlist = state['nlist'], nprobe = state['nprobe'], seed = state['seed'])
+        index.centroids, index.vectors, index.ids, index.lists = state['centroids'], state['vectors'], state['ids'], state['lists']
+        return index
+
+def get_embedding_index():
+    '''
+    Returns
+    -------
+    embedding_index : dict
+        Empty index over several embedding spaces: {'vocabulary': list of countries, 'spaces': {(drug, period, model_name): IVFIndex}}.
+        The IDs of the index are positions in its own vocabulary, which grows as runs with new countries are added.
+    '''
+    return {'vocabulary': [], 'spaces': dict()}
+
+def add_run_embeddings(embedding_index, log_to, run_id, metric = 'cosine', nlist = None, nprobe = 4, replace = False):
+    '''
+    Parameters
+    ----------
+    embedding_index : dict
+        Output of get_embedding_index (or load_embedding_index); updated in place.
+    log_to : str
+    run_id : str
+    metric : str, optional
+    nlist : int, optional
+    nprobe : int, optional
+        See IVFIndex.
+    replace : bool, optional
+        If True, spaces already in the index are rebuilt from this run; by default they are skipped.
+    Returns
+    -------
+    added : list of tuples
+    Inserts the embeddings exported by a run (e.g. newly trained years), one space per (drug, period, model_name).
+    The run's country IDs are translated by name into those of the index; countries new to the index are appended to its vocabulary.
+    '''
+    vocabulary, run_embeddings = embeddings.read_embeddings(log_to, run_id)
+
+    # A run trained on more (or other) countries shifts every ID of its sorted vocabulary, so IDs are matched by name
+    index_vocabulary = embedding_index['vocabulary']
+    position = {country: i for i, country in enumerate(index_vocabulary)}
+    for country in vocabulary:
+        if country not in position:
+            position[country] = len(index_vocabulary)
+            index_vocabulary.append(country)
+    remap = torch.tensor([position[country] for country in vocabulary], dtype = torch.long)
+
+    added = []
+    for space, (ids, z) in run_embeddings.items():
+        if space in embedding_index['spaces'] and not replace:
+            continue
+        index = IVFIndex(metric = metric, nlist = nlist, nprobe = nprobe)
+        index.add(z, remap[torch.as_tensor(ids, dtype = torch.long)])
+        embedding_index['spaces'][space] = index
+        added.append(space)
+    return added
+
+def get_similar_countries(embedding_index, drug, period, model_name, countries, k = 10, nprobe = None):
+    '''
+    Parameters
+    ----------
+    embedding_index : dict
+    drug : str
+    period : str or int
+    model_name : str
+    countries : str or list of str
+    k : int, optional
+    nprobe : int, optional
+    Returns
+    -------
+    similar : dict
+        {country: [(neighbor, score), ...]}: the k countries whose role (embedding) in the network of the given space is most similar, excluding the country itself.
+    '''
+    space = (drug, str(period), model_name)
+    if space not in embedding_index['spaces']:
+        raise Exception(f'No embeddings for {space} in the index!')
+    index = embedding_index['spaces'][space]
+    vocabulary = embedding_index['vocabulary']
+    countries = [countries] if isinstance(countries, str) else list(countries)
+
+    # The queries are the countries' own stored vectors
+    if index.offsets is None:
+        index.sort()
+    country_ids = {country: i for i, country in enumerate(vocabulary)}
+    position = {country_id: i for i, country_id in enumerate(index.ids.tolist())}
+    query_ids = [country_ids.get(country, -1) for country in countries]
+    missing = [country for country, country_id in zip(countries, query_ids) if country_id not in position]
+    if len(missing) > 0:
+        raise Exception(f'Countries not in the {space} network: {missing}')
+    queries = index.vectors[[position[country_id] for country_id in query_ids]]
+
+    scores, ids = index.search(queries, k = k + 1, nprobe = nprobe)
+    similar = dict()
+    for country, country_id, row_scores, row_ids in zip(countries, query_ids, scores.tolist(), ids.tolist()):
+        similar[country] = [(vocabulary[i], s) for i, s in zip(row_ids, row_scores) if i != country_id and i >= 0][:k]
+    return similar
+
+def save_embedding_index(embedding_index, file):
+    '''
+    Parameters
+    ----------
+    embedding_index : dict
+    file : str
+    Returns
+    -------
+    None
+    '''
+    torch.save({'vocabulary': embedding_index['vocabulary'],
+                'spaces': {space: index.state_dict() for space, index in embedding_index['spaces'].items()}}, file)
+
+def load_embedding_index(file):
+    '''
+    Parameters
+    ----------
+    file : str
+    Returns
+    -------
+    embedding_index : dict
+    Loads a saved index, or returns an empty one if the file does not exist (so that runs can be added incrementally).
+    '''
+    if not os.path.exists(file):
+        return get_embedding_index()
+    state = torch.load(file)
+    return {'vocabulary': state['vocabulary'],
+            'spaces': {space: IVFIndex.from_state_dict(index) for space, index in state['spaces'].items()}}
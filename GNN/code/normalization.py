@@ -0,0 +1,163 @@
+import os
+import networkx as nx
+
+import torch
+import torch.nn.functional as F
+from torch_geometric.utils.convert import from_networkx
+
+import dataset
+
+# Feature normalization with statistics computed once over the whole collection of graphs (all drugs and periods),
+# so that every graph is put on the same scale, instead of normalizing the columns of each graph independently.
+# Heavy-tailed columns can be log-transformed (log1p) first; the statistics are then folded into a single
+# affine map x * scale + shift, applied with one fused multiply-add when the graphs are loaded.
+
+# Numerical features of the node feature matrix, in the column order of Features.get_network_data;
+# the remaining columns are the one-hot encoded sub-regions and regions
+feature_names = ['Latitude', 'Longitude', 'Price(USD)', 'Seizures(kg)', 'Consumption(kg)', 'Market(kg)',
+                 'GDP/capita', 'Control_of_Corruption', 'Gov_Effectiveness', 'Stability_No_Terrorism', 'Regulatory_Quality', 'Rule_of_Law']
+
+# Heavy-tailed (non-negative) features which are log-transformed by default
+log_features = ['Price(USD)', 'Seizures(kg)', 'Consumption(kg)', 'Market(kg)', 'GDP/capita']
+
+# Normalization methods: 'standard' (zero mean, unit variance), 'minmax' (onto [0, 1]) and 'l2' (unit column norm)
+methods = ['standard', 'minmax', 'l2']
+
+def get_feature_statistics(x, method = 'standard', log_features = log_features, one_hot = False):
+    '''
+    Parameters
+    ----------
+    x : torch.Tensor
+        Node features of the whole collection, stacked (nodes x features).
+    method : str, optional
+        'standard', 'minmax' or 'l2'. The default is 'standard'.
+    log_features : list of str, optional
+        Features transformed by log1p before computing the statistics. The default is log_features.
+    one_hot : bool, optional
+        If True, the one-hot columns are normalized as well; by default they are left as they are.
+    Returns
+    -------
+    stats : dict
+        The method, the log-transformed columns (log_mask) and the affine map (scale, shift), together with
+        the per-feature mean, std, min, max and L2 norm (after the log transform) for reference.
+    '''
+    if method not in methods:
+        raise Exception(f'Invalid method, choose from {methods}!')
+    if any(feature not in feature_names for feature in log_features):
+        raise Exception(f'Log-transformed features must be among {feature_names}!')
+
+    num_features = x.size(1)
+    log_mask = torch.zeros(num_features, dtype = torch.bool)
+    log_mask[[feature_names.index(feature) for feature in log_features]] = True
+
+    # Statistics in double precision, over the transformed features
+    x = transform_log(x.double(), log_mask)
+    mean, std = x.mean(dim = 0), x.std(dim = 0)
+    x_min, x_max = x.min(dim = 0).values, x.max(dim = 0).values
+    norm = x.norm(dim = 0)
+
+    # Constant columns are only shifted (standard, minmax) or left as they are (l2)
+    if method == 'standard':
+        scale, shift = 1 / torch.where(std > 0, std, 1.0), -mean
+    elif method == 'minmax':
+        scale, shift = 1 / torch.where(x_max > x_min, x_max - x_min, 1.0), -x_min
+    else:
+        scale, shift = 1 / torch.where(norm > 0, norm, 1.0), torch.zeros(num_features, dtype = x.dtype)
+    # x * scale + shift, i.e. the shift is applied after scaling
+    shift = shift * scale
+
+    if not one_hot:
+        scale[len(feature_names):], shift[len(feature_names):] = 1.0, 0.0
+
+    return {'method': method, 'feature_names': feature_names, 'log_features': list(log_features), 'one_hot': one_hot,
+            'num_nodes': x.size(0), 'log_mask': log_mask, 'scale': scale.float(), 'shift': shift.float(),
+            'mean': mean.float(), 'std': std.float(), 'min': x_min.float(), 'max': x_max.float(), 'norm': norm.float()}
+
+def transform_log(x, log_mask):
+    '''
+    Parameters
+    ----------
+    x : torch.Tensor
+    log_mask : torch.Tensor of bool
+    Returns
+    -------
+    x : torch.Tensor
+    Applies log1p to the masked columns (negative values are clipped to 0).
+    '''
+    if not log_mask.any():
+        return x
+    return torch.where(log_mask, torch.log1p(x.clamp(min = 0)), x)
+
+def normalize_features(x, stats):
+    '''
+    Parameters
+    ----------
+    x : torch.Tensor
+    stats : dict
+        Output of get_feature_statistics (or load_feature_statistics).
+    Returns
+    -------
+    x : torch.Tensor
+    Applies the stored normalization: the log transform and the fused affine map x * scale + shift.
+    '''
+    if x.size(1) != stats['scale'].size(0):
+        raise Exception(f"The statistics were computed for {stats['scale'].size(0)} features, not {x.size(1)}!")
+    return torch.addcmul(stats['shift'], transform_log(x, stats['log_mask']), stats['scale'])
+
+def get_collection_features(args):
+    '''
+    Parameters
+    ----------
+    args : dict
+        Training configuration.
+    Returns
+    -------
+    x : torch.Tensor
+    Stacks the node features of all the graphs used for training (see dataset.get_training_graphs);
+    with the collated container, these are read in one go.
+    '''
+    if args.get('dataset_root', None) is not None:
+        return dataset.get_dataset(args)._data.x
+    return torch.cat([from_networkx(nx.read_gml(file)).x for file, _ in dataset.get_training_graphs(args)])
+
+def save_feature_statistics(stats, file):
+    '''
+    Parameters
+    ----------
+    stats : dict
+    file : str
+    Returns
+    -------
+    None
+    '''
+    torch.save(stats, file)
+
+def load_feature_statistics(file):
+    '''
+    Parameters
+    ----------
+    file : str
+    Returns
+    -------
+    stats : dict
+    '''
+    if not os.path.exists(file):
+        raise Exception(f'No feature statistics at {file}, compute them with get_feature_statistics first!')
+    return torch.load(file)
+
+def get_normalizer(args):
+    '''
+    Parameters
+    ----------
+    args : dict
+        Training configuration; feature_stats is the file of the stored statistics (or None).
+    Returns
+    -------
+    normalize : callable
+    Produces the feature normalization used when loading a graph: the stored statistics if args['feature_stats'] is set,
+    otherwise the per-graph column normalization (F.normalize along the nodes).
+    '''
+    if args.get('feature_stats', None) is None:
+        return lambda x: F.normalize(x, dim = 0)
+    stats = load_feature_statistics(args['feature_stats'])
+    return lambda x: normalize_features(x, stats)
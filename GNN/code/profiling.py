@@ -0,0 +1,117 @@
+import sys
+import time
+from contextlib import contextmanager, nullcontext
+
+import torch
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+class TrainingProfiler():
+    '''
+    Records wall time per phase, throughput and resource usage for one (dataset, model) job.
+    Phases can be nested (e.g. 'forward' within 'train'): the time of a phase includes that of its sub-phases.
+    '''
+
+    def __init__(self, job):
+        self.job = job
+        self.phase_times = dict()
+        self.child_times = dict()
+        self.stack = []
+        self.num_epochs = 0
+        self.start_time = time.perf_counter()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        self.stack.append(name)
+        try:
+            yield
+        finally:
+            # Make sure queued GPU kernels are accounted to the right phase
+            if torch.cuda.is_available():
+                torch.cuda.synchronize()
+            seconds = time.perf_counter() - start
+            self.stack.pop()
+            self.phase_times[name] = self.phase_times.get(name, 0.0) + seconds
+            if len(self.stack) > 0:
+                parent = self.stack[-1]
+                self.child_times[parent] = self.child_times.get(parent, 0.0) + seconds
+
+    def add_epoch(self):
+        self.num_epochs += 1
+
+    def summary(self):
+        '''
+        Returns
+        -------
+        summary : dict
+        Produces a flat dict of profiling metrics for the job. Leaf phases are reported as profile_time_<phase>;
+        phases with sub-phases as profile_inclusive_time_<phase>, with the time outside their sub-phases as profile_time_<phase>_other,
+        so that the profile_time_ entries do not overlap: they add up to profile_time_phases, and profile_share_ is their share of it.
+        '''
+        exclusive = dict()
+        summary = dict()
+        for name, seconds in self.phase_times.items():
+            if name in self.child_times:
+                summary[f'profile_inclusive_time_{name}'] = seconds
+                exclusive[f'{name}_other'] = max(seconds - self.child_times[name], 0.0)
+            else:
+                exclusive[name] = seconds
+        phases_time = sum(exclusive.values())
+        for name, seconds in exclusive.items():
+            summary[f'profile_time_{name}'] = seconds
+            summary[f'profile_share_{name}'] = seconds / phases_time if phases_time > 0 else 0.0
+        summary['profile_time_phases'] = phases_time
+        summary['profile_time_total'] = time.perf_counter() - self.start_time
+        epoch_time = self.phase_times.get('train', 0.0) + self.phase_times.get('test', 0.0)
+        summary['profile_epochs_per_sec'] = self.num_epochs / epoch_time if epoch_time > 0 else 0.0
+        summary['profile_peak_rss_mb'] = get_peak_rss_mb()
+        summary['profile_torch_threads'] = torch.get_num_threads()
+        summary['profile_torch_interop_threads'] = torch.get_num_interop_threads()
+        return summary
+
+def phase(profiler, name):
+    '''
+    Parameters
+    ----------
+    profiler : TrainingProfiler or None
+    name : str
+    Returns
+    -------
+    context manager
+    Times the enclosed block if profiling is enabled, otherwise does nothing.
+    '''
+    if profiler is None:
+        return nullcontext()
+    return profiler.phase(name)
+
+def get_peak_rss_mb():
+    '''
+    Returns
+    -------
+    peak_rss : float
+    Retrieves the peak resident set size of the current process in MB (NaN if unavailable).
+    '''
+    if resource is None:
+        return float('nan')
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes on Linux
+    if sys.platform == 'darwin':
+        return peak_rss / 2**20
+    return peak_rss / 2**10
+
+def get_torch_profiler():
+    '''
+    Returns
+    -------
+    prof : torch.profiler.profile
+    Creates a torch profiler recording CPU (and CUDA, if available) activity.
+    '''
+    activities = [torch.profiler.ProfilerActivity.CPU]
+    if torch.cuda.is_available():
+        activities.append(torch.profiler.ProfilerActivity.CUDA)
+    return torch.profiler.profile(activities = activities, record_shapes = True, profile_memory = True)
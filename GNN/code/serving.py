@@ -0,0 +1,422 @@
+import json
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import torch
+
+import checkpoints
+
+# Local HTTP service answering link-prediction queries with the checkpointed models (see checkpoints.py).
+# Models are loaded lazily into an LRU cache keyed by (drug, period, model), which also keeps their node embeddings z,
+# so that a query is only a lookup in z and the inner product decoder. Requests are queued to a single worker thread,
+# which takes every request waiting (up to max_batch, after waiting at most max_wait_ms for more to arrive) and answers
+# all the pair scores of a model with one decoder call and all its top-k queries with one matrix product.
+#
+# Endpoints (JSON bodies; countries are given by name):
+#   POST /score        {"drug", "period", "model", "u", "v"}                      -> {"score"}
+#   POST /topk         {"drug", "period", "model", "u", "k", "exclude_known"}    -> {"neighbors": [{"country", "score"}, ...]}
+#   POST /batch_score  {"drug", "period", "model", "pairs": [[u, v], ...]}        -> {"scores"}
+#   GET  /models, /metrics, /health
+
+class ModelCache():
+    '''
+    Parameters
+    ----------
+    checkpoint_files : dict
+        {(drug, period, model_name): file}, e.g. from checkpoints.list_checkpoints.
+    capacity : int, optional
+        Number of models kept in memory. The default is 8.
+    LRU cache of the loaded models and their node embeddings.
+    '''
+
+    def __init__(self, checkpoint_files, capacity = 8):
+        if capacity < 1:
+            raise Exception('The cache must hold at least one model!')
+        self.checkpoint_files = checkpoint_files
+        self.capacity = capacity
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'load_seconds': 0.0}
+
+    def load(self, key):
+        '''
+        Parameters
+        ----------
+        key : tuple
+        Returns
+        -------
+        entry : dict
+        The model, its embeddings z, the node index of every country and the adjacency of the training edges.
+        '''
+        if key not in self.checkpoint_files:
+            raise KeyError(f'No checkpoint for {key}!')
+        model, checkpoint = checkpoints.load_checkpoint(self.checkpoint_files[key])
+        with torch.no_grad():
+            z = model.encode(checkpoint['x'], checkpoint['edge_index'])
+        num_nodes = z.size(0)
+        adjacency = torch.zeros(num_nodes, num_nodes, dtype = torch.bool)
+        adjacency[checkpoint['edge_index'][0], checkpoint['edge_index'][1]] = True
+        return {'model': model, 'z': z, 'countries': checkpoint['countries'],
+                'index': {country: i for i, country in enumerate(checkpoint['countries'])}, 'adjacency': adjacency}
+
+    def get(self, key):
+        '''
+        Parameters
+        ----------
+        key : tuple
+            (drug, period, model_name).
+        Returns
+        -------
+        entry : dict
+        Returns the cached entry, loading it (and evicting the least recently used one) on a miss.
+        '''
+        with self.lock:
+            if key in self.entries:
+                self.stats['hits'] += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+            self.stats['misses'] += 1
+            start = time.perf_counter()
+            entry = self.load(key)
+            self.stats['load_seconds'] += time.perf_counter() - start
+            self.entries[key] = entry
+            if len(self.entries) > self.capacity:
+                self.entries.popitem(last = False)
+                self.stats['evictions'] += 1
+            return entry
+
+    def keys(self):
+        with self.lock:
+            return list(self.entries.keys())
+
+class ServingMetrics():
+    '''
+    Parameters
+    ----------
+    window : int, optional
+        Number of recent requests kept for the latency percentiles and the recent throughput. The default is 10000.
+    Thread-safe request counters, latencies and batch sizes.
+    '''
+
+    def __init__(self, window = 10000):
+        self.lock = threading.Lock()
+        self.start = time.time()
+        self.requests = {'score': 0, 'topk': 0, 'batch_score': 0}
+        self.errors = 0
+        self.pairs = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.max_batch = 0
+        self.latencies = deque(maxlen = window)
+        self.finished = deque(maxlen = window)
+
+    def add_request(self, op, seconds, num_pairs = 0, error = False):
+        with self.lock:
+            self.requests[op] += 1
+            self.errors += int(error)
+            self.pairs += num_pairs
+            self.latencies.append(seconds)
+            self.finished.append(time.time())
+
+    def add_batch(self, size):
+        with self.lock:
+            self.batches += 1
+            self.batched_requests += size
+            self.max_batch = max(self.max_batch, size)
+
+    def summary(self):
+        '''
+        Returns
+        -------
+        summary : dict
+        Request counts, throughput (over the whole uptime and the last minute), latency mean and percentiles (ms) and batch sizes.
+        '''
+        with self.lock:
+            now = time.time()
+            uptime = now - self.start
+            total = sum(self.requests.values())
+            latencies = torch.tensor(list(self.latencies), dtype = torch.float64) * 1000
+            recent = sum(1 for t in self.finished if now - t <= 60)
+            summary = {'uptime_seconds': uptime, 'requests': dict(self.requests), 'total_requests': total, 'errors': self.errors,
+                       'pairs_scored': self.pairs, 'throughput_rps': total / uptime if uptime > 0 else 0.0,
+                       'throughput_rps_last_minute': recent / min(60.0, uptime) if uptime > 0 else 0.0,
+                       'batches': self.batches, 'mean_batch_size': self.batched_requests / self.batches if self.batches > 0 else 0.0,
+                       'max_batch_size': self.max_batch}
+        if latencies.numel() > 0:
+            p50, p95, p99 = torch.quantile(latencies, torch.tensor([0.5, 0.95, 0.99], dtype = torch.float64)).tolist()
+            summary.update({'latency_ms_mean': latencies.mean().item(), 'latency_ms_p50': p50, 'latency_ms_p95': p95,
+                            'latency_ms_p99': p99, 'latency_ms_max': latencies.max().item()})
+        return summary
+
+class ScoringService():
+    '''
+    Parameters
+    ----------
+    checkpoint_files : dict
+        {(drug, period, model_name): file}.
+    cache_size : int, optional
+        See ModelCache.
+    max_batch : int, optional
+        Maximum number of requests answered together. The default is 256.
+    max_wait_ms : float, optional
+        How long the worker waits for more requests after the first one of a batch. The default is 2.
+    timeout : float, optional
+        Seconds a request waits for its result. The default is 30.
+    Micro-batching front end of the models: score, topk and batch_score can be called from any number of threads.
+    '''
+
+    def __init__(self, checkpoint_files, cache_size = 8, max_batch = 256, max_wait_ms = 2.0, timeout = 30.0):
+        self.cache = ModelCache(checkpoint_files, capacity = cache_size)
+        self.metrics = ServingMetrics()
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.timeout = timeout
+        self.requests = queue.Queue()
+        self.worker = threading.Thread(target = self.run, daemon = True)
+        self.worker.start()
+
+    def submit(self, op, key, payload):
+        # key is normalized here so that e.g. period 2010 and '2010' share a cache entry
+        future = Future()
+        self.requests.put((op, (str(key[0]), str(key[1]), str(key[2])), payload, future))
+        return future
+
+    def call(self, op, key, payload, num_pairs = 0):
+        start = time.perf_counter()
+        try:
+            result = self.submit(op, key, payload).result(timeout = self.timeout)
+        except Exception:
+            self.metrics.add_request(op, time.perf_counter() - start, error = True)
+            raise
+        self.metrics.add_request(op, time.perf_counter() - start, num_pairs = num_pairs)
+        return result
+
+    def score(self, key, u, v):
+        '''
+        Parameters
+        ----------
+        key : tuple
+            (drug, period, model_name).
+        u : str
+        v : str
+        Returns
+        -------
+        score : float
+            Predicted probability of the edge u -> v.
+        '''
+        return self.call('score', key, [(u, v)], num_pairs = 1)[0]
+
+    def batch_score(self, key, pairs):
+        '''
+        Parameters
+        ----------
+        key : tuple
+        pairs : list of (str, str)
+        Returns
+        -------
+        scores : list of float
+        '''
+        return self.call('batch_score', key, [tuple(pair) for pair in pairs], num_pairs = len(pairs))
+
+    def topk(self, key, u, k = 10, exclude_known = False):
+        '''
+        Parameters
+        ----------
+        key : tuple
+        u : str
+        k : int, optional
+        exclude_known : bool, optional
+            If True, the training edges of u are left out, so that only new links are predicted.
+        Returns
+        -------
+        neighbors : list of (str, float)
+            The k countries with the highest predicted probability of an edge from u (u itself excluded), best first.
+        '''
+        if int(k) < 1:
+            raise Exception('k must be at least 1!')
+        return self.call('topk', key, (u, int(k), bool(exclude_known)))
+
+    def run(self):
+        while True:
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                try:
+                    batch.append(self.requests.get(timeout = remaining) if remaining > 0 else self.requests.get_nowait())
+                except queue.Empty:
+                    break
+            self.metrics.add_batch(len(batch))
+
+            by_key = dict()
+            for request in batch:
+                by_key.setdefault(request[1], []).append(request)
+            for key, requests in by_key.items():
+                try:
+                    entry = self.cache.get(key)
+                except Exception as e:
+                    for _, _, _, future in requests:
+                        future.set_exception(e)
+                    continue
+                try:
+                    self.answer_scores(entry, [request for request in requests if request[0] != 'topk'])
+                    self.answer_topk(entry, [request for request in requests if request[0] == 'topk'])
+                except Exception as e:
+                    # The worker keeps running; only the requests of the failed batch get the error
+                    for _, _, _, future in requests:
+                        if not future.done():
+                            future.set_exception(e)
+
+    def resolve(self, entry, countries):
+        missing = [country for country in countries if country not in entry['index']]
+        if len(missing) > 0:
+            raise KeyError(f'Countries not in the network: {missing}')
+        return [entry['index'][country] for country in countries]
+
+    def answer_scores(self, entry, requests):
+        # All the pairs of all the requests are decoded at once, then split back
+        valid, u, v = [], [], []
+        for request in requests:
+            _, _, pairs, future = request
+            try:
+                u_ids, v_ids = self.resolve(entry, [p[0] for p in pairs]), self.resolve(entry, [p[1] for p in pairs])
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            valid.append((future, len(pairs)))
+            u += u_ids
+            v += v_ids
+        if len(valid) == 0:
+            return
+        with torch.no_grad():
+            scores = entry['model'].decoder(entry['z'], torch.tensor([u, v], dtype = torch.long), sigmoid = True).tolist()
+        offset = 0
+        for future, num_pairs in valid:
+            future.set_result(scores[offset:offset + num_pairs])
+            offset += num_pairs
+
+    def answer_topk(self, entry, requests):
+        # One (queries x nodes) product for all the queries, with u itself (and optionally its known edges) masked out
+        valid, u, exclude = [], [], []
+        for request in requests:
+            _, _, (country, k, exclude_known), future = request
+            try:
+                u += self.resolve(entry, [country])
+            except Exception as e:
+                future.set_exception(e)
+                continue
+            valid.append((future, k))
+            exclude.append(exclude_known)
+        if len(valid) == 0:
+            return
+        z, u = entry['z'], torch.tensor(u, dtype = torch.long)
+        with torch.no_grad():
+            logits = z[u] @ z.T
+        mask = entry['adjacency'][u] & torch.tensor(exclude).unsqueeze(1)
+        mask[torch.arange(u.size(0)), u] = True
+        logits = logits.masked_fill(mask, float('-inf'))
+        available = (~mask).sum(dim = 1).tolist()
+        top = logits.topk(min(max(k for _, k in valid), z.size(0)), dim = 1)
+        scores, ids = torch.sigmoid(top.values).tolist(), top.indices.tolist()
+        for i, (future, k) in enumerate(valid):
+            k = min(k, available[i])
+            future.set_result([(entry['countries'][j], score) for j, score in zip(ids[i][:k], scores[i][:k])])
+
+class ScoringHandler(BaseHTTPRequestHandler):
+
+    def send_json(self, status, body):
+        content = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def do_GET(self):
+        service = self.server.service
+        if self.path == '/health':
+            self.send_json(200, {'status': 'ok'})
+        elif self.path == '/metrics':
+            summary = service.metrics.summary()
+            summary['cache'] = dict(service.cache.stats, capacity = service.cache.capacity, loaded = [list(key) for key in service.cache.keys()])
+            self.send_json(200, summary)
+        elif self.path == '/models':
+            self.send_json(200, {'models': [list(key) for key in service.cache.checkpoint_files.keys()]})
+        else:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+
+    def do_POST(self):
+        service = self.server.service
+        if self.path not in ['/score', '/topk', '/batch_score']:
+            self.send_json(404, {'error': f'Unknown path {self.path}'})
+            return
+        try:
+            body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+            key = (body['drug'], body['period'], body['model'])
+            if self.path == '/score':
+                u, v = body['u'], body['v']
+            elif self.path == '/topk':
+                u, k, exclude_known = body['u'], body.get('k', 10), body.get('exclude_known', False)
+            else:
+                pairs = body['pairs']
+        except KeyError as e:
+            self.send_json(400, {'error': f'Missing field {e}'})
+            return
+        except Exception as e:
+            self.send_json(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+
+        # Unknown models and countries are KeyErrors of the service
+        try:
+            if self.path == '/score':
+                result = {'score': service.score(key, u, v)}
+            elif self.path == '/topk':
+                result = {'neighbors': [{'country': country, 'score': score} for country, score in service.topk(key, u, k = k, exclude_known = exclude_known)]}
+            else:
+                result = {'scores': service.batch_score(key, pairs)}
+        except KeyError as e:
+            self.send_json(404, {'error': e.args[0]})
+            return
+        except Exception as e:
+            self.send_json(400, {'error': f'{type(e).__name__}: {e}'})
+            return
+        self.send_json(200, result)
+
+    def log_message(self, format, *args):
+        # Requests are counted in /metrics instead of being logged one by one
+        pass
+
+class ScoringServer(ThreadingHTTPServer):
+    # One thread per connection; the larger backlog keeps bursts of concurrent clients from being refused
+    daemon_threads = True
+    request_queue_size = 128
+
+def get_server(log_to, run_id = None, host = '127.0.0.1', port = 8000, cache_size = 8, max_batch = 256, max_wait_ms = 2.0):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str, optional
+        Run whose checkpoints are served; defaults to the latest run with checkpoints.
+    host : str, optional
+    port : int, optional
+        0 picks a free port (see server.server_address).
+    cache_size : int, optional
+    max_batch : int, optional
+    max_wait_ms : float, optional
+        See ScoringService.
+    Returns
+    -------
+    server : ScoringServer
+    The HTTP server (not started: call server.serve_forever()), with the ScoringService as server.service.
+    '''
+    if run_id is None:
+        run_id = checkpoints.get_latest_checkpoints_run(log_to)
+    server = ScoringServer((host, port), ScoringHandler)
+    server.run_id = run_id
+    server.service = ScoringService(checkpoints.list_checkpoints(log_to, run_id), cache_size = cache_size, max_batch = max_batch, max_wait_ms = max_wait_ms)
+    return server
@@ -1,58 +1,154 @@
 import networkx as nx
+from contextlib import nullcontext
 
 import torch
-import torch.nn.functional as F
 
 import torch_geometric.nn as pyg_nn
+from torch_geometric.data import Data
 from torch_geometric.utils import train_test_split_edges
 from torch_geometric.utils.convert import from_networkx
 
 import utils
+import dataset
+import normalization
+import embeddings
+import checkpoints
+import profiling
+import metrics
 from models import GAE_Encoder, VGAE_Encoder
 
 import warnings
 warnings.filterwarnings('ignore')
 
-import importlib
-importlib.reload(utils)
-
-def train(epoch, model, optimizer, x, train_pos_edge_index):
+def train(epoch, model, optimizer, x, train_pos_edge_index, profiler = None):
     model.train()
     optimizer.zero_grad()
-    z = model.encode(x, train_pos_edge_index)
-    loss = model.recon_loss(z, train_pos_edge_index)
-    loss.backward()
-    optimizer.step()
+    with profiling.phase(profiler, 'forward'):
+        z = model.encode(x, train_pos_edge_index)
+        loss = model.recon_loss(z, train_pos_edge_index)
+    with profiling.phase(profiler, 'backward'):
+        loss.backward()
+        optimizer.step()
     return loss.item()
 
-def test(model, x, train_pos_edge_index, pos_edge_index, neg_edge_index):
+def test(model, x, train_pos_edge_index, pos_edge_index, neg_edge_index, profiler = None):
     model.eval()
-    with torch.no_grad():
-        z = model.encode(x, train_pos_edge_index)
-    return model.test(z, pos_edge_index, neg_edge_index)
+    with profiling.phase(profiler, 'test_encode'):
+        with torch.no_grad():
+            z = model.encode(x, train_pos_edge_index)
+    with profiling.phase(profiler, 'test_metrics'):
+        pos_scores, neg_scores = metrics.test_scores(model, z, pos_edge_index, neg_edge_index)
+        auc, ap = metrics.auc_ap(pos_scores, neg_scores)
+        return auc.item(), ap.item()
+
+def get_job(pyg_model, dataset_path, args, run_id = None, data = None):
+    '''
+    Parameters
+    ----------
+    pyg_model : torch_geometric.nn.GAE or torch_geometric.nn.VGAE
+    dataset_path : str or None
+    args : dict
+    run_id : str, optional
+        A new run is started if None.
+    data : torch_geometric.data.Data, optional
+        A graph of the collated container (see dataset.DrugNetworks), which replaces the .gml file.
+    Returns
+    -------
+    (model_name, drug, period, run_id, logger, store_path) : tuple
+    Produces the strings for reporting, an empty model logger and the path of the metrics store of a training job.
+    '''
+    if data is None:
+        model_name, drug, period = utils.get_model_info(pyg_model, dataset_path)
+    else:
+        model_name, drug, period = utils.get_model_name(pyg_model), data.drug, data.period
+    if run_id is None:
+        run_id = utils.get_run_id()
+    return model_name, drug, period, run_id, utils.get_model_logger(drug, period, model_name), utils.get_metrics_store_path(args['log_to'])
+
+def prepare_data(dataset_path, args, data = None, profiler = None):
+    '''
+    Parameters
+    ----------
+    dataset_path : str or None
+    args : dict
+    data : torch_geometric.data.Data, optional
+        A graph of the collated container, which replaces the .gml file.
+    profiler : profiling.TrainingProfiler, optional
+    Returns
+    -------
+    (data, countries) : tuple
+    Reads a graph (from its .gml file or the container) with normalized features, ready for train_test_split_edges, and the name of every node.
+    '''
+    # Read data from file and covert to pyg dataset; graphs of the container are copied, as the split modifies them
+    if data is None:
+        with profiling.phase(profiler, 'read_gml'):
+            G = nx.read_gml(dataset_path)
+        with profiling.phase(profiler, 'from_networkx'):
+            data = from_networkx(G)
+        countries = list(G.nodes)
+    else:
+        countries = data.countries
+        data = Data(x = data.x, edge_index = data.edge_index)
+
+    # Important: Normalize the features, per graph or with the statistics of the whole collection (see normalization.get_normalizer)
+    with profiling.phase(profiler, 'normalize'):
+        data.x = normalization.get_normalizer(args)(data.x)
 
-def train_test_model(pyg_model, encoder, dataset_path, args, verbose = False):
+    data.train_mask = data.val_mask = data.test_mask = data.y = None
+    return data, countries
+
+def finalize_model(model, x, train_pos_edge_index, countries, args, run_id, drug, period, model_name):
+    '''
+    Parameters
+    ----------
+    model : torch_geometric.nn.GAE or torch_geometric.nn.VGAE
+        Trained model.
+    x : torch.Tensor
+        Normalized node features.
+    train_pos_edge_index : torch.Tensor
+        Training edges.
+    countries : list of str
+    args : dict
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    Returns
+    -------
+    None
+    Exports the node embeddings (if args['export_embeddings']) and saves the checkpoint (if args['save_checkpoints']) of a trained model.
+    '''
+    # Export the node embeddings of the trained encoder (on the full training graph), keyed by country ID
+    if args.get('export_embeddings', False):
+        model.eval()
+        with torch.no_grad():
+            z = model.encode(x, train_pos_edge_index)
+        embeddings.export_embeddings(z, countries, embeddings.get_country_vocabulary(args), args['log_to'], run_id, drug, period, model_name)
+
+    # Save the trained model with the graph it encodes, e.g. for serving.py
+    if args.get('save_checkpoints', False):
+        checkpoints.save_checkpoint(model, x, train_pos_edge_index, countries, args['log_to'], run_id, drug, period, model_name)
+
+def train_test_model(pyg_model, encoder, dataset_path, args, run_id = None, verbose = False, data = None):
     
-    # Get srings for reporting
-    model_name, drug, period = utils.get_model_info(pyg_model, dataset_path)
+    # Get strings for reporting, the model logger and the metrics store, which is appended to after every epoch
+    model_name, drug, period, run_id, logger, store_path = get_job(pyg_model, dataset_path, args, run_id = run_id, data = data)
 
-    # Initialize a model logger
-    logger = utils.get_model_logger(drug, period, model_name)
+    # Optional instrumentation: per-phase timings and, for one chosen job, a torch.profiler trace
+    job = f'{drug}_{period}_{model_name}'
+    profiler = profiling.TrainingProfiler(job) if args.get('profile', False) else None
+    trace_job = args.get('trace_job', None) == job
     
-    # Read data from file and covert to pyg dataset
-    G = nx.read_gml(dataset_path)
-    data = from_networkx(G)
-
-    # Important: Normalize the features by row
-    data.x = F.normalize(data.x, dim = 0)
+    # Read and normalize the graph
+    data, countries = prepare_data(dataset_path, args, data = data, profiler = profiler)
 
     # Set the parameters
     channels = args['hidden1_dim']
     dev = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
     # Encoder written by us; decoder is the default one (inner product)
     model = pyg_model(encoder(data.num_features, channels)).to(dev)
-    data.train_mask = data.val_mask = data.test_mask = data.y = None
-    data = train_test_split_edges(data)
+    with profiling.phase(profiler, 'split'):
+        data = train_test_split_edges(data)
     x, train_pos_edge_index = data.x.to(dev), data.train_pos_edge_index.to(dev)
     optimizer = torch.optim.Adam(model.parameters(), lr = args['learning_rate'])
     num_epochs = args['num_epochs']
@@ -60,29 +156,58 @@ def train_test_model(pyg_model, encoder, dataset_path, args, verbose = False):
     if verbose:
         print(f'Began training {model_name} on {drug} ({period})...')
 
-    for epoch in range(0, num_epochs):
-        train_loss = train(epoch, model, optimizer, x, train_pos_edge_index)
-        auc, ap = test(model, x, train_pos_edge_index, data.test_pos_edge_index, data.test_neg_edge_index)
-        utils.add_to_model_logger(logger, drug, period, model_name, train_loss, auc, ap)
-
-        if verbose:
-            print('Epoch: {}, train loss: {:.4f}, AUC: {:.4f}, AP: {:.4f}'.format(epoch, train_loss, auc, ap))
+    torch_prof = profiling.get_torch_profiler() if trace_job else nullcontext()
+    with torch_prof:
+        for epoch in range(0, num_epochs):
+            with profiling.phase(profiler, 'train'):
+                train_loss = train(epoch, model, optimizer, x, train_pos_edge_index, profiler = profiler)
+            with profiling.phase(profiler, 'test'):
+                auc, ap = test(model, x, train_pos_edge_index, data.test_pos_edge_index, data.test_neg_edge_index, profiler = profiler)
+            if profiler is not None:
+                profiler.add_epoch()
+            utils.add_to_model_logger(logger, drug, period, model_name, train_loss, auc, ap)
+            utils.add_to_metrics_store(store_path, run_id, drug, period, model_name, epoch, train_loss, auc, ap)
+
+            if verbose:
+                print('Epoch: {}, train loss: {:.4f}, AUC: {:.4f}, AP: {:.4f}'.format(epoch, train_loss, auc, ap))
+
+    # Write the trace next to the logs so that it can be opened in chrome://tracing or TensorBoard
+    if trace_job:
+        torch_prof.export_chrome_trace(args['log_to'] + '/' + f'trace_{run_id}_{job}.json')
+
+    # Embeddings and checkpoint
+    finalize_model(model, x, train_pos_edge_index, countries, args, run_id, drug, period, model_name)
+
+    # Add the profiling summary to the run's log
+    if profiler is not None:
+        utils.add_summary_to_metrics_store(store_path, run_id, drug, period, model_name, profiler.summary())
     
     if verbose:
         print(f"Training and testing complete. Best AUC: {max(logger[drug][period][model_name]['test']['AUC'])}")
     
     return model, logger
 
-def train_test_all_models(args, verbose = False):
-
-    # Get the log path
+def train_test_all_graphs(train_test_function, args, verbose = False):
+    '''
+    Parameters
+    ----------
+    train_test_function : callable
+        train_test_model, or the minibatch/ensemble equivalent.
+    args : dict
+    verbose : bool, optional
+    Returns
+    -------
+    model_dict : dict
+    Trains GAE and VGAE models on every graph (see dataset.get_training_graphs) within a single run; the metrics are in the metrics store.
+    '''
+    # Get the log path and identify the run
     log_to = args['log_to']
+    run_id = utils.get_run_id()
 
-    # Obtain the list of dataset files to train on
-    path_list = utils.get_path_list(args['data_path'])
+    # Obtain the datasets to train on: .gml files, or the graphs of the collated container if dataset_root is set
+    graphs = dataset.get_training_graphs(args)
 
-    # Initiliaze the master logger and the dict of models
-    master_logger = dict()
+    # Initiliaze the dict of models
     model_dict = dict()
 
     if verbose:
@@ -90,28 +215,19 @@ def train_test_all_models(args, verbose = False):
         print('Start loop over all datasets...')
 
     # Iterate over all datasets
-    for file in path_list:
-        # GAE model
-        model, logger = train_test_model(pyg_model = pyg_nn.GAE, encoder = GAE_Encoder, dataset_path = file, args = args, verbose = verbose)
-        drug, period, model_name = utils.get_model_info_from_logger(logger)
-        utils.merge_nested_dicts(master_logger, logger)
-        utils.add_to_model_dict(model_dict, drug, period, model_name, model)
-
-        # VGAE model
-        model, logger = train_test_model(pyg_model = pyg_nn.VGAE, encoder = VGAE_Encoder, dataset_path = file, args = args, verbose = verbose)
-        drug, period, model_name = utils.get_model_info_from_logger(logger)
-        utils.merge_nested_dicts(master_logger, logger)
-        utils.add_to_model_dict(model_dict, drug, period, model_name, model)
+    for file, data in graphs:
+        for pyg_model, encoder in [(pyg_nn.GAE, GAE_Encoder), (pyg_nn.VGAE, VGAE_Encoder)]:
+            model, logger = train_test_function(pyg_model = pyg_model, encoder = encoder, dataset_path = file, args = args, run_id = run_id, verbose = verbose, data = data)
+            drug, period, model_name = utils.get_model_info_from_logger(logger)
+            utils.add_to_model_dict(model_dict, drug, period, model_name, model)
     
     if verbose:
         print('Loop completed.')
-        print('Logging to file...')
-    
-    # Dump log to json
-    utils.dump_to_json(master_logger, log_to)
+        print(f'Metrics of run {run_id} logged to {utils.get_metrics_store_path(log_to)}.')
 
-    if verbose:
-        print('Logging completed.')
+    return model_dict
+
+def train_test_all_models(args, verbose = False):
 
     # Return the models
-    return model_dict
\ No newline at end of file
+    return train_test_all_graphs(train_test_model, args, verbose = verbose)
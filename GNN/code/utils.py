@@ -2,6 +2,8 @@ import os
 import json
 import datetime 
 
+# pandas is imported lazily by the functions returning dataframes, so that quick jobs (e.g. the cli) start fast
+
 def get_path_list(base_path):
     '''
     Parameters
@@ -63,6 +65,26 @@ def add_to_model_logger(logger, drug, period, model_name, train_loss, auc, ap):
     logger[drug][period][model_name]['test']['AUC'].append(auc)
     logger[drug][period][model_name]['test']['AP'].append(ap)
 
+def add_spread_to_model_logger(logger, drug, period, model_name, spread):
+    '''
+    Parameters
+    ----------
+    logger : dict
+    drug : str
+    period : str
+    model_name : str
+    spread : dict
+        {metric name: value}, e.g. {'test_AUC_std': 0.02}; the split is the part of the name before the first underscore.
+    Returns
+    -------
+    None
+    Adds the spread of a multi-seed ensemble's metrics to logger for one epoch.
+    '''
+
+    for metric, value in spread.items():
+        split, key = metric.split('_', 1)
+        logger[drug][period][model_name][split].setdefault(key, []).append(value)
+
 def get_model_info(pyg_model, dataset_path):
     '''
     Parameters
@@ -74,10 +96,35 @@ def get_model_info(pyg_model, dataset_path):
     (model_name, drug, period) : tuple
     Retrieves information about the drug, period, and model type.
     '''
-    model_name = str(pyg_model).split(".")[-1][:-2]
-    drug = dataset_path.split("/")[-1].split('_')[0]
-    period = 'aggregate' if 'aggregate' in dataset_path.split("/")[-1].split('_') else dataset_path.split("/")[-1].split('_')[1].split('.')[0]
-    return model_name, drug, period
+    drug, period = get_dataset_info(dataset_path)
+    return get_model_name(pyg_model), drug, period
+
+def get_model_name(pyg_model):
+    '''
+    Parameters
+    ----------
+    pyg_model : pyg_nn
+    Returns
+    -------
+    model_name : str
+    Retrieves the model type (e.g. 'GAE') from the model class.
+    '''
+    return str(pyg_model).split(".")[-1][:-2]
+
+def get_dataset_info(dataset_path):
+    '''
+    Parameters
+    ----------
+    dataset_path : str
+    Returns
+    -------
+    (drug, period) : tuple
+    Retrieves the drug and period of a dataset from its file name (e.g. Cocaine_2010.gml or Cocaine_aggregate_2006_2017.gml).
+    '''
+    file_name = dataset_path.split("/")[-1]
+    drug = file_name.split('_')[0]
+    period = 'aggregate' if 'aggregate' in file_name.split('_') else file_name.split('_')[1].split('.')[0]
+    return drug, period
 
 def get_model_info_from_logger(logger):
     '''
@@ -133,16 +180,186 @@ def add_to_model_dict(model_dict, drug, period, model_name, model):
         model_dict[drug][period][model_name] = model
     model_dict[drug][period][model_name] = model
 
-def dump_to_json(master_logger, log_to):
+def get_run_id():
+    '''
+    Returns
+    -------
+    run_id : str
+    Produces a run identifier from the current timestamp, down to the microsecond and followed by the process ID,
+    so that runs started at the same time (e.g. in parallel jobs) do not share the metrics store rows.
+    '''
+    return datetime.datetime.now().strftime("%d-%m-%Y_%H:%M:%S.%f") + f'_{os.getpid()}'
+
+def get_metrics_store_path(log_to):
     '''
     Parameters
     ----------
-    master_logger : dict
     log_to : str
     Returns
     -------
+    store_path : str
+    Retrieves the path of the append-only metrics store shared by all runs.
+    '''
+    return log_to + '/metrics.jsonl'
+
+def append_to_metrics_store(store_path, rows):
+    '''
+    Parameters
+    ----------
+    store_path : str
+    rows : list of dict
+    Returns
+    -------
     None
-    Dumps the master_logger to a .json file.
+    Appends rows to the metrics store (one json object per line) and flushes them to disk immediately.
     '''
-    with open(log_to + '/' + datetime.datetime.now().strftime("%d-%m-%Y_%H:%M:%S") + '.json', 'w') as log_file:
-        json.dump(master_logger, log_file)
\ No newline at end of file
+    with open(store_path, 'a') as store:
+        for row in rows:
+            store.write(json.dumps(row) + '\n')
+        store.flush()
+        os.fsync(store.fileno())
+
+def add_to_metrics_store(store_path, run_id, drug, period, model_name, epoch, train_loss, auc, ap):
+    '''
+    Parameters
+    ----------
+    store_path : str
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    epoch : int
+    train_loss : float
+    auc : float
+    ap : float
+    Returns
+    -------
+    None
+    Streams model training and test metrics for one epoch to the metrics store as (run_id, drug, period, model, epoch, metric, value) rows.
+    '''
+    rows = []
+    for metric, value in [('train_loss', train_loss), ('test_AUC', auc), ('test_AP', ap)]:
+        rows.append({'run_id': run_id, 'drug': drug, 'period': period, 'model': model_name, 
+                     'epoch': epoch, 'metric': metric, 'value': float(value)})
+    append_to_metrics_store(store_path, rows)
+
+def read_metrics_store(log_to):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    Returns
+    -------
+    df_metrics : pd.DataFrame
+    Reads all historical runs from the metrics store into a single long-format dataframe.
+    '''
+    import pandas as pd
+
+    store_path = get_metrics_store_path(log_to)
+    if not os.path.exists(store_path):
+        return pd.DataFrame(columns = ['run_id', 'drug', 'period', 'model', 'epoch', 'metric', 'value'])
+    return pd.read_json(store_path, lines = True, dtype = {'run_id': str, 'drug': str, 'period': str, 'model': str, 'metric': str})
+
+def convert_json_log_to_metrics_store(json_file, log_to):
+    '''
+    Parameters
+    ----------
+    json_file : str
+    log_to : str
+    Returns
+    -------
+    None
+    Migrates a legacy nested-dict .json log into the metrics store, using the file name as run_id.
+    '''
+    run_id = json_file.split('/')[-1].split('.')[0]
+    with open(json_file, 'r') as log_file:
+        master_logger = json.load(log_file)
+
+    # Legacy key names mapped to metric names
+    metric_names = {('train', 'loss'): 'train_loss', ('test', 'AUC'): 'test_AUC', ('test', 'AP'): 'test_AP'}
+
+    rows = []
+    for drug in master_logger.keys():
+        for period in master_logger[drug].keys():
+            for model_name in master_logger[drug][period].keys():
+                for (split, key), metric in metric_names.items():
+                    for epoch, value in enumerate(master_logger[drug][period][model_name][split][key]):
+                        rows.append({'run_id': run_id, 'drug': drug, 'period': period, 'model': model_name, 
+                                     'epoch': epoch, 'metric': metric, 'value': float(value)})
+    append_to_metrics_store(get_metrics_store_path(log_to), rows)
+
+def add_summary_to_metrics_store(store_path, run_id, drug, period, model_name, summary):
+    '''
+    Parameters
+    ----------
+    store_path : str
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    summary : dict
+    Returns
+    -------
+    None
+    Streams run-level metrics (e.g. profiling summaries) to the metrics store; these rows carry no epoch.
+    '''
+    rows = []
+    for metric, value in summary.items():
+        rows.append({'run_id': run_id, 'drug': drug, 'period': period, 'model': model_name, 
+                     'epoch': None, 'metric': metric, 'value': float(value)})
+    append_to_metrics_store(store_path, rows)
+
+def add_spread_to_metrics_store(store_path, run_id, drug, period, model_name, epoch, spread):
+    '''
+    Parameters
+    ----------
+    store_path : str
+    run_id : str
+    drug : str
+    period : str
+    model_name : str
+    epoch : int
+    spread : dict
+    Returns
+    -------
+    None
+    Streams the spread of a multi-seed ensemble's metrics for one epoch to the metrics store.
+    '''
+    rows = []
+    for metric, value in spread.items():
+        rows.append({'run_id': run_id, 'drug': drug, 'period': period, 'model': model_name, 
+                     'epoch': epoch, 'metric': metric, 'value': float(value)})
+    append_to_metrics_store(store_path, rows)
+
+def summarize_metrics_store(log_to, run_id = None):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    run_id : str, optional
+        Only summarize this run; by default all runs are summarized.
+    Returns
+    -------
+    summary : list of dict
+    Produces one row per (run_id, drug, period, model) with the number of epochs, the final train loss and the final and best test AUC/AP.
+    Reads the metrics store line by line without pandas, so that it stays cheap for quick inspection of the logs.
+    '''
+    store_path = get_metrics_store_path(log_to)
+    if not os.path.exists(store_path):
+        return []
+
+    summary = dict()
+    with open(store_path, 'r') as store:
+        for line in store:
+            row = json.loads(line)
+            if (run_id is not None and row['run_id'] != run_id) or row['epoch'] is None:
+                continue
+            key = (row['run_id'], row['drug'], row['period'], row['model'])
+            entry = summary.setdefault(key, {'run_id': key[0], 'drug': key[1], 'period': key[2], 'model': key[3], 'epochs': 0})
+            entry['epochs'] = max(entry['epochs'], row['epoch'] + 1)
+            if row['metric'] == 'train_loss':
+                entry['final_train_loss'] = row['value']
+            elif row['metric'] in ['test_AUC', 'test_AP']:
+                entry['final_' + row['metric']] = row['value']
+                entry['best_' + row['metric']] = max(entry.get('best_' + row['metric'], row['value']), row['value'])
+    return list(summary.values())
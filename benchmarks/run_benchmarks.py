@@ -0,0 +1,213 @@
+
+# Benchmark suite for the data preparation stages and the GNN training loop;
+# Every stage runs on synthetic IDS-shaped data (see data_prep/Synthetic.py) of configurable size;
+# Results are appended to results.jsonl together with the current commit, so that runs can be compared across commits.
+
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+import tempfile
+import subprocess
+
+import numpy as np
+import pandas as pd
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(base_path, '..', 'data_prep'))
+sys.path.insert(0, os.path.join(base_path, '..', 'GNN', 'code'))
+
+import Synthetic
+import Seizures
+import Purity
+import Prevalence
+import Aggregation
+
+# Stages in the order they are run
+stage_list = ['synthetic', 'get_ids_locations', 'get_purity_adjusted_seizures', 'get_drug_network_by_year',
+              'purity_imputation', 'prevalence_imputation', 'get_national_markets_df', 'train_test_model', 'cli_cold_start']
+
+# Quick cli commands whose cold start (a fresh interpreter, including all imports) is tracked
+cli_commands = {'datasets': ['datasets', '--data-path'], 'summarize': ['summarize', '--log-to']}
+
+def get_commit():
+    '''
+    Returns
+    -------
+    commit : str
+    Retrieves the short hash of the current commit ('unknown' outside of a git checkout).
+    '''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd = base_path, stderr = subprocess.DEVNULL).decode().strip()
+    except Exception:
+        return 'unknown'
+
+def write_training_graph(network, file_path, num_features = 33, seed = 0):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    file_path : str
+    num_features : int, optional
+    seed : int, optional
+    Returns
+    -------
+    None
+    Writes a network in the .gml layout of data/pyg_data, with random node features.
+    '''
+    import networkx as nx
+
+    rng = np.random.default_rng(seed)
+    output_network = nx.DiGraph()
+    output_network.add_nodes_from([(node, {'y': node, 'x': list(rng.random(num_features))}) for node in network.nodes])
+    output_network.add_edges_from(network.edges)
+    nx.write_gml(output_network, file_path)
+
+def run_benchmarks(n_rows, n_locations, drug = 'Cocaine', stages = stage_list, num_epochs = 20, seed = 0):
+    '''
+    Parameters
+    ----------
+    n_rows : int
+    n_locations : int
+    drug : str, optional
+    stages : list of str, optional
+    num_epochs : int, optional
+    seed : int, optional
+    Returns
+    -------
+    results : list of dict
+    Times each requested stage on synthetic data of the given size.
+    '''
+    results = []
+    sources_path = tempfile.mkdtemp() + '/'
+
+    def _record(stage, seconds, status = 'ok'):
+        results.append({'stage': stage, 'n_rows': n_rows, 'n_locations': n_locations, 'seconds': seconds, 'status': status})
+        print(f'{stage:40s} {seconds:10.3f}s  {status}')
+
+    def _time(stage, fn):
+        if stage not in stages:
+            return None
+        start = time.perf_counter()
+        try:
+            output = fn()
+            _record(stage, time.perf_counter() - start)
+            return output
+        except Exception as e:
+            _record(stage, time.perf_counter() - start, status = f'failed: {type(e).__name__}: {e}')
+            return None
+
+    # The synthetic data is always needed by the following stages
+    start = time.perf_counter()
+    df_loc, df_ids, sources = Synthetic.get_synthetic_data(n_rows = n_rows, n_locations = n_locations, seed = seed)
+    Synthetic.write_sources(sources, sources_path)
+    if 'synthetic' in stages:
+        _record('synthetic', time.perf_counter() - start)
+
+    locations = _time('get_ids_locations', lambda: Seizures.get_ids_locations(df_ids))
+    if locations is None:
+        locations = Seizures.get_ids_locations(df_ids)
+    countries_list, sub_region_dict, region_dict = locations
+
+    _time('get_purity_adjusted_seizures', lambda: Seizures.get_purity_adjusted_seizures(df_ids, countries_list, sub_region_dict, region_dict,
+                                                                                         purity_file = sources_path + 'Purity.xlsx'))
+
+    networks = _time('get_drug_network_by_year', lambda: Seizures.get_drug_network_by_year(drug, df_ids, markets_file = sources_path + 'Markets.xlsx'))
+
+    _time('purity_imputation', lambda: Purity.get_purity_values(sources['raw_purity'], locations = countries_list,
+                                                                sub_region_dict = sub_region_dict, region_dict = region_dict))
+
+    _time('prevalence_imputation', lambda: Prevalence.get_prevalence_values(sources['raw_prevalence'], countries_list = countries_list,
+                                                                            sub_regions_dict = sub_region_dict, regions_dict = region_dict))
+
+    _time('get_national_markets_df', lambda: Aggregation.get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids,
+                                                                                 drug_list = [drug], sources_path = sources_path))
+
+    if 'train_test_model' in stages and networks is not None:
+        import yaml
+        import torch_geometric.nn as pyg_nn
+        import train_test
+        from models import GAE_Encoder
+
+        with open(os.path.join(base_path, '..', 'GNN', 'code', 'config.yaml')) as config_file:
+            args = yaml.safe_load(config_file)
+        args.update({'log_to': sources_path[:-1], 'num_epochs': num_epochs, 'profile': True, 'trace_job': None})
+
+        # Train on the largest yearly network
+        year = max(networks.keys(), key = lambda y: networks[y].number_of_edges())
+        dataset_path = sources_path + f'{drug}_{year}.gml'
+        write_training_graph(networks[year], dataset_path, num_features = args['input_dim'], seed = seed)
+        if _time('train_test_model', lambda: train_test.train_test_model(pyg_nn.GAE, GAE_Encoder, dataset_path, args)) is not None:
+            # Keep the per-phase breakdown recorded by the training profiler
+            import utils
+            df_metrics = utils.read_metrics_store(args['log_to'])
+            for _, row in df_metrics[df_metrics['metric'].str.startswith('profile_time_')].iterrows():
+                _record('train_test_model/' + row['metric'][len('profile_time_'):], row['value'])
+
+    if 'cli_cold_start' in stages:
+        # The synthetic sources folder stands in for the datasets and logs folders
+        for name, command in cli_commands.items():
+            start = time.perf_counter()
+            try:
+                subprocess.run([sys.executable, os.path.join(base_path, '..', 'cli.py')] + command + [sources_path[:-1]],
+                               check = True, stdout = subprocess.DEVNULL, stderr = subprocess.PIPE)
+                _record('cli_cold_start/' + name, time.perf_counter() - start)
+            except subprocess.CalledProcessError as e:
+                _record('cli_cold_start/' + name, time.perf_counter() - start, status = f'failed: {e.stderr.decode().strip()}')
+
+    return results
+
+def write_results(results, results_file = os.path.join(base_path, 'results.jsonl')):
+    '''
+    Parameters
+    ----------
+    results : list of dict
+    results_file : str, optional
+    Returns
+    -------
+    None
+    Appends benchmark results to the results file, tagged with the commit and a timestamp.
+    '''
+    commit = get_commit()
+    timestamp = datetime.datetime.now().strftime("%d-%m-%Y_%H:%M:%S")
+    with open(results_file, 'a') as output:
+        for row in results:
+            output.write(json.dumps({'commit': commit, 'timestamp': timestamp, **row}) + '\n')
+
+def compare_results(results_file = os.path.join(base_path, 'results.jsonl')):
+    '''
+    Parameters
+    ----------
+    results_file : str, optional
+    Returns
+    -------
+    df_compare : pd.DataFrame
+    Produces a (stage, n_rows, n_locations) x commit table of the latest successful timings.
+    '''
+    df = pd.read_json(results_file, lines = True, dtype = {'commit': str})
+    df = df[df['status'] == 'ok']
+    df = df.drop_duplicates(subset = ['commit', 'stage', 'n_rows', 'n_locations'], keep = 'last')
+    return df.pivot_table(index = ['stage', 'n_rows', 'n_locations'], columns = 'commit', values = 'seconds', sort = False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description = 'Benchmark the data preparation stages and the training loop on synthetic data.')
+    parser.add_argument('--rows', type = int, nargs = '+', default = [10000], help = 'total number of seizure records (10k to 10M)')
+    parser.add_argument('--locations', type = int, nargs = '+', default = [200], help = 'number of locations (200 to 50k)')
+    parser.add_argument('--stages', nargs = '+', default = stage_list, choices = stage_list)
+    parser.add_argument('--drug', default = 'Cocaine')
+    parser.add_argument('--epochs', type = int, default = 20)
+    parser.add_argument('--seed', type = int, default = 0)
+    parser.add_argument('--compare', action = 'store_true', help = 'print the comparison across commits and exit')
+    args = parser.parse_args()
+
+    if args.compare:
+        print(compare_results().to_string())
+        sys.exit(0)
+
+    for n_rows in args.rows:
+        for n_locations in args.locations:
+            print(f'--- {n_rows} rows, {n_locations} locations ---')
+            results = run_benchmarks(n_rows, n_locations, drug = args.drug, stages = args.stages, num_epochs = args.epochs, seed = args.seed)
+            write_results(results)
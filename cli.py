@@ -0,0 +1,319 @@
+
+# Command-line entry point for building the networks, training the GNNs and inspecting the results;
+# Heavy dependencies (pandas, networkx, torch, torch_geometric) are imported inside the subcommands that need them,
+# so that quick jobs such as listing the datasets or summarizing the logs start in a fraction of a second;
+# Run with --timing to print the start-up (import) time and the total time of a command.
+
+import os
+import sys
+import time
+import argparse
+
+start_time = time.perf_counter()
+
+base_path = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(base_path, 'data_prep'))
+sys.path.insert(0, os.path.join(base_path, 'GNN', 'code'))
+
+config_file = os.path.join(base_path, 'GNN', 'code', 'config.yaml')
+
+# Training modes and the modules implementing them
+train_modes = {'full': 'train_test', 'minibatch': 'minibatch', 'ensemble': 'ensemble'}
+
+def read_config(file = config_file, **overrides):
+    '''
+    Parameters
+    ----------
+    file : str, optional
+    **overrides
+        Entries replacing those of the config file (None values are ignored).
+    Returns
+    -------
+    args : dict
+    Reads the training configuration (config.yaml by default).
+    '''
+    import yaml
+
+    with open(file) as config:
+        args = yaml.safe_load(config)
+    args.update({key: value for key, value in overrides.items() if value is not None})
+    return args
+
+def print_table(rows, columns):
+    '''
+    Parameters
+    ----------
+    rows : list of dict
+    columns : list of str
+    Returns
+    -------
+    None
+    Prints rows as an aligned plain-text table (floats with 4 decimals, missing entries as '-').
+    '''
+    def _format(value):
+        if value is None:
+            return '-'
+        return f'{value:.4f}' if isinstance(value, float) else str(value)
+
+    cells = [[_format(row.get(column)) for column in columns] for row in rows]
+    widths = [max([len(column)] + [len(row[j]) for row in cells]) for j, column in enumerate(columns)]
+    print('  '.join(column.ljust(width) for column, width in zip(columns, widths)))
+    for row in cells:
+        print('  '.join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+def list_datasets(args):
+    import utils
+
+    data_path = args.data_path if args.data_path is not None else read_config()['data_path']
+    rows = []
+    for file in utils.get_path_list(data_path):
+        if not file.endswith('.gml'):
+            continue
+        drug, period = utils.get_dataset_info(file)
+        rows.append({'drug': drug, 'period': period, 'size(kB)': round(os.path.getsize(file) / 1024), 'file': file.split('/')[-1]})
+    print_table(rows, ['drug', 'period', 'size(kB)', 'file'])
+
+def summarize_logs(args):
+    import utils
+
+    log_to = args.log_to if args.log_to is not None else read_config()['log_to']
+    summary = utils.summarize_metrics_store(log_to, run_id = args.run_id)
+    if args.last and len(summary) > 0:
+        # Run ids are timestamps, the last one appended to the store is the latest run
+        last_run = summary[-1]['run_id']
+        summary = [row for row in summary if row['run_id'] == last_run]
+    print_table(summary, ['run_id', 'drug', 'period', 'model', 'epochs', 'final_train_loss',
+                          'final_test_AUC', 'best_test_AUC', 'final_test_AP', 'best_test_AP'])
+
+def build_networks(args):
+    import Seizures
+    import Features
+
+    # The IDS data is read once for all drugs
+    if args.ids_file is not None:
+        df_ids = Seizures.read_xlsx(args.ids_file, start_year = args.start_year, end_year = args.end_year)
+    else:
+        df_ids = Seizures.read_xlsx(start_year = args.start_year, end_year = args.end_year)
+    for drug in args.drugs:
+        Features.get_network_data(drug, df_ids = df_ids, for_pyg = not args.no_pyg, for_R = not args.no_R,
+                                  aggregate_over_time_period = not args.no_aggregate, write_to_file = True,
+                                  base_file_path = args.base_path, start_year = args.start_year, end_year = args.end_year, R_format = args.R_format)
+        print(f'Networks of {drug} ({args.start_year}-{args.end_year}) written to {args.base_path}')
+
+def train(args):
+    import importlib
+    import torch_geometric.nn as pyg_nn
+    import utils
+    import dataset
+    from models import GAE_Encoder, VGAE_Encoder
+
+    config = read_config(args.config, data_path = args.data_path, log_to = args.log_to, dataset_root = args.dataset_root,
+                         feature_stats = args.feature_stats, num_epochs = args.epochs, num_seeds = args.seeds,
+                         export_embeddings = True if args.export_embeddings else None,
+                         save_checkpoints = True if args.save_checkpoints else None)
+    module = importlib.import_module(train_modes[args.mode])
+    train_test = module.train_test_ensemble if args.mode == 'ensemble' else module.train_test_model
+
+    # Only the datasets whose name (file name, or <drug>_<period> for the container) contains one of the given patterns
+    graphs = dataset.get_training_graphs(config)
+    if args.datasets is not None:
+        names = [file.split('/')[-1] if data is None else f'{data.drug}_{data.period}' for file, data in graphs]
+        graphs = [graph for graph, name in zip(graphs, names) if any(pattern in name for pattern in args.datasets)]
+    if len(graphs) == 0:
+        raise Exception('No datasets to train on!')
+
+    run_id = utils.get_run_id()
+    models = [(pyg_nn.GAE, GAE_Encoder), (pyg_nn.VGAE, VGAE_Encoder)]
+    models = [(pyg_model, encoder) for pyg_model, encoder in models if args.model is None or pyg_model.__name__ == args.model]
+    for file, data in graphs:
+        for pyg_model, encoder in models:
+            train_test(pyg_model = pyg_model, encoder = encoder, dataset_path = file, args = config, run_id = run_id, verbose = args.verbose, data = data)
+
+    print(f'Metrics of run {run_id} logged to {utils.get_metrics_store_path(config["log_to"])}.')
+    print_table(utils.summarize_metrics_store(config['log_to'], run_id = run_id),
+                ['drug', 'period', 'model', 'epochs', 'final_train_loss', 'final_test_AUC', 'best_test_AUC', 'final_test_AP', 'best_test_AP'])
+
+def compute_feature_stats(args):
+    import normalization
+
+    config = read_config(args.config, data_path = args.data_path, dataset_root = args.dataset_root)
+    log_features = [] if args.no_log else args.log_features
+    stats = normalization.get_feature_statistics(normalization.get_collection_features(config), method = args.method,
+                                                 log_features = log_features, one_hot = args.one_hot)
+    normalization.save_feature_statistics(stats, args.output)
+    rows = [{'feature': feature, 'log': feature in log_features, **{key: stats[key][j].item() for key in ['mean', 'std', 'min', 'max', 'scale', 'shift']}}
+            for j, feature in enumerate(normalization.feature_names)]
+    print_table(rows, ['feature', 'log', 'mean', 'std', 'min', 'max', 'scale', 'shift'])
+    print(f"Statistics of {stats['num_nodes']} nodes written to {args.output}; set feature_stats in the config to use them.")
+
+def drift(args):
+    import embeddings
+
+    log_to = args.log_to if args.log_to is not None else read_config()['log_to']
+    run_id = args.run_id if args.run_id is not None else get_latest_embeddings_run(log_to)
+    drift_df = embeddings.get_drift(log_to, run_id, args.drug, args.model, center = not args.no_center, scale = not args.no_scale)
+    if args.output is not None:
+        drift_df.to_csv(args.output, index = False)
+    print(f'Embedding drift of {args.drug} ({args.model}) in run {run_id}, largest mean movements:')
+    summary = embeddings.get_drift_summary(drift_df).head(args.top)
+    print_table(summary.to_dict(orient = 'records'), ['Country_ID', 'Country', 'Pairs', 'Mean_movement', 'Max_movement', 'Max_from'])
+
+def get_latest_embeddings_run(log_to):
+    '''
+    Parameters
+    ----------
+    log_to : str
+    Returns
+    -------
+    run_id : str
+    The latest run with exported embeddings.
+    '''
+    runs = os.listdir(log_to + '/embeddings') if os.path.exists(log_to + '/embeddings') else []
+    runs = [run for run in runs if os.path.isdir(log_to + '/embeddings/' + run)]
+    if len(runs) == 0:
+        raise Exception(f'No embeddings exported to {log_to}!')
+    return max(runs, key = lambda run: os.path.getmtime(log_to + '/embeddings/' + run))
+
+def similar(args):
+    import neighbors
+
+    log_to = args.log_to if args.log_to is not None else read_config()['log_to']
+    index_file = args.index if args.index is not None else log_to + '/embeddings/index.pt'
+    embedding_index = neighbors.load_embedding_index(index_file)
+
+    # Runs are inserted incrementally: only their new (drug, period, model) spaces are added
+    run_ids = args.add_runs if args.add_runs is not None else ([get_latest_embeddings_run(log_to)] if len(embedding_index['spaces']) == 0 else [])
+    added = []
+    for run_id in run_ids:
+        added += neighbors.add_run_embeddings(embedding_index, log_to, run_id, metric = args.metric, nprobe = args.nprobe)
+    if len(added) > 0:
+        neighbors.save_embedding_index(embedding_index, index_file)
+        print(f'Added {len(added)} embedding spaces to {index_file}')
+
+    start = time.perf_counter()
+    results = neighbors.get_similar_countries(embedding_index, args.drug, args.period, args.model, args.countries, k = args.k, nprobe = args.nprobe)
+    latency = time.perf_counter() - start
+    for country, neighbors_list in results.items():
+        print(f'Countries with the most similar role to {country} ({args.drug}, {args.period}, {args.model}):')
+        print_table([{'country': neighbor, 'similarity': score} for neighbor, score in neighbors_list], ['country', 'similarity'])
+    print(f'query: {1000 * latency:.2f}ms', file = sys.stderr)
+
+def serve(args):
+    import serving
+
+    log_to = args.log_to if args.log_to is not None else read_config()['log_to']
+    server = serving.get_server(log_to, run_id = args.run_id, host = args.host, port = args.port, cache_size = args.cache_size,
+                                max_batch = args.max_batch, max_wait_ms = args.max_wait_ms)
+    host, port = server.server_address[:2]
+    print(f'Serving {len(server.service.cache.checkpoint_files)} models of run {server.run_id} at http://{host}:{port} (metrics at /metrics)')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+def get_parser():
+    '''
+    Returns
+    -------
+    parser : argparse.ArgumentParser
+    '''
+    parser = argparse.ArgumentParser(description = 'Build the drug trafficking networks, train the GNNs and inspect the results.')
+    parser.add_argument('--timing', action = 'store_true', help = 'print the start-up and total time of the command')
+    subparsers = parser.add_subparsers(dest = 'command', required = True)
+
+    datasets = subparsers.add_parser('datasets', help = 'list the .gml datasets available for training')
+    datasets.add_argument('--data-path', help = 'defaults to data_path of config.yaml')
+    datasets.set_defaults(function = list_datasets)
+
+    summarize = subparsers.add_parser('summarize', help = 'summarize the metrics store: final and best test metrics per run, dataset and model')
+    summarize.add_argument('--log-to', help = 'defaults to log_to of config.yaml')
+    summarize.add_argument('--run-id')
+    summarize.add_argument('--last', action = 'store_true', help = 'only the latest run')
+    summarize.set_defaults(function = summarize_logs)
+
+    build = subparsers.add_parser('build-networks', help = 'build the yearly and aggregate networks and write them for pyg and R')
+    build.add_argument('--drugs', nargs = '+', default = ['Cocaine', 'Heroin'])
+    build.add_argument('--ids-file', help = 'IDS report (.xlsx); defaults to that of Seizures.read_xlsx')
+    build.add_argument('--base-path', default = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/', help = 'folder containing pyg_data and R_data')
+    build.add_argument('--start-year', type = int, default = 2006)
+    build.add_argument('--end-year', type = int, default = 2017)
+    build.add_argument('--no-pyg', action = 'store_true')
+    build.add_argument('--no-R', action = 'store_true')
+    build.add_argument('--no-aggregate', action = 'store_true')
+    build.add_argument('--R-format', choices = ['csv', 'parquet', 'arrow'], default = 'csv', help = 'csv files or one partitioned dataset per drug and table')
+    build.set_defaults(function = build_networks)
+
+    train_parser = subparsers.add_parser('train', help = 'train and test GAE and VGAE models on the datasets')
+    train_parser.add_argument('--mode', choices = list(train_modes.keys()), default = 'full')
+    train_parser.add_argument('--config', default = config_file)
+    train_parser.add_argument('--data-path')
+    train_parser.add_argument('--log-to')
+    train_parser.add_argument('--dataset-root', help = 'train on the collated container of the datasets, kept in this folder')
+    train_parser.add_argument('--feature-stats', help = 'normalize the features with these statistics (see feature-stats)')
+    train_parser.add_argument('--datasets', nargs = '+', help = 'only the files whose name contains one of these (e.g. Cocaine_2010 aggregate)')
+    train_parser.add_argument('--model', choices = ['GAE', 'VGAE'], help = 'defaults to both')
+    train_parser.add_argument('--epochs', type = int)
+    train_parser.add_argument('--seeds', type = int, help = 'number of seeds of the ensemble mode')
+    train_parser.add_argument('--export-embeddings', action = 'store_true', help = 'export the node embeddings of every model (of the first seed in ensemble mode)')
+    train_parser.add_argument('--save-checkpoints', action = 'store_true', help = 'save every model with its graph, e.g. for serve (the first seed in ensemble mode)')
+    train_parser.add_argument('--verbose', action = 'store_true')
+    train_parser.set_defaults(function = train)
+
+    drift_parser = subparsers.add_parser('drift', help = 'align the exported embeddings of consecutive years and rank the countries by movement')
+    drift_parser.add_argument('--drug', default = 'Cocaine')
+    drift_parser.add_argument('--model', choices = ['GAE', 'VGAE'], default = 'GAE')
+    drift_parser.add_argument('--log-to', help = 'defaults to log_to of config.yaml')
+    drift_parser.add_argument('--run-id', help = 'defaults to the latest run with exported embeddings')
+    drift_parser.add_argument('--top', type = int, default = 20)
+    drift_parser.add_argument('--no-center', action = 'store_true')
+    drift_parser.add_argument('--no-scale', action = 'store_true')
+    drift_parser.add_argument('--output', help = 'write the movements of every country and year pair to this csv file')
+    drift_parser.set_defaults(function = drift)
+
+    similar_parser = subparsers.add_parser('similar', help = 'countries with the most similar embeddings (role) in a network, from an ANN index')
+    similar_parser.add_argument('countries', nargs = '+')
+    similar_parser.add_argument('--drug', default = 'Cocaine')
+    similar_parser.add_argument('--period', default = 'aggregate')
+    similar_parser.add_argument('--model', choices = ['GAE', 'VGAE'], default = 'GAE')
+    similar_parser.add_argument('--k', type = int, default = 10)
+    similar_parser.add_argument('--log-to', help = 'defaults to log_to of config.yaml')
+    similar_parser.add_argument('--index', help = 'index file; defaults to embeddings/index.pt in log_to')
+    similar_parser.add_argument('--add-runs', nargs = '+', help = 'runs whose embeddings are inserted first; an empty index gets the latest run')
+    similar_parser.add_argument('--metric', choices = ['cosine', 'ip'], default = 'cosine')
+    similar_parser.add_argument('--nprobe', type = int, default = 4)
+    similar_parser.set_defaults(function = similar)
+
+    serve_parser = subparsers.add_parser('serve', help = 'local HTTP service scoring links with the saved models (see GNN/code/serving.py)')
+    serve_parser.add_argument('--log-to', help = 'defaults to log_to of config.yaml')
+    serve_parser.add_argument('--run-id', help = 'defaults to the latest run with saved checkpoints')
+    serve_parser.add_argument('--host', default = '127.0.0.1')
+    serve_parser.add_argument('--port', type = int, default = 8000)
+    serve_parser.add_argument('--cache-size', type = int, default = 8, help = 'number of models kept in memory')
+    serve_parser.add_argument('--max-batch', type = int, default = 256, help = 'maximum number of requests answered together')
+    serve_parser.add_argument('--max-wait-ms', type = float, default = 2.0, help = 'how long a batch waits for more requests')
+    serve_parser.set_defaults(function = serve)
+
+    stats_parser = subparsers.add_parser('feature-stats', help = 'compute the feature normalization statistics over all the datasets')
+    stats_parser.add_argument('output', help = 'file of the statistics (torch format)')
+    stats_parser.add_argument('--method', choices = ['standard', 'minmax', 'l2'], default = 'standard')
+    stats_parser.add_argument('--log-features', nargs = '+', default = ['Price(USD)', 'Seizures(kg)', 'Consumption(kg)', 'Market(kg)', 'GDP/capita'])
+    stats_parser.add_argument('--no-log', action = 'store_true', help = 'no log transforms')
+    stats_parser.add_argument('--one-hot', action = 'store_true', help = 'normalize the one-hot region columns as well')
+    stats_parser.add_argument('--config', default = config_file)
+    stats_parser.add_argument('--data-path')
+    stats_parser.add_argument('--dataset-root')
+    stats_parser.set_defaults(function = compute_feature_stats)
+
+    return parser
+
+def main(argv = None):
+    args = get_parser().parse_args(argv)
+    startup = time.perf_counter() - start_time
+    args.function(args)
+    if args.timing:
+        print(f'start-up: {startup:.3f}s, total: {time.perf_counter() - start_time:.3f}s', file = sys.stderr)
+
+if __name__ == '__main__':
+    main()
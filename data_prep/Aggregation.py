@@ -1,11 +1,11 @@
-import numpy as np
 import pandas as pd
-import networkx as nx
 from copy import deepcopy
-import Prevalence
+import Countries
 import Seizures
 
-def get_drug_users(drug, countries_list, start_year = 2006, end_year = 2017):
+def get_drug_users(drug, countries_list, start_year = 2006, end_year = 2017,
+                   population_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Population.xlsx', 
+                   prevalence_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Prevalence.xlsx'):
     '''
     Parameters
     ----------
@@ -15,6 +15,8 @@ def get_drug_users(drug, countries_list, start_year = 2006, end_year = 2017):
         The default is 2006.
     end_year : int, optional
         The default is 2017.
+    population_file : str, optional
+    prevalence_file : str, optional
     Returns
     -------
     drug_users : dict(dict(floate))
@@ -22,13 +24,13 @@ def get_drug_users(drug, countries_list, start_year = 2006, end_year = 2017):
     '''
     
     # Read the population data
-    xlsx = pd.ExcelFile('/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Population.xlsx')
+    xlsx = pd.ExcelFile(population_file)
     df_pop = dict()
     for year in range(start_year, end_year + 1):
         df_pop[year] = pd.read_excel(xlsx, str(year))
     
     # Read the prevalence data
-    xlsx = pd.ExcelFile('/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Prevalence.xlsx')
+    xlsx = pd.ExcelFile(prevalence_file)
     df_prev = dict()
     for year in range(start_year, end_year + 1):
         df_prev[year] = pd.read_excel(xlsx, str(year))
@@ -36,18 +38,20 @@ def get_drug_users(drug, countries_list, start_year = 2006, end_year = 2017):
     # Container for total drug users per country
     drug_users = {year: {} for year in range(start_year, end_year + 1)}
     
+    # Countries are matched by their registry IDs
+    registry = Countries.get_country_registry(countries_list)
+    codes = Countries.get_country_codes(countries_list, registry)
+
     # Iterate over the time period
     for year in range(start_year, end_year + 1):
-        # Iterate over the list of countries
-        for country in countries_list:
-            country_year_population = float(df_pop[year][df_pop[year]['Location'] == country]['Population'])
-            country_year_drug_prevalence = float(df_prev[year][(df_prev[year]['Location'] == country) & (df_prev[year]['Drug'] == drug)]['Prevalence'])
-            country_drug_users = country_year_population * country_year_drug_prevalence
-            drug_users[year][country] = country_drug_users
+        population = Countries.get_country_values(df_pop[year], 'Location', 'Population', registry)
+        prevalence = Countries.get_country_values(df_prev[year], 'Location', 'Prevalence', registry, mask = df_prev[year]['Drug'] == drug)
+        drug_users[year] = dict(zip(countries_list, population[codes] * prevalence[codes]))
     
     return drug_users
 
-def get_yearly_consumption(drug, drug_users_dict, start_year = 2006, end_year = 2017):
+def get_yearly_consumption(drug, drug_users_dict, start_year = 2006, end_year = 2017,
+                           production_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Production.xlsx'):
     '''
     Parameters
     ----------
@@ -57,13 +61,14 @@ def get_yearly_consumption(drug, drug_users_dict, start_year = 2006, end_year =
         The default is 2006.
     end_year : int, optional
         The default is 2017.
+    production_file : str, optional
     Returns
     -------
     consumption_dict : dict(float)
         Returns the yearly consumption of the drug in every year.
     '''
     # Import the production data
-    prod_df = pd.read_excel('/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Production.xlsx')
+    prod_df = pd.read_excel(production_file)
 
     # Container for yearly consumption per user
     consumption_dict = dict()
@@ -80,7 +85,8 @@ def get_yearly_consumption(drug, drug_users_dict, start_year = 2006, end_year =
     # Return the output
     return consumption_dict
 
-def get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'], from_file = False, start_year = 2006, end_year = 2017):
+def get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'], from_file = False, 
+                            start_year = 2006, end_year = 2017, sources_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/'):
     '''
     Parameters
     ----------
@@ -91,6 +97,8 @@ def get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids
         The default is 2006.
     end_year : int, optional
         The default is 2017.
+    sources_path : str, optional
+        Directory containing Seizures.xlsx, Purity.xlsx, Prevalence.xlsx, Population.xlsx and Production.xlsx.
     Returns
     -------
     df_markets : dict(pd.DataFrame)
@@ -99,7 +107,7 @@ def get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids
     
     if from_file:
         # Read the seziures data for the given time period
-        xlsx = pd.ExcelFile('/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Seizures.xlsx')
+        xlsx = pd.ExcelFile(sources_path + 'Seizures.xlsx')
         df_seiz = dict()
         for year in range(start_year, end_year + 1):
             df_seiz[year] = pd.read_excel(xlsx, str(year))
@@ -110,16 +118,17 @@ def get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids
                                                         countries_list = countries_list, 
                                                         sub_region_dict = sub_region_dict,
                                                         region_dict = region_dict, 
-                                                        drug_list = drug_list)
+                                                        drug_list = drug_list,
+                                                        purity_file = sources_path + 'Purity.xlsx')
         
     # Read the prevalence data for the given time period
-    xlsx = pd.ExcelFile('/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Prevalence.xlsx')
+    xlsx = pd.ExcelFile(sources_path + 'Prevalence.xlsx')
     df_prev = dict()
     for year in range(start_year, end_year + 1):
         df_prev[year] = pd.read_excel(xlsx, str(year))
     
     # Read the population data for the given time period
-    xlsx = pd.ExcelFile('/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Population.xlsx')
+    xlsx = pd.ExcelFile(sources_path + 'Population.xlsx')
     df_pop = dict()
     for year in range(start_year, end_year + 1):
         df_pop[year] = pd.read_excel(xlsx, str(year))
@@ -134,39 +143,38 @@ def get_national_markets_df(countries_list, sub_region_dict, region_dict, df_ids
         df_markets[year]['Consumption(kg)'] = ''
         df_markets[year]['Market(kg)'] = ''
     
+    # Countries are matched by their registry IDs
+    registry = Countries.get_country_registry(countries_list)
+
     # Iterate over the drug list
     for drug in drug_list:
         # Obtain the yearly number of drug users
-        drug_users = get_drug_users(drug, countries_list, start_year = start_year, end_year = end_year)
+        drug_users = get_drug_users(drug, countries_list, 
+                                    population_file = sources_path + 'Population.xlsx', 
+                                    prevalence_file = sources_path + 'Prevalence.xlsx', 
+                                    start_year = start_year, end_year = end_year)
         # Obtain the yearly consumption for each drug
-        yearly_consumption = get_yearly_consumption(drug, drug_users)
+        yearly_consumption = get_yearly_consumption(drug, drug_users, production_file = sources_path + 'Production.xlsx')
         
         # Iterate over the time period
         for year in range(start_year, end_year + 1):
             # Get the average yearly consumption
             average_quantity = yearly_consumption[year]
             # Extract the seizures data for the corresponding drug
-            drug_seizures_year_df = df_markets[year][df_markets[year]['Drug'] == drug]
+            mask = (df_markets[year]['Drug'] == drug).to_numpy()
+            codes = Countries.get_country_codes(df_markets[year]['Country'][mask], registry)
+
+            # Get the population and the prevalence of every country by ID
+            population = Countries.get_country_values(df_pop[year], 'Location', 'Population', registry)
+            prevalence = Countries.get_country_values(df_prev[year], 'Location', 'Prevalence', registry, mask = df_prev[year]['Drug'] == drug)
+
+            # Compute internal consumption and market
+            consumption = population[codes] * prevalence[codes] * average_quantity
+            market = consumption + df_markets[year]['Seizures(kg)'][mask].to_numpy(dtype = float)
 
-            # Iterate over the rows
-            for ind in drug_seizures_year_df.index:
-                # Get the country
-                country = drug_seizures_year_df['Country'][ind]
-                # Get the seizures
-                seizures = float(drug_seizures_year_df['Seizures(kg)'][ind])
-                # Get the population
-                population = float(df_pop[year][df_pop[year]['Location'] == country]['Population'])
-                # Get the prevalence
-                prevalence = float(df_prev[year][(df_prev[year]['Location'] == country) & (df_prev[year]['Drug'] == drug)]['Prevalence'])
-                
-                # Compute internal consumption
-                consumption = population * prevalence * average_quantity
-                # Compute internal market
-                market = consumption + seizures
-                
-                # Add the consumption and the market data to df_markets
-                df_markets[year].loc[(df_markets[year]['Drug'] == drug) & (df_markets[year]['Country'] == country), 'Consumption(kg)'] = consumption
-                df_markets[year].loc[(df_markets[year]['Drug'] == drug) & (df_markets[year]['Country'] == country), 'Market(kg)'] = market
+            # Add the consumption and the market data to df_markets
+            df_markets[year].loc[mask, 'Consumption(kg)'] = consumption
+            df_markets[year].loc[mask, 'Market(kg)'] = market
     
     # Remove the first column in each dataframe:
     for year in range(start_year, end_year + 1):
@@ -0,0 +1,245 @@
+
+# Collection of functions for coarsening the country-level networks into sub-region or region networks;
+# Countries are mapped to groups by a sparse assignment matrix S (countries x groups), so that the coarse weights are S^T W S;
+# All the networks of a drug (yearly and aggregate) are stacked and coarsened in a single sparse product;
+# Node features are aggregated per group with configurable reducers and the results are exported like Features.get_network_data.
+
+import os
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy.sparse as sp
+import Seizures
+import Features
+
+# Coarsening levels and the corresponding columns of the feature tables
+levels = ['Sub_Region', 'Region']
+
+# Default reducers of the feature columns: volumes are summed, everything else is averaged
+default_reducers = {
+    'Latitude': 'mean',
+    'Longitude': 'mean',
+    'Price(USD)': 'mean',
+    'Seizures(kg)': 'sum',
+    'Consumption(kg)': 'sum',
+    'Market(kg)': 'sum',
+    'GDP/capita': 'mean',
+    'Control_of_Corruption': 'mean',
+    'Gov_Effectiveness': 'mean',
+    'Stability_No_Terrorism': 'mean',
+    'Regulatory_Quality': 'mean',
+    'Rule_of_Law': 'mean'
+}
+
+def get_assignment_matrix(nodes, group_dict):
+    '''
+    Parameters
+    ----------
+    nodes : list
+    group_dict : dict
+        Group (sub-region or region) of every node.
+    Returns
+    -------
+    (groups, S) : tuple
+        Sorted list of groups and the binary (nodes x groups) assignment matrix in CSR format.
+    '''
+    missing = [node for node in nodes if node not in group_dict]
+    if len(missing) > 0:
+        raise Exception(f'No group for nodes: {missing}')
+    groups = sorted(set(group_dict[node] for node in nodes))
+    index = {group: j for j, group in enumerate(groups)}
+    cols = np.array([index[group_dict[node]] for node in nodes], dtype = int)
+    S = sp.csr_matrix((np.ones(len(nodes)), (np.arange(len(nodes)), cols)), shape = (len(nodes), len(groups)))
+    return groups, S
+
+def coarsen_networks(networks, group_dict, weight = 'weight'):
+    '''
+    Parameters
+    ----------
+    networks : dict of nx.DiGraphs
+        E.g. {year: network}, possibly with aggregate networks as well.
+    group_dict : dict
+        Group of every country, e.g. the sub_region_dict or region_dict of Seizures.get_ids_locations.
+    weight : str, optional
+    Returns
+    -------
+    output : dict of nx.DiGraphs
+        Coarse networks with the same keys. Edge 'weight' is the total weight between two groups and 'edges' the number of country-level edges;
+        flows within a group are stored on the node as 'internal_weight' and 'internal_edges', and 'countries' counts the group's countries in the network.
+    '''
+    keys = list(networks.keys())
+    nodes = sorted(set().union(*[set(networks[key].nodes) for key in keys]))
+    index = {node: i for i, node in enumerate(nodes)}
+    groups, S = get_assignment_matrix(nodes, group_dict)
+    n, k, T = len(nodes), len(groups), len(keys)
+
+    # Stack all the networks vertically: row t * n + i holds the out-edges of node i in network t
+    rows, cols, weights, presence = [], [], [], []
+    for t, key in enumerate(keys):
+        edges = list(networks[key].edges(data = weight, default = 0.0))
+        rows.append(t * n + np.array([index[u] for u, v, w in edges], dtype = int))
+        cols.append(np.array([index[v] for u, v, w in edges], dtype = int))
+        weights.append(np.array([w for u, v, w in edges], dtype = float))
+        presence.append(np.zeros((n, 1)))
+        presence[-1][[index[node] for node in networks[key].nodes]] = 1.0
+    rows, cols = np.concatenate(rows), np.concatenate(cols)
+    W = sp.csr_matrix((np.concatenate(weights), (rows, cols)), shape = (T * n, n))
+    B = sp.csr_matrix((np.ones(len(rows)), (rows, cols)), shape = (T * n, n))
+
+    # blockdiag(S^T, ..., S^T) @ [W_1; ...; W_T] @ S = [S^T W_1 S; ...; S^T W_T S]
+    ST = sp.kron(sp.identity(T, format = 'csr'), S.T, format = 'csr')
+    W_coarse = (ST @ (W @ S)).tocsr()
+    B_coarse = (ST @ (B @ S)).tocsr()
+    countries = (S.T @ np.hstack(presence)).T
+
+    output = dict()
+    for t, key in enumerate(keys):
+        W_t, B_t = W_coarse[t * k:(t + 1) * k], B_coarse[t * k:(t + 1) * k].tocoo()
+        network = nx.DiGraph()
+        network.add_nodes_from((group, {'countries': int(c), 'internal_weight': w, 'internal_edges': int(b)})
+                               for group, c, w, b in zip(groups, countries[t], W_t.diagonal(), B_t.diagonal()) if c > 0)
+        # Edges are taken from the counts, so that edges with zero total weight are kept as well
+        off_diagonal = B_t.row != B_t.col
+        network.add_edges_from((groups[i], groups[j], {'weight': W_t[i, j], 'edges': int(b)})
+                               for i, j, b in zip(B_t.row[off_diagonal], B_t.col[off_diagonal], B_t.data[off_diagonal]))
+        output[key] = network
+    return output
+
+def coarsen_features(df, level, reducers = None):
+    '''
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Country features, e.g. one year of Features.get_node_attributes.
+    level : str
+        'Sub_Region' or 'Region'.
+    reducers : dict, optional
+        {column: reducer}, with any reducer accepted by pd.DataFrameGroupBy.agg; updates default_reducers.
+    Returns
+    -------
+    output_df : pd.DataFrame
+        One row per group: the group name (in the level column), its region (for sub-regions), the number of countries and the reduced features.
+        Missing values are skipped by the reducers.
+    '''
+    if level not in levels:
+        raise Exception(f'Invalid level, choose from {levels}!')
+    reducers = {**default_reducers, **(reducers if reducers is not None else dict())}
+    reducers = {column: reducer for column, reducer in reducers.items() if column in df.columns}
+    if level == 'Sub_Region':
+        reducers = {'Region': 'first', **reducers}
+    reducers = {'Country': 'count', **reducers}
+    output_df = df.groupby(level, sort = True).agg(reducers).reset_index()
+    return output_df.rename(columns = {'Country': 'Countries'})
+
+def get_coarse_network_data(drug, level = 'Sub_Region', df_ids = None, reducers = None,
+                            for_pyg = True, for_R = True,
+                            aggregate_over_time_period = True,
+                            write_to_file = True,
+                            base_file_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/',
+                            start_year = 2006, end_year = 2017, R_format = 'csv'):
+    '''
+    Parameters
+    ----------
+    drug : str
+    level : str, optional
+        'Sub_Region' or 'Region'. The default is 'Sub_Region'.
+    df_ids : dict of pd.DataFrames
+    reducers : dict, optional
+        See coarsen_features.
+    for_pyg : bool, optional (pytorch_geometric format)
+    for_R : bool, optionl (R format)
+    aggregate_over_time_period : bool, optional
+    write_to_file : bool, optional
+        Files are written to the 'pyg_data_<level>' and 'R_data_<level>' folders, next to the country-level ones.
+    base_file_path : str, optional
+    start_year : int, optional
+    end_year : int, optional
+    R_format : str, optional
+        'csv', 'parquet' or 'arrow'; see Features.get_network_data. The default is 'csv'.
+    Returns
+    -------
+    output : dict
+        Coarse counterpart of Features.get_network_data: output['pyg'][net] holds the networks (with edge weights) and output['R'] the node and edge tables.
+    '''
+
+    # Checks
+    if not for_pyg and not for_R:
+        raise Exception("The data must be prepared either for pyg or for R!")
+    if start_year < 2006 or end_year > 2017:
+        raise Exception("Data is available only for period 2006-2017!")
+    if level not in levels:
+        raise Exception(f'Invalid level, choose from {levels}!')
+    if R_format not in Features.R_formats:
+        raise Exception(f'Invalid R format, choose from {Features.R_formats}!')
+
+    # If no IDS data is not loaded, read it
+    if df_ids is None:
+        df_ids = Seizures.read_xlsx()
+
+    # Get the node attributes
+    df_yearly = Features.get_node_attributes(drug, df_ids, start_year = start_year, end_year = end_year)
+    df_aggregate = Features.aggregate_yearly_features(df_yearly, start_year = start_year, end_year = end_year)
+
+    # Get the yearly networks and, potentially, the weighted aggregate one
+    networks = Seizures.get_drug_network_by_year(drug, df_ids, start_year = start_year, end_year = end_year)
+    period = list(range(start_year, end_year + 1))
+    if aggregate_over_time_period:
+        networks = dict(networks)
+        networks['total'] = Features.get_window_network(Features.get_cumulative_weights(networks, start_year = start_year, end_year = end_year), start_year, end_year)
+        period.append('total')
+
+    # Coarsen all networks at once
+    _, sub_region_dict, region_dict = Seizures.get_ids_locations(df_ids, drug_list = [drug])
+    group_dict = sub_region_dict if level == 'Sub_Region' else region_dict
+    coarse_networks = coarsen_networks({net: networks[net] for net in period}, group_dict)
+
+    suffix = '_' + level.lower()
+    output = dict()
+
+    if for_pyg:
+        output['pyg'] = dict()
+        for net in period:
+            # Preproccesing: one-hot encoding of the region of each sub-region
+            df_features = coarsen_features(df_aggregate[net], level, reducers = reducers)
+            if level == 'Sub_Region':
+                df_features = pd.get_dummies(df_features, columns = ['Region'], dtype = float)
+            # Only the groups present in the network; y is the group name, x is a list of features
+            df_features = df_features[df_features[level].isin(coarse_networks[net].nodes)]
+            output_network = nx.DiGraph()
+            output_network.add_nodes_from((row[level], {'y': row[level], 'x': list(row[1:].astype(float))}) for _, row in df_features.iterrows())
+            output_network.add_weighted_edges_from(coarse_networks[net].edges(data = 'weight'))
+            output['pyg'][net] = output_network
+
+            if write_to_file:
+                os.makedirs(base_file_path + 'pyg_data' + suffix, exist_ok = True)
+                if net == 'total':
+                    write_file_path = base_file_path + 'pyg_data' + suffix + '/' + f'{drug}' + '_aggregate' + f'_{start_year}_{end_year}' + '.gml'
+                else:
+                    write_file_path = base_file_path + 'pyg_data' + suffix + '/' + f'{drug}' + f'_{net}' + '.gml'
+                nx.write_gml(output_network, write_file_path)
+
+    if for_R:
+        output['R'] = dict()
+        for net in period:
+            nodes_df = coarsen_features(df_aggregate[net], level, reducers = reducers)
+            nodes_df = nodes_df[nodes_df[level].isin(coarse_networks[net].nodes)].reset_index(drop = True)
+            edges_df = pd.DataFrame([(u, v, d['weight'], d['edges']) for u, v, d in coarse_networks[net].edges(data = True)],
+                                    columns = ['from', 'to', 'weight', 'edges'])
+            output['R'][f'nodes_{net}'] = nodes_df
+            output['R'][f'edges_{net}'] = edges_df
+
+            if write_to_file and R_format == 'csv':
+                os.makedirs(base_file_path + 'R_data' + suffix, exist_ok = True)
+                if net == 'total':
+                    write_file_path_nodes = base_file_path + 'R_data' + suffix + '/' + f'{drug}' + '_nodes' + '_aggregate' + f'_{start_year}_{end_year}' + '.csv'
+                    write_file_path_edges = base_file_path + 'R_data' + suffix + '/' + f'{drug}' + '_edges' + '_aggregate' + f'_{start_year}_{end_year}' + '.csv'
+                else:
+                    write_file_path_nodes = base_file_path + 'R_data' + suffix + '/' + f'{drug}' + '_nodes' + f'_{net}' + '.csv'
+                    write_file_path_edges = base_file_path + 'R_data' + suffix + '/' + f'{drug}' + '_edges' + f'_{net}' + '.csv'
+                nodes_df.to_csv(write_file_path_nodes)
+                edges_df.to_csv(write_file_path_edges)
+
+        if write_to_file and R_format != 'csv':
+            Features.write_R_dataset(output['R'], drug, base_file_path + 'R_data' + suffix, R_format = R_format, start_year = start_year, end_year = end_year)
+
+    return output
@@ -0,0 +1,303 @@
+
+# Country registry shared by the data_prep modules;
+# Every country gets a dense integer ID (its position in the sorted countries list), together with its ISO code, sub-region and region;
+# Tables carry the IDs as categorical country columns (or int32 codes), so that lookups and joins are integer index operations
+# instead of string comparisons over full DataFrames.
+# build_country_registry registers the full vocabulary of the IDS data once, so that the IDs are stable across drugs, periods and modules.
+
+import numpy as np
+import pandas as pd
+
+# Sub-regions of the countries whose sub-region is missing in the IDS data
+missing_sub_region_map = {
+    'Albania': 'East Europe',
+    'Antigua and Barbuda': 'Caribbean',
+    'Aruba': 'Caribbean',
+    'Australia': 'Oceania',
+    'Bahrain': 'Near and Middle East /South-West Asia',
+    'Barbados': 'Caribbean',
+    'Bermuda': 'Caribbean',
+    'Burundi': 'East Africa',
+    'Cameroon': 'West and Central Africa',
+    'Congo, the Democratic Republic of the': 'West and Central Africa',
+    'Cook Islands': 'Oceania',
+    'Costa Rica': 'Central America',
+    'Curaçao': 'Caribbean',
+    'Dominica': 'Caribbean',
+    'Equatorial Guinea': 'West and Central Africa',
+    'Eritrea': 'East Africa',
+    'Estonia': 'East Europe',
+    'Faroe Islands': 'West & Central Europe',
+    'Fiji': 'Oceania',
+    'Gabon': 'West and Central Africa',
+    'Grenada': 'Caribbean',
+    'Guadeloupe': 'Caribbean',
+    'Guernsey': 'West & Central Europe',
+    'Guyana': 'South America',
+    'Haiti': 'Caribbean',
+    'Hong Kong': 'South Asia',
+    'Iraq':'Near and Middle East /South-West Asia',
+    'Isle of Man': 'West & Central Europe',
+    'Israel': 'Near and Middle East /South-West Asia',
+    'Jamaica': 'Caribbean',
+    'Jordan': 'Near and Middle East /South-West Asia',
+    "Korea, Democratic People's Republic of": 'East and South-East Asia',
+    'Kosovo under UNSCR 1244': 'East Europe',
+    'Kuwait': 'Near and Middle East /South-West Asia',
+    'Liberia': 'West and Central Africa',
+    'Madagascar': 'East Africa',
+    'Mongolia': 'East and South-East Asia',
+    'Namibia': 'Southern Africa',
+    'Netherlands Antilles': 'Caribbean',
+    'Nicaragua': 'Central America',
+    'Niger': 'West and Central Africa',
+    'Oman': 'Near and Middle East /South-West Asia',
+    'Panama': 'Central America',
+    'Papua New Guinea': 'Oceania',
+    'Puerto Rico': 'Caribbean',
+    'Qatar': 'Near and Middle East /South-West Asia',
+    'Rwanda': 'East Africa',
+    'Réunion': 'South Asia',
+    'Saint Pierre and Miquelon': 'North America',
+    'Samoa': 'Oceania',
+    'Sao Tome and Principe': 'West and Central Africa',
+    'Seychelles': 'East Africa',
+    'St. Lucia': 'Caribbean',
+    'Suriname': 'South America',
+    'Taiwan, Province of China': 'East and South-East Asia',
+    'Turks and Caicos Islands': 'North America',
+    'Viet Nam': 'East and South-East Asia',
+    'Yemen': 'Near and Middle East /South-West Asia'
+}
+
+# Regions of the countries whose region is missing in the IDS data
+missing_region_map = {
+    'Albania': 'Europe',
+    'Antigua and Barbuda': 'Americas',
+    'Aruba': 'Americas',
+    'Australia': 'Oceania',
+    'Bahrain': 'Asia',
+    'Barbados': 'Americas',
+    'Bermuda': 'Americas',
+    'Burundi': 'Africa',
+    'Cameroon': 'Africa',
+    'Congo, the Democratic Republic of the': 'Africa',
+    'Cook Islands': 'Oceania',
+    'Costa Rica': 'Americas',
+    'Curaçao': 'Americas',
+    'Dominica': 'Americas',
+    'Equatorial Guinea': 'Africa',
+    'Eritrea': 'Africa',
+    'Estonia': 'Europe',
+    'Faroe Islands': 'Europe',
+    'Fiji': 'Oceania',
+    'Gabon': 'Africa',
+    'Grenada': 'Americas',
+    'Guadeloupe': 'Americas',
+    'Guernsey': 'Europe',
+    'Guyana': 'Americas',
+    'Haiti': 'Americas',
+    'Hong Kong': 'Asia',
+    'Iraq':'Asia',
+    'Isle of Man': 'Europe',
+    'Israel': 'Asia',
+    'Jamaica': 'Americas',
+    'Jordan': 'Asia',
+    "Korea, Democratic People's Republic of": 'Asia',
+    'Kosovo under UNSCR 1244': 'Europe',
+    'Kuwait': 'Asia',
+    'Liberia': 'Africa',
+    'Madagascar': 'Africa',
+    'Mongolia': 'Asia',
+    'Namibia': 'Africa',
+    'Netherlands Antilles': 'Americas',
+    'Nicaragua': 'Americas',
+    'Niger': 'Africa',
+    'Oman': 'Asia',
+    'Panama': 'Americas',
+    'Papua New Guinea': 'Oceania',
+    'Puerto Rico': 'Americas',
+    'Qatar': 'Asia',
+    'Rwanda': 'Africa',
+    'Réunion': 'Asia',
+    'Saint Pierre and Miquelon': 'Americas',
+    'Samoa': 'Oceania',
+    'Sao Tome and Principe': 'Africa',
+    'Seychelles': 'Africa',
+    'St. Lucia': 'Americas',
+    'Suriname': 'Americas',
+    'Taiwan, Province of China': 'Asia',
+    'Turks and Caicos Islands': 'Americas',
+    'Viet Nam': 'Asia',
+    'Yemen': 'Asia'
+}
+
+# Alternative spellings used by the external sources, mapped to the canonical (IDS) names
+aliases = {
+    'Moldova': 'Moldova, Republic of',
+    'R?union': 'Réunion',
+    'Bolivia': 'Bolivia, Plurinational State of',
+    'Taiwan': 'Taiwan, Province of China',
+    'Iran': 'Iran, Islamic Republic of',
+    'S?o Tom? and Pr?ncipe': 'Sao Tome and Principe',
+    'Laos': "Lao People's Democratic Republic",
+    'Macedonia [FYROM]': 'North Macedonia',
+    'North Korea': "Korea, Democratic People's Republic of",
+    'Swaziland': 'Eswatini',
+    'Saint Lucia': 'St. Lucia',
+    'Venezuela': 'Venezuela, Bolivarian Republic of',
+    'Tanzania': 'Tanzania, United Republic of',
+    'Vietnam': 'Viet Nam',
+    "C?te d'Ivoire": "Côte d'Ivoire",
+    'Kosovo': 'Kosovo under UNSCR 1244',
+    'Syria': 'Syrian Arab Republic',
+    'Libya': 'Libyan Arab Jamahiriya',
+    'Myanmar [Burma]': 'Myanmar',
+    'Russia': 'Russian Federation',
+    'South Korea': 'Korea, Republic of',
+    'Congo [Republic]': 'Congo',
+    'Congo [DRC]': 'Congo, the Democratic Republic of the'
+}
+
+def canonical_name(name):
+    '''
+    Parameters
+    ----------
+    name : str
+    Returns
+    -------
+    str
+        Canonical (IDS) name of a country.
+    '''
+    return aliases.get(name, name)
+
+# Registry shared by all the calls of get_country_registry; see build_country_registry
+country_registry = None
+
+def get_country_registry(countries_list, sub_region_dict = None, region_dict = None, iso_dict = None):
+    '''
+    Parameters
+    ----------
+    countries_list : list of str
+        E.g. the output of Seizures.get_ids_locations.
+    sub_region_dict : dict, optional
+    region_dict : dict, optional
+    iso_dict : dict, optional
+    Returns
+    -------
+    registry : pd.DataFrame
+        One row per country, indexed by its dense integer ID, with the (categorical) Country, ISO, Sub_Region and Region.
+        Missing sub-regions and regions are filled from missing_sub_region_map and missing_region_map.
+        If the shared registry (see build_country_registry) covers countries_list, it is returned, so that IDs are the same across
+        drugs, periods and modules; otherwise a registry of countries_list only is built, whose IDs are only valid within the call.
+    '''
+    countries = pd.Index(sorted(set(canonical_name(country) for country in countries_list)))
+    if country_registry is not None and countries.isin(country_registry['Country'].cat.categories).all():
+        return country_registry
+
+    def _get(mapping, missing_map, country):
+        if mapping is not None and mapping.get(country, 'Unknown') != 'Unknown':
+            return mapping[country]
+        return missing_map.get(country, 'Unknown')
+
+    registry = pd.DataFrame({'Country': pd.Categorical(countries, categories = countries),
+                             'ISO': [iso_dict.get(country) if iso_dict is not None else None for country in countries],
+                             'Sub_Region': pd.Categorical([_get(sub_region_dict, missing_sub_region_map, country) for country in countries]),
+                             'Region': pd.Categorical([_get(region_dict, missing_region_map, country) for country in countries])},
+                            index = pd.RangeIndex(len(countries), name = 'ID'))
+    return registry
+
+def build_country_registry(df_ids, start_year = None, end_year = None, iso_dict = None):
+    '''
+    Parameters
+    ----------
+    df_ids : dict of pd.DataFrame
+    start_year : int, optional
+    end_year : int, optional
+        The default is the first (last) year of df_ids.
+    iso_dict : dict, optional
+    Returns
+    -------
+    registry : pd.DataFrame
+        Builds the registry of the full vocabulary, i.e. the locations of all drugs over the period and the canonical names of the aliases,
+        and shares it with every later call of get_country_registry (until the next build or clear_country_registry).
+    '''
+    global country_registry
+    # Seizures imports this module
+    import Seizures
+
+    start_year = min(df_ids) if start_year is None else start_year
+    end_year = max(df_ids) if end_year is None else end_year
+    countries_list, sub_region_dict, region_dict = Seizures.get_ids_locations(df_ids, drug_list = list(Seizures.drug_derivatives), start_year = start_year, end_year = end_year)
+    country_registry = None
+    country_registry = get_country_registry(list(countries_list) + list(aliases.values()), sub_region_dict, region_dict, iso_dict)
+    return country_registry
+
+def clear_country_registry():
+    '''
+    Stops sharing the registry built by build_country_registry.
+    '''
+    global country_registry
+    country_registry = None
+
+def get_country_codes(values, registry):
+    '''
+    Parameters
+    ----------
+    values : iterable of str
+        Country names (aliases are resolved).
+    registry : pd.DataFrame
+    Returns
+    -------
+    codes : np.ndarray of int32
+        Country IDs of the values; -1 for values which are not in the registry (including missing values).
+    '''
+    categories = registry['Country'].cat.categories
+    # Categorical columns are translated once per category, then through their codes
+    if isinstance(getattr(values, 'dtype', None), pd.CategoricalDtype):
+        category_codes = np.append(get_country_codes(values.cat.categories, registry), -1).astype(np.int32)
+        return category_codes[np.asarray(values.cat.codes)]
+    values = pd.Series(values, dtype = object).map(lambda value: aliases.get(value, value) if isinstance(value, str) else value)
+    return pd.Categorical(values, categories = categories).codes.astype(np.int32)
+
+def encode_countries(df, columns, registry):
+    '''
+    Parameters
+    ----------
+    df : pd.DataFrame
+    columns : list of str
+    registry : pd.DataFrame
+    Returns
+    -------
+    df : pd.DataFrame
+        Copy of df in which the country columns are categoricals over the registry (codes are the country IDs);
+        values outside of the registry become missing.
+    '''
+    df = df.copy()
+    categories = registry['Country'].cat.categories
+    for column in columns:
+        df[column] = pd.Categorical.from_codes(get_country_codes(df[column], registry), categories = categories)
+    return df
+
+def get_country_values(df, country_column, value_column, registry, mask = None):
+    '''
+    Parameters
+    ----------
+    df : pd.DataFrame
+    country_column : str
+    value_column : str
+    registry : pd.DataFrame
+    mask : array-like of bool, optional
+        Rows of df to consider.
+    Returns
+    -------
+    values : np.ndarray
+        Values of value_column indexed by country ID (NaN for countries missing from df), i.e. an integer join of df onto the registry.
+    '''
+    if mask is not None:
+        df = df[np.asarray(mask)]
+    codes = get_country_codes(df[country_column], registry)
+    values = np.full(len(registry), np.nan)
+    found = codes >= 0
+    values[codes[found]] = pd.to_numeric(df[value_column], errors = 'coerce').to_numpy(dtype = float)[found]
+    return values
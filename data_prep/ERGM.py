@@ -0,0 +1,472 @@
+
+# Collection of functions for fitting exponential random graph models (ERGMs) to the networks exported by Features.get_network_data;
+# Reads the R_data nodes/edges files directly, so the models no longer require a round-trip to R;
+# Change statistics of all dyads are computed at once with (sparse) matrix products and the model is first fitted by MPLE,
+# then refined by MCMC-MLE (Geyer-Thompson), with the Markov chains of every network simulated in a shared process pool.
+
+import os
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.optimize import linprog
+from concurrent.futures import ProcessPoolExecutor
+
+# Node features which are not meaningful as covariates
+non_covariates = ['Country', 'Sub_Region', 'Region', 'ISO', 'Latitude', 'Longitude']
+
+def get_adjacency(nodes_df, edges_df):
+    '''
+    Parameters
+    ----------
+    nodes_df : pd.DataFrame
+        Node table with a 'Country' column.
+    edges_df : pd.DataFrame
+        Edge table whose first two columns are the source and target countries.
+    Returns
+    -------
+    A : scipy.sparse.csr_matrix
+        Sparse binary adjacency matrix (rows are senders) in the order of nodes_df; self-loops and unknown countries are dropped.
+    '''
+    # The edge columns are taken positionally: older csv exports have their 'to'/'from' headers reversed
+    index = {country: i for i, country in enumerate(nodes_df['Country'])}
+    edges = [(index[u], index[v]) for u, v in zip(edges_df.iloc[:, 0], edges_df.iloc[:, 1]) if u in index and v in index and u != v]
+    n = len(nodes_df)
+    rows = np.array([u for u, v in edges], dtype = int)
+    cols = np.array([v for u, v in edges], dtype = int)
+    A = sp.csr_matrix((np.ones(len(edges)), (rows, cols)), shape = (n, n))
+    A.data[:] = 1.0
+    return A
+
+def read_R_network(nodes_file, edges_file):
+    '''
+    Parameters
+    ----------
+    nodes_file : str
+        A '<drug>_nodes_<net>.csv' file from data/R_data.
+    edges_file : str
+        The matching '<drug>_edges_<net>.csv' file.
+    Returns
+    -------
+    (nodes_df, A) : tuple
+        Reads the node features and the sparse binary adjacency matrix (rows are senders) in the order of nodes_df.
+    '''
+    nodes_df = pd.read_csv(nodes_file, index_col = 0).reset_index(drop = True)
+    edges_df = pd.read_csv(edges_file, index_col = 0)
+    return nodes_df, get_adjacency(nodes_df, edges_df)
+
+def get_model(nodes_df, A, nodematch = ['Region', 'Sub_Region'], nodecov = None, gwesp_decay = 0.5, standardize = True):
+    '''
+    Parameters
+    ----------
+    nodes_df : pd.DataFrame
+    A : scipy.sparse matrix
+    nodematch : list of str, optional
+        Categorical attributes for nodematch terms. The default is ['Region', 'Sub_Region'].
+    nodecov : list of str, optional
+        Numerical attributes for nodecov terms; None uses every numerical feature.
+    gwesp_decay : float or None, optional
+        Decay of the GWESP term (outgoing two-paths); None drops the term. The default is 0.5.
+    standardize : bool, optional
+        If True, covariates are standardized (missing values are set to the mean).
+    Returns
+    -------
+    model : dict
+        Specification of the model: edges + mutual + nodematch + nodecov + gwesp.
+    '''
+    if nodecov is None:
+        nodecov = [col for col in nodes_df.columns if col not in non_covariates and pd.api.types.is_numeric_dtype(nodes_df[col])]
+
+    match = []
+    for attribute in nodematch:
+        codes = pd.factorize(nodes_df[attribute])[0]
+        match.append((codes[:, None] == codes[None, :]).astype(float))
+
+    covariates = []
+    for attribute in nodecov:
+        values = nodes_df[attribute].astype(float).to_numpy()
+        values = np.where(np.isnan(values), np.nanmean(values), values)
+        if standardize and values.std() > 0:
+            values = (values - values.mean()) / values.std()
+        covariates.append(values)
+
+    term_names = ['edges', 'mutual'] + [f'nodematch.{a}' for a in nodematch] + [f'nodecov.{a}' for a in nodecov]
+    if gwesp_decay is not None:
+        term_names.append(f'gwesp.OTP.fixed.{gwesp_decay}')
+
+    A = sp.csr_matrix(A, dtype = float)
+    A.setdiag(0)
+    A.eliminate_zeros()
+
+    return {'nodes': list(nodes_df['Country']), 'A': A, 'match': match, 'covariates': covariates,
+            'gwesp_decay': gwesp_decay, 'term_names': term_names}
+
+def get_model_statistics(model, A = None):
+    '''
+    Parameters
+    ----------
+    model : dict
+    A : scipy.sparse matrix, optional
+        Network on which to evaluate the statistics; the observed one by default.
+    Returns
+    -------
+    g : np.ndarray
+        Computes the sufficient statistics of the model.
+    '''
+    A = sp.csr_matrix(model['A'] if A is None else A)
+    g = [A.sum(), A.multiply(A.T).sum() / 2]
+    g += [A.multiply(M).sum() for M in model['match']]
+    in_degree, out_degree = np.asarray(A.sum(axis = 0)).ravel(), np.asarray(A.sum(axis = 1)).ravel()
+    g += [c @ (in_degree + out_degree) for c in model['covariates']]
+    if model['gwesp_decay'] is not None:
+        alpha = model['gwesp_decay']
+        SP = (A @ A).multiply(A).tocsr()
+        # Edges without shared partners contribute 0
+        g.append(np.exp(alpha) * (1 - (1 - np.exp(-alpha)) ** SP.data).sum())
+    return np.array(g, dtype = float)
+
+def get_change_statistics(model):
+    '''
+    Parameters
+    ----------
+    model : dict
+    Returns
+    -------
+    (X, y) : tuple
+        Computes the change statistics (X, one row per dyad i != j) and the dyad values (y) of the observed network.
+    '''
+    A = model['A']
+    n = A.shape[0]
+    Ad = A.toarray()
+    off_diagonal = ~np.eye(n, dtype = bool)
+
+    columns = [np.ones((n, n)), Ad.T]
+    columns += model['match']
+    columns += [c[:, None] + c[None, :] for c in model['covariates']]
+
+    if model['gwesp_decay'] is not None:
+        alpha = model['gwesp_decay']
+        r = 1 - np.exp(-alpha)
+        SP = (A @ A).toarray()
+        # Weight increments r^sp of the edges for which (i, j) completes a two-path, correcting for (i, j) itself
+        R = A.multiply(r ** SP).tocsr()
+        shared = (R @ A.T).toarray() + (A.T @ R).toarray()
+        columns.append(np.exp(alpha) * (1 - r ** SP) + shared * r ** (-Ad))
+
+    X = np.column_stack([column[off_diagonal] for column in columns])
+    y = Ad[off_diagonal]
+    return X, y
+
+def _fit_logistic(X, y, max_iter = 100, tol = 1e-8):
+    '''
+    Parameters
+    ----------
+    X : np.ndarray
+    y : np.ndarray
+    max_iter : int, optional
+    tol : float, optional
+    Returns
+    -------
+    (theta, cov) : tuple
+        Fits a logistic regression by Newton-Raphson and returns the estimates with their covariance matrix.
+    '''
+    theta = np.zeros(X.shape[1])
+    for _ in range(max_iter):
+        p = 1 / (1 + np.exp(-(X @ theta)))
+        gradient = X.T @ (y - p)
+        hessian = (X * (p * (1 - p))[:, None]).T @ X
+        step = np.linalg.lstsq(hessian, gradient, rcond = None)[0]
+        theta += step
+        if np.abs(step).max() < tol:
+            break
+    p = 1 / (1 + np.exp(-(X @ theta)))
+    cov = np.linalg.pinv((X * (p * (1 - p))[:, None]).T @ X)
+    return theta, cov
+
+def fit_mple(model):
+    '''
+    Parameters
+    ----------
+    model : dict
+    Returns
+    -------
+    (theta, cov) : tuple
+        Fits the model by maximum pseudo-likelihood.
+    '''
+    X, y = get_change_statistics(model)
+    return _fit_logistic(X, y)
+
+def _dyad_change(model, A, SP, i, j, rpow):
+    '''
+    Parameters
+    ----------
+    model : dict
+    A : np.ndarray
+        Dense current network.
+    SP : np.ndarray
+        Dense current two-path counts (A @ A).
+    i, j : int
+    rpow : np.ndarray
+        Powers of r = 1 - exp(-decay), indexed by exponent + 1.
+    Returns
+    -------
+    delta : np.ndarray
+        Change statistics of dyad (i, j) given the rest of the current network.
+    '''
+    delta = [1.0, A[j, i]]
+    delta += [M[i, j] for M in model['match']]
+    delta += [c[i] + c[j] for c in model['covariates']]
+    if model['gwesp_decay'] is not None:
+        a = int(A[i, j])
+        alpha = model['gwesp_decay']
+        shared = (A[i] * A[j] * rpow[SP[i] - a + 1]).sum() + (A[:, i] * A[:, j] * rpow[SP[:, j] - a + 1]).sum()
+        delta.append(np.exp(alpha) * (1 - rpow[SP[i, j] + 1]) + shared)
+    return np.array(delta)
+
+def _proposal_probability(is_edge, num_edges, num_dyads):
+    '''
+    Parameters
+    ----------
+    is_edge : bool
+        Whether the dyad is an edge of the current network.
+    num_edges : int
+        Number of edges of the current network.
+    num_dyads : int
+    Returns
+    -------
+    float
+        Probability that the tie-no-tie proposal picks a given dyad: half of the proposals pick an existing edge and half a random dyad,
+        except from the empty network, where every proposal picks a random dyad.
+    '''
+    if num_edges == 0:
+        return 1 / num_dyads
+    return (0.5 / num_edges if is_edge else 0.0) + 0.5 / num_dyads
+
+def simulate_statistics(model, theta, num_samples = 1000, interval = 100, burnin = 10000, seed = 0):
+    '''
+    Parameters
+    ----------
+    model : dict
+    theta : np.ndarray
+    num_samples : int, optional
+    interval : int, optional
+        Number of proposals between two samples.
+    burnin : int, optional
+    seed : int, optional
+    Returns
+    -------
+    samples : np.ndarray (num_samples x terms)
+        Runs a Metropolis-Hastings chain (tie-no-tie proposals) from the observed network and records the statistics of the sampled networks.
+    '''
+    rng = np.random.default_rng(seed)
+    A = model['A'].toarray().astype(np.int64)
+    n = A.shape[0]
+    SP = A @ A
+    g = get_model_statistics(model)
+    num_dyads = n * (n - 1)
+
+    alpha = model['gwesp_decay'] if model['gwesp_decay'] is not None else 1.0
+    rpow = (1 - np.exp(-alpha)) ** np.arange(-1, n + 1, dtype = float)
+
+    # Edge list with positions, for sampling existing edges in O(1)
+    edges = [(i, j) for i, j in zip(*np.nonzero(A))]
+    position = {edge: k for k, edge in enumerate(edges)}
+
+    samples = np.zeros((num_samples, len(g)))
+    for step in range(burnin + num_samples * interval):
+
+        # Tie-no-tie: half of the proposals toggle an existing edge, half a random dyad
+        if len(edges) > 0 and rng.random() < 0.5:
+            i, j = edges[rng.integers(len(edges))]
+        else:
+            i, j = rng.integers(n), rng.integers(n - 1)
+            j += j >= i
+
+        delta = _dyad_change(model, A, SP, i, j, rpow)
+        num_edges = len(edges)
+        if A[i, j]:
+            sign = -1.0
+            # Reverse move: adding (i, j) back to the network with one edge less
+            q_ratio = _proposal_probability(False, num_edges - 1, num_dyads) / _proposal_probability(True, num_edges, num_dyads)
+        else:
+            sign = 1.0
+            # Reverse move: removing (i, j) from the network with one edge more
+            q_ratio = _proposal_probability(True, num_edges + 1, num_dyads) / _proposal_probability(False, num_edges, num_dyads)
+
+        if np.log(rng.random()) < sign * (theta @ delta) + np.log(q_ratio):
+            g += sign * delta
+            if sign > 0:
+                A[i, j] = 1
+                SP[i] += A[j]
+                SP[:, j] += A[:, i]
+                position[(i, j)] = len(edges)
+                edges.append((i, j))
+            else:
+                A[i, j] = 0
+                SP[i] -= A[j]
+                SP[:, j] -= A[:, i]
+                k = position.pop((i, j))
+                last = edges.pop()
+                if k < len(edges):
+                    edges[k] = last
+                    position[last] = k
+
+        if step >= burnin and (step - burnin + 1) % interval == 0:
+            samples[(step - burnin) // interval] = g
+
+    return samples
+
+def _in_hull(point, samples):
+    '''
+    Parameters
+    ----------
+    point : np.ndarray
+    samples : np.ndarray
+    Returns
+    -------
+    bool
+        Checks whether the point lies in the convex hull of the samples (LP feasibility).
+    '''
+    m = samples.shape[0]
+    result = linprog(np.zeros(m), A_eq = np.vstack([samples.T, np.ones(m)]), b_eq = np.append(point, 1.0),
+                     bounds = (0, None), method = 'highs')
+    return result.status == 0
+
+def _update_theta(theta, g_obs, samples, margin = 0.95):
+    '''
+    Parameters
+    ----------
+    theta : np.ndarray
+        Parameters the samples were simulated at.
+    g_obs : np.ndarray
+    samples : np.ndarray
+    margin : float, optional
+        Safety factor applied to the step length.
+    Returns
+    -------
+    (theta, gamma) : tuple
+        Maximizes the lognormal approximation of the log-likelihood ratio around theta (as ergm's default MCMC-MLE metric).
+        Following Hummel, Hunter & Handcock (2012), the observed statistics are replaced by the point gamma * g_obs + (1 - gamma) * mean,
+        with the largest gamma keeping it inside the convex hull of the samples; gamma = 1 means the full step was taken.
+    '''
+    # Drop constant statistics, which carry no information on the step
+    keep = samples.std(axis = 0) > 0
+    mean = samples.mean(axis = 0)
+
+    gamma = 1.0
+    if not _in_hull(g_obs[keep], samples[:, keep]):
+        low, high = 0.0, 1.0
+        for _ in range(20):
+            mid = (low + high) / 2
+            if _in_hull(mid * g_obs[keep] + (1 - mid) * mean[keep], samples[:, keep]):
+                low = mid
+            else:
+                high = mid
+        gamma = low * margin
+    target = gamma * g_obs + (1 - gamma) * mean
+
+    theta = theta.copy()
+    theta[keep] += np.linalg.pinv(np.cov(samples[:, keep], rowvar = False)) @ (target - mean)[keep]
+    return theta, gamma
+
+def _summarize(model, theta, cov, method, converged = True):
+    std_error = np.sqrt(np.clip(np.diag(cov), 0, None))
+    return pd.DataFrame({'Term': model['term_names'], 'Estimate': theta, 'Std_error': std_error,
+                         'z': np.divide(theta, std_error, out = np.full(len(theta), np.nan), where = std_error > 0),
+                         'Method': method, 'Converged': converged})
+
+def fit_ergms(models, mcmc = True, num_iterations = 20, num_chains = 4, num_samples = 500, interval = 100, burnin = 10000,
+              max_workers = None, seed = 0):
+    '''
+    Parameters
+    ----------
+    models : dict
+        {key: model}, e.g. from get_R_models.
+    mcmc : bool, optional
+        If False, only the MPLE is computed.
+    num_iterations : int, optional
+        Maximum number of MCMC-MLE iterations.
+    num_chains : int, optional
+        Number of chains per model and iteration; all chains of all models run in one process pool.
+    num_samples, interval, burnin : int, optional
+        Per-chain MCMC settings.
+    max_workers : int, optional
+    seed : int, optional
+    Returns
+    -------
+    output_df : pd.DataFrame
+        Estimates of every model in one tidy table (Key, Term, Estimate, Std_error, z, Method, Converged).
+        MCMC-MLE fits which did not reach two consecutive full steps within num_iterations are flagged as not converged.
+    '''
+    theta, frames = dict(), []
+    for key, model in models.items():
+        theta[key], cov = fit_mple(model)
+        frames.append(_summarize(model, theta[key], cov, 'MPLE').assign(Key = [key] * len(model['term_names'])))
+
+    if mcmc:
+        g_obs = {key: get_model_statistics(model) for key, model in models.items()}
+        # Models stop updating after two consecutive full (gamma = 1) steps
+        full_steps = {key: 0 for key in models.keys()}
+        active = list(models.keys())
+        with ProcessPoolExecutor(max_workers = max_workers) as executor:
+
+            def _simulate(keys, iteration):
+                futures = {(key, chain): executor.submit(simulate_statistics, models[key], theta[key], num_samples, interval, burnin,
+                                                         seed + 1000 * iteration + chain)
+                           for key in keys for chain in range(num_chains)}
+                return {key: np.vstack([futures[(key, chain)].result() for chain in range(num_chains)]) for key in keys}
+
+            for iteration in range(num_iterations):
+                samples = _simulate(active, iteration)
+                for key in active:
+                    theta[key], gamma = _update_theta(theta[key], g_obs[key], samples[key])
+                    full_steps[key] = full_steps[key] + 1 if gamma == 1.0 else 0
+                active = [key for key in active if full_steps[key] < 2]
+                if len(active) == 0:
+                    break
+
+            # Final round of simulations, for the covariance at the final parameters
+            samples = _simulate(list(models.keys()), num_iterations)
+
+        for key, model in models.items():
+            cov = np.linalg.pinv(np.cov(samples[key], rowvar = False))
+            frames.append(_summarize(model, theta[key], cov, 'MCMC-MLE', converged = full_steps[key] >= 2).assign(Key = [key] * len(model['term_names'])))
+
+    output_df = pd.concat(frames, ignore_index = True)
+    return output_df[['Key', 'Term', 'Estimate', 'Std_error', 'z', 'Method', 'Converged']]
+
+def get_R_models(R_data_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/R_data/', drug_list = ['Cocaine', 'Heroin'], R_format = 'csv', **model_kwargs):
+    '''
+    Parameters
+    ----------
+    R_data_path : str, optional
+    drug_list : list of str, optional
+    R_format : str, optional
+        'csv' for the per-network files, 'parquet' or 'arrow' for the partitioned datasets of Features.write_R_dataset. The default is 'csv'.
+    **model_kwargs
+        Passed to get_model.
+    Returns
+    -------
+    models : dict
+        Builds the model of every exported network, keyed by (drug, net), where net is a year or 'aggregate_<start>_<end>'.
+    '''
+    models = dict()
+    for drug in drug_list:
+        if R_format != 'csv':
+            # Only the datasets need Features (and pyarrow)
+            import Features
+            nodes_df, edges_df = Features.read_R_dataset(R_data_path, drug, R_format = R_format)
+            for net in sorted(nodes_df['Period'].unique()):
+                nodes_net = nodes_df[nodes_df['Period'] == net].drop(columns = 'Period').reset_index(drop = True)
+                edges_net = edges_df[edges_df['Period'] == net]
+                models[(drug, int(net) if net.isdigit() else net)] = get_model(nodes_net, get_adjacency(nodes_net, edges_net), **model_kwargs)
+            continue
+        prefix = f'{drug}_nodes_'
+        for file in sorted(os.listdir(R_data_path)):
+            if file.startswith(prefix) and file.endswith('.csv'):
+                net = file[len(prefix):-len('.csv')]
+                edges_file = os.path.join(R_data_path, f'{drug}_edges_{net}.csv')
+                if not os.path.exists(edges_file):
+                    continue
+                nodes_df, A = read_R_network(os.path.join(R_data_path, file), edges_file)
+                models[(drug, int(net) if net.isdigit() else net)] = get_model(nodes_df, A, **model_kwargs)
+    return models
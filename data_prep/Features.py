@@ -1,6 +1,8 @@
 import numpy as np
 import pandas as pd
 import networkx as nx
+import scipy.sparse as sp
+import Countries
 import Seizures
 import Aggregation
 
@@ -224,11 +226,13 @@ def get_gdp_per_capita(countries_list, file = "/Users/mateicosa/Bocconi/BIDSA/Ne
     for i in range(start_year, end_year + 1):
         output_df[i] = pd.DataFrame(columns = ['Country', 'GDP/capita'])
     
+    # Integer join of the GDP table onto the countries
+    registry = Countries.get_country_registry(countries_list)
+    codes = Countries.get_country_codes(countries_list, registry)
     for year in range(start_year, end_year + 1):
         year_format = f"{year} [YR{year}]"
-        for country in countries_list:
-            row = {'Country': country, 'GDP/capita': float(df_gdp[df_gdp['Country Name'] == country][year_format])}
-            output_df[year].loc[len(output_df[year])] = row
+        values = Countries.get_country_values(df_gdp, 'Country Name', year_format, registry)
+        output_df[year] = pd.DataFrame({'Country': list(countries_list), 'GDP/capita': values[codes]})
         
     # Return output_df
     return output_df
@@ -249,32 +253,7 @@ def get_coordinates(countries_list, file = '/Users/mateicosa/Bocconi/BIDSA/Netwo
     df_coord = pd.read_csv(file)
     
     # Replace countries names for consistency
-    names_to_replace = {
-    'Moldova': 'Moldova, Republic of',
-    'R?union': 'Réunion',
-    'Bolivia': 'Bolivia, Plurinational State of',
-    'Taiwan': 'Taiwan, Province of China',
-    'Iran': 'Iran, Islamic Republic of',
-    'S?o Tom? and Pr?ncipe': 'Sao Tome and Principe',
-    'Laos': "Lao People's Democratic Republic",
-    'Macedonia [FYROM]': 'North Macedonia',
-    'North Korea': "Korea, Democratic People's Republic of",
-    'Swaziland': 'Eswatini',
-    'Saint Lucia': 'St. Lucia',
-    'Venezuela': 'Venezuela, Bolivarian Republic of',
-    'Tanzania': 'Tanzania, United Republic of',
-    'Vietnam': 'Viet Nam',
-    "C?te d'Ivoire": "Côte d'Ivoire",
-    'Kosovo': 'Kosovo under UNSCR 1244',
-    'Syria': 'Syrian Arab Republic',
-    'Libya': 'Libyan Arab Jamahiriya',
-    'Myanmar [Burma]': 'Myanmar',
-    'Russia': 'Russian Federation',
-    'South Korea': 'Korea, Republic of',
-    'Congo [Republic]': 'Congo',
-    'Congo [DRC]': 'Congo, the Democratic Republic of the'
-    }
-    df_coord['name'] = df_coord['name'].replace(names_to_replace)
+    df_coord['name'] = df_coord['name'].replace(Countries.aliases)
     
     # Fill in missing values
     df_coord.loc[len(df_coord)] = {
@@ -288,7 +267,8 @@ def get_coordinates(countries_list, file = '/Users/mateicosa/Bocconi/BIDSA/Netwo
     df_coord = df_coord.rename(columns = {'country': 'ISO', 'latitude': 'Latitude', 'longitude': 'Longitude', 'name': 'Country'})
     
     # Pick only the countries in countries_list
-    df_coord = df_coord.query("Country in @countries_list")
+    registry = Countries.get_country_registry(countries_list)
+    df_coord = df_coord[np.isin(Countries.get_country_codes(df_coord['Country'], registry), Countries.get_country_codes(countries_list, registry))]
     df_coord = df_coord.reset_index(drop = True)
     
     # Missing ISO for Namibia
@@ -327,20 +307,30 @@ def get_social_indicators(countries_list, file = '/Users/mateicosa/Bocconi/BIDSA
                                               'Gov_Effectiveness', 'Stability_No_Terrorism',
                                               'Regulatory_Quality', 'Rule_of_Law'])
     
+    # Integer join of every indicator onto the countries
+    series = {'Control_of_Corruption': 'Control of Corruption: Estimate',
+              'Gov_Effectiveness': 'Government Effectiveness: Estimate',
+              'Stability_No_Terrorism': 'Political Stability and Absence of Violence/Terrorism: Estimate',
+              'Regulatory_Quality': 'Regulatory Quality: Estimate',
+              'Rule_of_Law': 'Rule of Law: Estimate'}
+    registry = Countries.get_country_registry(countries_list)
+    codes = Countries.get_country_codes(countries_list, registry)
+    gov_codes = Countries.get_country_codes(df_gov['Country Name'], registry)
+
+    # Countries missing any of the indicators are skipped
+    found = np.ones(len(registry), dtype = bool)
+    for name in series.values():
+        found &= np.isin(np.arange(len(registry)), gov_codes[(df_gov['Series Name'] == name).to_numpy()])
+    for country, code in zip(countries_list, codes):
+        if not found[code]:
+            print(country)
+
     for year in range(start_year, end_year + 1):
         year_format = f"{year} [YR{year}]"
-        for country in countries_list:
-            try:
-                row = {'Country': country, 
-                       'Control_of_Corruption': float(df_gov[(df_gov['Country Name'] == country) & (df_gov['Series Name'] == 'Control of Corruption: Estimate')][year_format]),
-                       'Gov_Effectiveness': float(df_gov[(df_gov['Country Name'] == country) & (df_gov['Series Name'] == 'Government Effectiveness: Estimate')][year_format]),
-                       'Stability_No_Terrorism': float(df_gov[(df_gov['Country Name'] == country) & (df_gov['Series Name'] == 'Political Stability and Absence of Violence/Terrorism: Estimate')][year_format]),
-                       'Regulatory_Quality': float(df_gov[(df_gov['Country Name'] == country) & (df_gov['Series Name'] == 'Regulatory Quality: Estimate')][year_format]),
-                       'Rule_of_Law': float(df_gov[(df_gov['Country Name'] == country) & (df_gov['Series Name'] == 'Rule of Law: Estimate')][year_format])
-                       }
-                output_df[year].loc[len(output_df[year])] = row
-            except:
-                print(country)
+        output_df[year] = pd.DataFrame({'Country': [country for country, code in zip(countries_list, codes) if found[code]]})
+        for column, name in series.items():
+            values = Countries.get_country_values(df_gov, 'Country Name', year_format, registry, mask = df_gov['Series Name'] == name)
+            output_df[year][column] = values[codes[found[codes]]]
     
     # Return the output
     return output_df
@@ -404,6 +394,59 @@ def get_node_attributes(drug, df_ids, start_year = 2006, end_year = 2017):
     # Return the output
     return output_df
 
+# Columns which are not averaged over time
+static_cols = ['Country', 'Sub_Region', 'Region', 'ISO', 'Latitude', 'Longitude']
+
+def get_cumulative_features(df, start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    df : dict of pd.DataFrames
+        Output of get_node_attributes.
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    cumulative : dict
+        Stacks the yearly features into cumulative sums over the years (cumulative['sum'][k] holds the sum of the first k years),
+        together with the cumulative number of missing values, so that the average over any window is a single subtraction.
+    '''
+    countries = list(df[start_year]['Country'])
+    avg_cols = [col for col in list(df[start_year].columns) if col not in static_cols]
+
+    # (years x countries x features), aligned on the countries of the first year
+    values = np.stack([df[year].set_index('Country').reindex(countries)[avg_cols].to_numpy(dtype = float)
+                       for year in range(start_year, end_year + 1)])
+    missing = np.isnan(values)
+
+    zeros = np.zeros((1,) + values.shape[1:])
+    return {'countries': countries, 'columns': avg_cols, 'start_year': start_year,
+            'static': df[start_year].copy(),
+            'sum': np.concatenate([zeros, np.cumsum(np.where(missing, 0.0, values), axis = 0)]),
+            'missing': np.concatenate([zeros, np.cumsum(missing, axis = 0)])}
+
+def get_window_features(cumulative, first_year, last_year):
+    '''
+    Parameters
+    ----------
+    cumulative : dict
+        Output of get_cumulative_features.
+    first_year : int
+    last_year : int
+    Returns
+    -------
+    output_df : pd.DataFrame
+        Average features over [first_year, last_year]; a feature missing in any year of the window is missing.
+    '''
+    a, b = first_year - cumulative['start_year'], last_year - cumulative['start_year'] + 1
+    if a < 0 or b >= len(cumulative['sum']) or a >= b:
+        raise Exception('Invalid years!')
+    average = (cumulative['sum'][b] - cumulative['sum'][a]) / (b - a)
+    average[(cumulative['missing'][b] - cumulative['missing'][a]) > 0] = np.nan
+    output_df = cumulative['static'].copy()
+    output_df[cumulative['columns']] = average
+    return output_df
+
 def aggregate_yearly_features(df, start_year = 2006, end_year = 2017):
     '''
     Parameters
@@ -416,18 +459,93 @@ def aggregate_yearly_features(df, start_year = 2006, end_year = 2017):
     df : dict of pd.DataFrames
         Adds an additional pd.DataFrame to the input dict which contains average features across the time period
     '''
-    # Create a new dataframe and make it containt the start_year values
-    df['total'] = df[start_year].copy()
-    
-    # Get the column names over which we want to average
-    avg_cols = [col for col in list(df[start_year].columns) if col not in ['Country', 'Sub_Region', 'Region', 'ISO', 'Latitude', 'Longitude']]
-    
-    # Iterate over the time period and average over the columns in avg_cols
-    for year in range(start_year + 1, end_year + 1):
-        df['total'][avg_cols] += df[year][avg_cols]
-    df['total'][avg_cols] /= (end_year - start_year + 1)
+    df['total'] = get_window_features(get_cumulative_features(df, start_year = start_year, end_year = end_year), start_year, end_year)
     return df
 
+def get_cumulative_weights(G, start_year = 2006, end_year = 2017, weight = 'weight'):
+    '''
+    Parameters
+    ----------
+    G : dict of nx.DiGraphs
+    start_year : int, optional
+    end_year : int, optional
+    weight : str, optional
+    Returns
+    -------
+    cumulative : dict
+        Converts the yearly networks to sparse matrices over a common node list and accumulates them over the years:
+        cumulative['weights'][k] and cumulative['counts'][k] hold the total weight and the number of years of every edge in the first k years.
+    '''
+    nodes = sorted(set().union(*[set(G[year].nodes) for year in range(start_year, end_year + 1)]))
+    index = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+
+    weights, counts = [sp.csr_matrix((n, n))], [sp.csr_matrix((n, n))]
+    for year in range(start_year, end_year + 1):
+        edges = list(G[year].edges(data = weight, default = 0.0))
+        rows = np.array([index[u] for u, v, w in edges], dtype = int)
+        cols = np.array([index[v] for u, v, w in edges], dtype = int)
+        W = sp.csr_matrix((np.array([w for u, v, w in edges], dtype = float), (rows, cols)), shape = (n, n))
+        B = sp.csr_matrix((np.ones(len(edges)), (rows, cols)), shape = (n, n))
+        weights.append((weights[-1] + W).tocsr())
+        counts.append((counts[-1] + B).tocsr())
+
+    return {'nodes': nodes, 'start_year': start_year, 'weights': weights, 'counts': counts}
+
+def get_window_network(cumulative, first_year, last_year):
+    '''
+    Parameters
+    ----------
+    cumulative : dict
+        Output of get_cumulative_weights.
+    first_year : int
+    last_year : int
+    Returns
+    -------
+    network : nx.DiGraph
+        Weighted union of the yearly networks over [first_year, last_year]: 'weight' is the total over the window and 'years' the number of years the edge appears in.
+    '''
+    a, b = first_year - cumulative['start_year'], last_year - cumulative['start_year'] + 1
+    if a < 0 or b >= len(cumulative['weights']) or a >= b:
+        raise Exception('Invalid years!')
+    W = (cumulative['weights'][b] - cumulative['weights'][a]).tocsr()
+    C = (cumulative['counts'][b] - cumulative['counts'][a]).tocoo()
+    nodes = cumulative['nodes']
+
+    # Edges are taken from the counts, so that edges with zero total weight are kept as well
+    rows, cols, years = C.row[C.data > 0], C.col[C.data > 0], C.data[C.data > 0]
+    edge_weights = np.asarray(W[rows, cols]).ravel()
+
+    network = nx.DiGraph()
+    network.add_edges_from((nodes[i], nodes[j], {'weight': w, 'years': int(c)}) for i, j, w, c in zip(rows, cols, edge_weights, years))
+    return network
+
+def get_sliding_windows(G, df, window_size = 3, step = 1, start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    G : dict of nx.DiGraphs
+    df : dict of pd.DataFrames
+        Output of get_node_attributes.
+    window_size : int, optional
+        Number of years per window. The default is 3.
+    step : int, optional
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    output : dict
+        Weighted aggregate network and average features of every window, keyed by (first_year, last_year).
+    '''
+    cumulative_weights = get_cumulative_weights(G, start_year = start_year, end_year = end_year)
+    cumulative_features = get_cumulative_features(df, start_year = start_year, end_year = end_year)
+    output = dict()
+    for first_year in range(start_year, end_year - window_size + 2, step):
+        last_year = first_year + window_size - 1
+        output[(first_year, last_year)] = {'network': get_window_network(cumulative_weights, first_year, last_year),
+                                           'features': get_window_features(cumulative_features, first_year, last_year)}
+    return output
+
 def aggregate_yearly_edges(G, start_year = 2006, end_year = 2017):
     '''
     Parameters
@@ -438,20 +556,124 @@ def aggregate_yearly_edges(G, start_year = 2006, end_year = 2017):
     Returns
     -------
     list(edge_set) : list
-        Returns a list of all edges present in the yearly networks across the time period
+        Returns a list of all edges present in the yearly networks across the time period (both ends included)
+    '''
+    return list(get_window_network(get_cumulative_weights(G, start_year = start_year, end_year = end_year), start_year, end_year).edges)
+
+# Formats of the R data: csv files, or partitioned Parquet / Arrow (IPC) datasets
+R_formats = ['csv', 'parquet', 'arrow']
+
+def get_R_dataset_path(R_data_path, drug, table):
+    '''
+    Parameters
+    ----------
+    R_data_path : str
+    drug : str
+    table : str
+        'nodes' or 'edges'.
+    Returns
+    -------
+    dataset_path : str
+        Folder of a partitioned dataset written by write_R_dataset.
     '''
-    edge_set = set()
-    for year in range(start_year, end_year):
-        for edge in G[year].edges:
-            edge_set.add(edge)
-    return list(edge_set)
+    return R_data_path.rstrip('/') + '/' + f'{drug}_{table}'
+
+def get_R_period_label(net, start_year, end_year):
+    '''
+    Parameters
+    ----------
+    net : int or str
+        A year or 'total'.
+    start_year : int
+    end_year : int
+    Returns
+    -------
+    label : str
+        Value of the 'Period' partition column: the year, or 'aggregate_<start>_<end>' like the csv file names.
+    '''
+    return f'aggregate_{start_year}_{end_year}' if net == 'total' else str(net)
+
+def get_arrow_dataset_module():
+    '''
+    Returns
+    -------
+    (pa, ds) : tuple
+        The pyarrow and pyarrow.dataset modules, imported on first use since only the Parquet / Arrow exports need them.
+    '''
+    try:
+        import pyarrow as pa
+        import pyarrow.dataset as ds
+    except ImportError:
+        raise Exception('The parquet and arrow formats require pyarrow!')
+    return pa, ds
+
+def write_R_dataset(output_R, drug, R_data_path, R_format = 'parquet', start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    output_R : dict
+        E.g. output['R'] of get_network_data: {'nodes_<net>': nodes_df, 'edges_<net>': edges_df}.
+    drug : str
+    R_data_path : str
+    R_format : str, optional
+        'parquet' or 'arrow' (Arrow IPC files, which can be memory-mapped). The default is 'parquet'.
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    (nodes_path, edges_path) : tuple
+        Writes the node and edge tables of all the networks as two datasets, '<drug>_nodes' and '<drug>_edges',
+        hive-partitioned by the string column 'Period' (see get_R_period_label); partitions being written replace existing ones.
+        Both can be read with read_R_dataset, pd.read_parquet (for parquet) or arrow::open_dataset in R.
+    '''
+    if R_format not in ['parquet', 'arrow']:
+        raise Exception("Invalid format, choose 'parquet' or 'arrow'!")
+    pa, ds = get_arrow_dataset_module()
+    partitioning = ds.partitioning(pa.schema([('Period', pa.string())]), flavor = 'hive')
+
+    paths = []
+    for table in ['nodes', 'edges']:
+        frames = [df.assign(Period = get_R_period_label(key[len(table) + 1:], start_year, end_year))
+                  for key, df in output_R.items() if key.startswith(table + '_')]
+        df = pd.concat(frames, ignore_index = True)
+        dataset_path = get_R_dataset_path(R_data_path, drug, table)
+        ds.write_dataset(pa.Table.from_pandas(df, preserve_index = False), dataset_path,
+                         format = 'ipc' if R_format == 'arrow' else 'parquet', partitioning = partitioning,
+                         existing_data_behavior = 'delete_matching')
+        paths.append(dataset_path)
+    return tuple(paths)
+
+def read_R_dataset(R_data_path, drug, period = None, R_format = 'parquet'):
+    '''
+    Parameters
+    ----------
+    R_data_path : str
+    drug : str
+    period : str or int, optional
+        Only this period (a year or 'aggregate_<start>_<end>'); by default all of them.
+    R_format : str, optional
+        'parquet' or 'arrow'. The default is 'parquet'.
+    Returns
+    -------
+    (nodes_df, edges_df) : tuple
+        Reads back the datasets of write_R_dataset, with the 'Period' column; only the requested partitions are read.
+    '''
+    pa, ds = get_arrow_dataset_module()
+    partitioning = ds.partitioning(pa.schema([('Period', pa.string())]), flavor = 'hive')
+    output = []
+    for table in ['nodes', 'edges']:
+        dataset = ds.dataset(get_R_dataset_path(R_data_path, drug, table), format = 'ipc' if R_format == 'arrow' else 'parquet', partitioning = partitioning)
+        row_filter = None if period is None else ds.field('Period') == str(period)
+        df = dataset.to_table(filter = row_filter).to_pandas()
+        output.append(df.assign(Period = df['Period'].astype(str)))
+    return tuple(output)
 
 def get_network_data(drug, df_ids = None,  
                      for_pyg = True, for_R = True,
                      aggregate_over_time_period = True,
                      write_to_file = True, 
                      base_file_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/',
-                     start_year = 2006, end_year = 2017):
+                     start_year = 2006, end_year = 2017, node_attributes = None, R_format = 'csv'):
     '''
     Parameters
     ----------
@@ -459,9 +681,15 @@ def get_network_data(drug, df_ids = None,
     df_ids : dict of pd.DataFrames
     for_pyg : bool, optional (pytorch_geometric format)
     for_R : bool, optionl (R format)
+    node_attributes : dict of pd.DataFrames, optional
+        Extra per-country columns keyed by year (and 'total'), e.g. Uncertainty.get_band_attributes of the market bands;
+        they are added as node attributes of the pyg networks (outside of x) and as columns of the R node tables.
     base_file_path : str, optional
     start_year : int, optional
     end_year : int, optional
+    R_format : str, optional
+        'csv' writes one nodes and one edges file per network; 'parquet' or 'arrow' write two datasets per drug, partitioned by period (see write_R_dataset).
+        The default is 'csv'.
     Returns
     -------
     output_networl : nx.DiGraph
@@ -473,10 +701,15 @@ def get_network_data(drug, df_ids = None,
         raise Exception("The data must be prepared either for pyg or for R!")
     if start_year < 2006 or end_year > 2017:
         raise Exception("Data is available only for period 2006-2017!")
+    if R_format not in R_formats:
+        raise Exception(f'Invalid R format, choose from {R_formats}!')
 
     # If no IDS data is not loaded, read it
     if df_ids is None:
         df_ids = Seizures.read_xlsx()
+
+    # Country IDs are shared by all the drugs and periods of df_ids
+    Countries.build_country_registry(df_ids)
     
     # Get the node attributes
     df_yearly = get_node_attributes(drug, df_ids, start_year = start_year, end_year = end_year)
@@ -484,7 +717,8 @@ def get_network_data(drug, df_ids = None,
     
     # Get the edge data
     dict_of_nets = Seizures.get_drug_network_by_year(drug, df_ids, start_year = start_year, end_year= end_year)
-    aggregate_edge_list = aggregate_yearly_edges(dict_of_nets, start_year = start_year, end_year = end_year)
+    aggregate_network = get_window_network(get_cumulative_weights(dict_of_nets, start_year = start_year, end_year = end_year), start_year, end_year)
+    aggregate_edge_list = list(aggregate_network.edges)
     
     # Add the features
     for year in range(start_year, end_year + 1):
@@ -514,6 +748,9 @@ def get_network_data(drug, df_ids = None,
             for index, row in df_features.iterrows():
                 node_list.append((row['Country'], {'y': row['Country'], 'x': list(row[1:])})) 
             output_network.add_nodes_from(node_list)
+            if node_attributes is not None and net in node_attributes:
+                extra = node_attributes[net][node_attributes[net]['Country'].isin(output_network.nodes)]
+                nx.set_node_attributes(output_network, extra.set_index('Country').to_dict(orient = 'index'))
             if net == 'total':
                 output_network.add_edges_from(aggregate_edge_list)
             else:
@@ -548,19 +785,19 @@ def get_network_data(drug, df_ids = None,
 
             # Get the node features
             nodes_df = df_aggregate[net]
+            if node_attributes is not None and net in node_attributes:
+                nodes_df = nodes_df.merge(node_attributes[net], on = 'Country', how = 'left')
 
-            # Get the edges
-            if net == 'total':
-                edges_df = pd.DataFrame(aggregate_edge_list, columns = ['to', 'from'])
-            else:
-                edges_df = pd.DataFrame(dict_of_nets[net].edges, columns = ['to', 'from'])
+            # Get the edges, in (source, target) order, with their weights
+            network = aggregate_network if net == 'total' else dict_of_nets[net]
+            edges_df = pd.DataFrame(list(network.edges(data = 'weight')), columns = ['from', 'to', 'weight'])
 
             # Add the datasets to the output
             output['R'][f'nodes_{net}'] = nodes_df
             output['R'][f'edges_{net}'] = edges_df
             
             # Write the output
-            if write_to_file:
+            if write_to_file and R_format == 'csv':
                 
                 # Create the path
                 if net == 'total':
@@ -573,5 +810,9 @@ def get_network_data(drug, df_ids = None,
                 # Write to the given path in .csv format
                 nodes_df.to_csv(write_file_path_nodes)
                 edges_df.to_csv(write_file_path_edges)
+
+        # Write all the networks of the drug as two partitioned datasets
+        if write_to_file and R_format != 'csv':
+            write_R_dataset(output['R'], drug, base_file_path + 'R_data', R_format = R_format, start_year = start_year, end_year = end_year)
             
     return output
\ No newline at end of file
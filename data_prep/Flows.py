@@ -0,0 +1,230 @@
+
+# Collection of functions for estimating trafficking flows consistent with the yearly drug networks;
+# Producers act as sources, national markets (kg) as sinks and purity-adjusted seizures bound the capacity of each route;
+# Each (drug, year) is a sparse min-cost max-flow linear program solved with HiGHS;
+# Problems are solved in a process pool and, when highspy is installed, each year is warm-started from the previous one.
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from scipy.optimize import linprog
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import highspy
+except ImportError:
+    highspy = None
+
+def get_flow_problem(network, seizure_rate = 0.1, weight = 'weight'):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+        Output of Seizures.get_drug_network_by_year for a given year.
+    seizure_rate : float or None, optional
+        Share of the flow along a route assumed to be seized; the capacity of an edge is weight / seizure_rate. None leaves edges uncapacitated.
+    weight : str, optional
+    Returns
+    -------
+    problem : dict
+        Builds the linear program: variables are edge flows, producer supplies and market deliveries;
+        flow is conserved at every node, deliveries are bounded by the market, and the objective maximizes delivered volume at minimum number of hops.
+    '''
+    nodes = list(network.nodes)
+    index = {node: i for i, node in enumerate(nodes)}
+    n = len(nodes)
+
+    edges = list(network.edges)
+    src = np.array([index[u] for u, v in edges], dtype = int)
+    dst = np.array([index[v] for u, v in edges], dtype = int)
+    weights = np.array([network.edges[e].get(weight, 0.0) for e in edges], dtype = float)
+
+    producers = np.array([i for i, node in enumerate(nodes) if network.nodes[node].get('producer', False)], dtype = int)
+    market = np.array([float(network.nodes[node].get('market', 0.0)) for node in nodes])
+    markets = np.flatnonzero(market > 0)
+
+    E, P, M = len(edges), len(producers), len(markets)
+
+    # Node x variable incidence matrix: inflow +1, outflow -1
+    rows = np.concatenate([src, dst, producers, markets])
+    cols = np.concatenate([np.arange(E), np.arange(E), E + np.arange(P), E + P + np.arange(M)])
+    vals = np.concatenate([-np.ones(E), np.ones(E), np.ones(P), -np.ones(M)])
+    A_eq = sp.csc_matrix((vals, (rows, cols)), shape = (n, E + P + M))
+
+    # Each hop costs 1; every delivered kg is worth more than the longest possible route
+    cost = np.concatenate([np.ones(E), np.zeros(P), -float(n) * np.ones(M)])
+
+    capacity = weights / seizure_rate if seizure_rate is not None else np.full(E, np.inf)
+    lower = np.zeros(E + P + M)
+    upper = np.concatenate([capacity, np.full(P, np.inf), market[markets]])
+
+    return {'nodes': nodes, 'edges': edges, 'weights': weights, 'capacity': capacity,
+            'producers': producers, 'markets': markets, 'market': market,
+            'A_eq': A_eq, 'cost': cost, 'lower': lower, 'upper': upper}
+
+def _get_warm_start(problem, previous):
+    '''
+    Parameters
+    ----------
+    problem : dict
+    previous : dict or None
+        Solution of the previous year.
+    Returns
+    -------
+    x0 : np.ndarray or None
+        Maps the previous year's flows, supplies and deliveries onto the current variables (by edge and country), clipped to the current bounds.
+    '''
+    if previous is None:
+        return None
+    edge_flows = dict(zip(previous['edges'], previous['x'][:len(previous['edges'])]))
+    supplies = dict(zip([previous['nodes'][i] for i in previous['producers']], previous['x'][len(previous['edges']):len(previous['edges']) + len(previous['producers'])]))
+    deliveries = dict(zip([previous['nodes'][i] for i in previous['markets']], previous['x'][len(previous['edges']) + len(previous['producers']):]))
+    x0 = np.concatenate([[edge_flows.get(e, 0.0) for e in problem['edges']],
+                         [supplies.get(problem['nodes'][i], 0.0) for i in problem['producers']],
+                         [deliveries.get(problem['nodes'][i], 0.0) for i in problem['markets']]])
+    return np.clip(x0, problem['lower'], problem['upper'])
+
+def _solve_lp(problem, x0 = None):
+    '''
+    Parameters
+    ----------
+    problem : dict
+    x0 : np.ndarray, optional
+        Starting point (used only with highspy).
+    Returns
+    -------
+    (x, status) : tuple
+        Solves the linear program with HiGHS, through highspy when available, otherwise through scipy.optimize.linprog.
+    '''
+    A = problem['A_eq']
+    num_row, num_col = A.shape
+    if num_col == 0:
+        return np.zeros(0), 'Optimal'
+
+    if highspy is None:
+        result = linprog(problem['cost'], A_eq = A, b_eq = np.zeros(num_row),
+                         bounds = np.column_stack([problem['lower'], problem['upper']]), method = 'highs')
+        return (result.x if result.x is not None else np.zeros(num_col)), result.message
+
+    h = highspy.Highs()
+    h.setOptionValue('output_flag', False)
+    lp = highspy.HighsLp()
+    lp.num_col_ = num_col
+    lp.num_row_ = num_row
+    lp.col_cost_ = problem['cost']
+    lp.col_lower_ = problem['lower']
+    lp.col_upper_ = np.where(np.isinf(problem['upper']), highspy.kHighsInf, problem['upper'])
+    lp.row_lower_ = np.zeros(num_row)
+    lp.row_upper_ = np.zeros(num_row)
+    lp.a_matrix_.format_ = highspy.MatrixFormat.kColwise
+    lp.a_matrix_.start_ = A.indptr
+    lp.a_matrix_.index_ = A.indices
+    lp.a_matrix_.value_ = A.data
+    h.passModel(lp)
+
+    if x0 is not None:
+        solution = highspy.HighsSolution()
+        solution.col_value = list(x0)
+        solution.value_valid = True
+        h.setSolution(solution)
+
+    h.run()
+    status = h.modelStatusToString(h.getModelStatus())
+    return np.array(h.getSolution().col_value), status
+
+def solve_flows(network, seizure_rate = 0.1, previous = None):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    seizure_rate : float or None, optional
+    previous : dict, optional
+        Raw solution of the previous year, used as a warm start.
+    Returns
+    -------
+    solution : dict
+        Solves the flow problem of one network; 'edges' and 'nodes' hold the estimated flows, supplies and deliveries.
+    '''
+    problem = get_flow_problem(network, seizure_rate = seizure_rate)
+    x, status = _solve_lp(problem, x0 = _get_warm_start(problem, previous))
+
+    E, P = len(problem['edges']), len(problem['producers'])
+    supply = np.zeros(len(problem['nodes']))
+    supply[problem['producers']] = x[E:E + P]
+    delivered = np.zeros(len(problem['nodes']))
+    delivered[problem['markets']] = x[E + P:]
+
+    edges_df = pd.DataFrame({'Source': [u for u, v in problem['edges']], 'Target': [v for u, v in problem['edges']],
+                             'Weight': problem['weights'], 'Capacity': problem['capacity'], 'Flow': x[:E]})
+    nodes_df = pd.DataFrame({'Country': problem['nodes'], 'Supply': supply, 'Delivered': delivered,
+                             'Market': problem['market'], 'Unmet': problem['market'] - delivered})
+
+    return {'status': status, 'edges': edges_df, 'nodes': nodes_df,
+            'raw': {'nodes': problem['nodes'], 'edges': problem['edges'], 'producers': problem['producers'],
+                    'markets': problem['markets'], 'x': x}}
+
+def _solve_years(networks, seizure_rate):
+    '''
+    Parameters
+    ----------
+    networks : dict of nx.DiGraphs
+    seizure_rate : float or None
+    Returns
+    -------
+    solutions : dict
+        Solves the years of one drug in chronological order, warm-starting each year from the previous one.
+    '''
+    solutions = dict()
+    previous = None
+    for year in sorted(networks.keys()):
+        solutions[year] = solve_flows(networks[year], seizure_rate = seizure_rate, previous = previous)
+        previous = solutions[year]['raw']
+    return solutions
+
+def estimate_flows(networks, seizure_rate = 0.1, warm_start = True, max_workers = None):
+    '''
+    Parameters
+    ----------
+    networks : dict
+        {drug: {year: nx.DiGraph}}, e.g. the outputs of Seizures.get_drug_network_by_year for cocaine and heroin.
+    seizure_rate : float or None, optional
+        The default is 0.1.
+    warm_start : bool, optional
+        If True, drugs are solved in parallel and years sequentially with warm starts; otherwise every (drug, year) is solved in parallel from scratch.
+    max_workers : int, optional
+    Returns
+    -------
+    solutions : dict
+        Estimates the flows for every (drug, year), keyed as solutions[drug][year].
+    '''
+    solutions = {drug: dict() for drug in networks.keys()}
+    with ProcessPoolExecutor(max_workers = max_workers) as executor:
+        if warm_start:
+            futures = {drug: executor.submit(_solve_years, networks[drug], seizure_rate) for drug in networks.keys()}
+            for drug, future in futures.items():
+                solutions[drug] = future.result()
+        else:
+            futures = {(drug, year): executor.submit(solve_flows, networks[drug][year], seizure_rate)
+                       for drug in networks.keys() for year in networks[drug].keys()}
+            for (drug, year), future in futures.items():
+                solutions[drug][year] = future.result()
+    return solutions
+
+def add_flows_to_network(network, solution):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    solution : dict
+        Output of solve_flows for the same network.
+    Returns
+    -------
+    network : nx.DiGraph
+        Populates the 'flow' attribute of each edge and the 'supply' and 'delivered' attributes of each node.
+    '''
+    for _, row in solution['edges'].iterrows():
+        network.edges[row['Source'], row['Target']]['flow'] = row['Flow']
+    for _, row in solution['nodes'].iterrows():
+        network.nodes[row['Country']]['supply'] = row['Supply']
+        network.nodes[row['Country']]['delivered'] = row['Delivered']
+    return network
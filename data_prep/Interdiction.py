@@ -0,0 +1,291 @@
+
+# Collection of functions for simulating targeted interventions on the yearly drug networks;
+# Following Giommoni, Berlusconi & Aziani (2022), we ask which countries or routes, if disrupted, cut the most volume from producers to markets;
+# Candidate removals are evaluated in batch: each column of a dense (nodes x candidates) matrix holds the reachable set of one scenario,
+# propagated with sparse matrix products until convergence.
+
+import numpy as np
+import pandas as pd
+import networkx as nx
+
+def get_interdiction_data(network, weight = 'weight'):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+        Output of Seizures.get_drug_network_by_year for a given year.
+    weight : str, optional
+    Returns
+    -------
+    data : dict
+        Extracts the node list, the binary and weighted sparse adjacency matrices, the 'producer' flags and the 'market' values (0 if missing).
+    '''
+    nodes = list(network.nodes)
+    W = nx.to_scipy_sparse_array(network, nodelist = nodes, weight = weight, format = 'csr').astype(float)
+    B = W.copy()
+    B.data[:] = 1.0
+    producer = np.array([bool(network.nodes[node].get('producer', False)) for node in nodes])
+    market = np.array([float(network.nodes[node].get('market', 0.0)) for node in nodes])
+    return {'nodes': nodes, 'W': W, 'B': B, 'producer': producer, 'market': market}
+
+def _propagate(M, seeds, blocked_nodes = None, blocked_edges = None):
+    '''
+    Parameters
+    ----------
+    M : scipy.sparse matrix
+        Binary propagation matrix: row i collects the nodes reached from i in one step.
+    seeds : np.ndarray (n x K) of bool
+    blocked_nodes : np.ndarray (n x K) of bool, optional
+        Nodes removed in each scenario.
+    blocked_edges : tuple of np.ndarrays, optional
+        (source, target) indices, in propagation direction, of the edge removed in each scenario.
+    Returns
+    -------
+    R : np.ndarray (n x K) of bool
+        Computes the set of nodes reachable from the seeds in every scenario at once.
+    '''
+    K = seeds.shape[1]
+    R = seeds.copy()
+    if blocked_nodes is not None:
+        R &= ~blocked_nodes
+    columns = np.arange(K)
+    while True:
+        P = M @ R.astype(float)
+        # Remove the contribution of the blocked edge of each scenario
+        if blocked_edges is not None:
+            src, dst = blocked_edges
+            P[dst, columns] -= R[src, columns]
+        R_next = R | (P > 0.5)
+        if blocked_nodes is not None:
+            R_next &= ~blocked_nodes
+        if (R_next == R).all():
+            return R
+        R = R_next
+
+def _evaluate(data, objective, blocked_nodes = None, blocked_edges = None, num_scenarios = 1):
+    '''
+    Parameters
+    ----------
+    data : dict
+    objective : str
+        'reachability' (market volume reachable from producers) or 'flow' (weight of the edges on producer-to-market paths).
+    blocked_nodes : np.ndarray (n x K) of bool, optional
+    blocked_edges : tuple of np.ndarrays, optional
+        (source, target) indices of the edge removed in each scenario.
+    num_scenarios : int, optional
+    Returns
+    -------
+    values : np.ndarray (K)
+        Evaluates the objective for every scenario.
+    '''
+    K = num_scenarios if blocked_nodes is None else blocked_nodes.shape[1]
+    if blocked_edges is not None:
+        K = len(blocked_edges[0])
+
+    # Forward reachability from the producers (along edge direction)
+    seeds = np.repeat(data['producer'][:, None], K, axis = 1)
+    forward_edges = None if blocked_edges is None else (blocked_edges[0], blocked_edges[1])
+    R = _propagate(data['B'].T.tocsr(), seeds, blocked_nodes = blocked_nodes, blocked_edges = forward_edges)
+
+    if objective == 'reachability':
+        return data['market'] @ R
+
+    if objective == 'flow':
+        # Backward reachability from the markets (against edge direction)
+        seeds = np.repeat((data['market'] > 0)[:, None], K, axis = 1)
+        backward_edges = None if blocked_edges is None else (blocked_edges[1], blocked_edges[0])
+        C = _propagate(data['B'], seeds, blocked_nodes = blocked_nodes, blocked_edges = backward_edges)
+        # An edge (u, v) carries producer-to-market volume if u is reachable from a producer and v reaches a market
+        values = (R * (data['W'] @ C.astype(float))).sum(axis = 0)
+        if blocked_edges is not None:
+            src, dst = blocked_edges
+            columns = np.arange(K)
+            values -= np.asarray(data['W'][src, dst]).ravel() * R[src, columns] * C[dst, columns]
+        return values
+
+    raise Exception('Invalid objective!')
+
+def evaluate_removals(network, candidates = 'nodes', objective = 'reachability', removed = None, batch_size = 1024):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    candidates : str, optional
+        'nodes' (countries) or 'edges' (routes). The default is 'nodes'.
+    objective : str, optional
+        'reachability' or 'flow'. The default is 'reachability'.
+    removed : list, optional
+        Nodes (or edges) already removed before evaluating the candidates.
+    batch_size : int, optional
+        Number of scenarios evaluated together; bounds memory to (nodes x batch_size).
+    Returns
+    -------
+    output_df : pd.DataFrame
+        Evaluates the loss caused by every single removal, sorted from the most to the least disruptive.
+    '''
+    data = get_interdiction_data(network)
+    index = {node: i for i, node in enumerate(data['nodes'])}
+    n = len(data['nodes'])
+
+    # Apply the removals already made to the adjacency matrices
+    if removed is not None and len(removed) > 0:
+        data = _remove(data, index, removed, candidates)
+
+    baseline = _evaluate(data, objective)[0]
+
+    if candidates == 'nodes':
+        candidate_list = data['nodes']
+    elif candidates == 'edges':
+        rows, cols = data['W'].nonzero()
+        candidate_list = [(data['nodes'][u], data['nodes'][v]) for u, v in zip(rows, cols)]
+    else:
+        raise Exception('Invalid candidates!')
+
+    values = np.zeros(len(candidate_list))
+    for start in range(0, len(candidate_list), batch_size):
+        end = min(start + batch_size, len(candidate_list))
+        if candidates == 'nodes':
+            blocked_nodes = np.zeros((n, end - start), dtype = bool)
+            blocked_nodes[np.arange(start, end), np.arange(end - start)] = True
+            values[start:end] = _evaluate(data, objective, blocked_nodes = blocked_nodes)
+        else:
+            src = np.array([index[u] for u, v in candidate_list[start:end]])
+            dst = np.array([index[v] for u, v in candidate_list[start:end]])
+            values[start:end] = _evaluate(data, objective, blocked_edges = (src, dst))
+
+    output_df = pd.DataFrame({'Candidate': candidate_list, 'Value': values, 'Loss': baseline - values,
+                              'Loss_share': (baseline - values) / baseline if baseline > 0 else 0.0})
+    return output_df.sort_values('Loss', ascending = False).reset_index(drop = True)
+
+def _remove(data, index, removed, candidates):
+    '''
+    Parameters
+    ----------
+    data : dict
+    index : dict
+    removed : list
+    candidates : str
+    Returns
+    -------
+    data : dict
+        Removes nodes (all their edges and their producer/market role) or edges from the matrices, without rebuilding them from the network.
+    '''
+    W = data['W'].tolil()
+    producer = data['producer'].copy()
+    market = data['market'].copy()
+    for item in removed:
+        if candidates == 'nodes':
+            i = index[item]
+            W[i, :] = 0
+            W[:, i] = 0
+            producer[i] = False
+            market[i] = 0.0
+        else:
+            W[index[item[0]], index[item[1]]] = 0
+    W = W.tocsr()
+    W.eliminate_zeros()
+    B = W.copy()
+    B.data[:] = 1.0
+    return {'nodes': data['nodes'], 'W': W, 'B': B, 'producer': producer, 'market': market}
+
+def greedy_interdiction(network, k = 10, candidates = 'nodes', objective = 'reachability', batch_size = 1024):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    k : int, optional
+        Number of sequential removals. The default is 10.
+    candidates : str, optional
+        'nodes' or 'edges'. The default is 'nodes'.
+    objective : str, optional
+        'reachability' or 'flow'. The default is 'reachability'.
+    batch_size : int, optional
+    Returns
+    -------
+    output_df : pd.DataFrame
+        Greedily removes, at each step, the candidate with the largest marginal loss and records the remaining objective value.
+    '''
+    data = get_interdiction_data(network)
+    index = {node: i for i, node in enumerate(data['nodes'])}
+    n = len(data['nodes'])
+    baseline = _evaluate(data, objective)[0]
+
+    if candidates == 'nodes':
+        candidate_list = list(data['nodes'])
+    elif candidates == 'edges':
+        rows, cols = data['W'].nonzero()
+        candidate_list = [(data['nodes'][u], data['nodes'][v]) for u, v in zip(rows, cols)]
+    else:
+        raise Exception('Invalid candidates!')
+
+    output_df = pd.DataFrame(columns = ['Step', 'Removed', 'Marginal_loss', 'Value', 'Loss_share'])
+    current = baseline
+
+    for step in range(1, k + 1):
+
+        # Nothing left to cut
+        if current <= 0:
+            break
+
+        # Only candidates lying on a producer-to-market path can reduce the objective
+        R = _propagate(data['B'].T.tocsr(), data['producer'][:, None])[:, 0]
+        C = _propagate(data['B'], (data['market'] > 0)[:, None])[:, 0]
+        if candidates == 'nodes':
+            relevant = [c for c in candidate_list if R[index[c]] and C[index[c]]]
+        else:
+            relevant = [c for c in candidate_list if R[index[c[0]]] and C[index[c[1]]] and data['W'][index[c[0]], index[c[1]]] > 0]
+        if len(relevant) == 0:
+            break
+
+        values = np.zeros(len(relevant))
+        for start in range(0, len(relevant), batch_size):
+            end = min(start + batch_size, len(relevant))
+            if candidates == 'nodes':
+                blocked_nodes = np.zeros((n, end - start), dtype = bool)
+                blocked_nodes[[index[c] for c in relevant[start:end]], np.arange(end - start)] = True
+                values[start:end] = _evaluate(data, objective, blocked_nodes = blocked_nodes)
+            else:
+                src = np.array([index[u] for u, v in relevant[start:end]])
+                dst = np.array([index[v] for u, v in relevant[start:end]])
+                values[start:end] = _evaluate(data, objective, blocked_edges = (src, dst))
+
+        # Remove the best candidate and update the matrices in place of rebuilding them
+        best = int(np.argmin(values))
+        chosen = relevant[best]
+        data = _remove(data, index, [chosen], candidates)
+        candidate_list.remove(chosen)
+
+        new_row = {'Step': step, 'Removed': chosen, 'Marginal_loss': current - values[best], 'Value': values[best],
+                   'Loss_share': (baseline - values[best]) / baseline if baseline > 0 else 0.0}
+        output_df.loc[len(output_df)] = new_row
+        current = values[best]
+
+    return output_df
+
+def rank_countries(networks, candidates = 'nodes', objective = 'reachability', batch_size = 1024):
+    '''
+    Parameters
+    ----------
+    networks : dict
+        Either {year: nx.DiGraph} or {drug: {year: nx.DiGraph}}.
+    candidates : str, optional
+    objective : str, optional
+    batch_size : int, optional
+    Returns
+    -------
+    output_df : pd.DataFrame
+        Ranks all single removals for every drug and year in one tidy table (Drug, Year, Candidate, Loss, Loss_share, Rank).
+    '''
+    # Accept a single dict of yearly networks as well
+    if all(isinstance(value, nx.DiGraph) for value in networks.values()):
+        networks = {None: networks}
+
+    frames = []
+    for drug in networks.keys():
+        for year in networks[drug].keys():
+            df_year = evaluate_removals(networks[drug][year], candidates = candidates, objective = objective, batch_size = batch_size)
+            df_year.insert(0, 'Year', year)
+            df_year.insert(0, 'Drug', drug)
+            df_year['Rank'] = np.arange(1, len(df_year) + 1)
+            frames.append(df_year)
+    return pd.concat(frames, ignore_index = True)
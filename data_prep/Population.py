@@ -5,9 +5,10 @@
 # Source of data: UN data portal API.
 
 import pandas as pd
-import requests
 import json
 
+# requests is only needed (and imported) by the functions calling the API
+
 def get_location_ids(base_url = "https://population.un.org/dataportalapi/api/v1"):
     '''
     Parameters
@@ -18,6 +19,8 @@ def get_location_ids(base_url = "https://population.un.org/dataportalapi/api/v1"
     -------
     list of location ids
     '''
+    import requests
+
     # Creates the target URL, indicators, in this instance
     target = base_url + "/locations/"
 
@@ -88,6 +91,8 @@ def get_location_population(location_id, target_df, start_year = 2006, end_year
     None; Updates the target_df with population values for the given location
 
     '''
+    import requests
+
     # Creates the target URL, indicators, in this instance
     target = base_url + "/data/indicators/46/locations/" + str(location_id) + "/start/" + str(start_year) + "/end/" + str(end_year)
 
@@ -46,8 +46,10 @@ def prepare_data(file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sou
     # We are interested only in the values measured in percentages
     df_pure = df_pure[df_pure['Measurement'] == '% (percent)']
     
-    # Some values are greater than one, so we divide them by 100 to ensure consistency of the results
-    df_pure.loc[df_pure['Typical'] > 1, 'Typical'] /= 100
+    # Some values are greater than one, so we divide them by 100 to ensure consistency of the results;
+    # the minimum and maximum of those rows are on the same (percent) scale
+    percent = df_pure['Typical'] > 1
+    df_pure.loc[percent, ['Typical', 'Minimum', 'Maximum']] /= 100
     
     # Check that all values are not greater than 1
     if (df_pure['Typical'] > 1).sum() != 0:
@@ -1,9 +1,9 @@
-
 # Collection of functions for converting drug derivatives and different measurement units to pure generic drug quantities expressed in kilograms;
 # The default period is 2006-2017;
 # The drugs of interest are: cocaine, opioids, cannabis, amphetamines, and ecstasy;
 # Sources of conversion factors: https://www.unodc.org/documents/data-and-analysis/WDR2010/WDR2010methodology.pdf ,
 #                                https://wdr.unodc.org/wdr2019/prelaunch/WDR-2019-Methodology-FINAL.pdf
+# Every conversion is a chain of named factors (a conversion path), so that the factors can be perturbed without reparsing the seizures.
 
 
 import numpy as np
@@ -25,245 +25,408 @@ unit_to_kg = {
               np.nan: 0
              }
 
-def convert_cocaine(drug_type, q, unit):
+# Drug-specific conversion factors; the units of unit_to_kg are factors as well, keyed as ('unit_to_kg', unit)
+factors = {
+           'cocaine_dose': 1e-4,                          # kg per tablet/unit/capsule of cocaine
+           'coca_leaf_dose': 1e-4,                        # kg per unit of coca leaf
+           'coca_leaf_per_cocaine': 220,                  # kg of coca leaf per kg of cocaine HCL
+           'heroin_dose': 3e-5,                           # kg per dose of heroin
+           'opium_dose': 0.0003,                          # kg per dose of opium
+           'plant_to_hectar': 5.263157894736842e-06,      # hectars per opium/poppy straw plant
+           'acre_to_hectar': 0.404686,
+           'opium_yield': 42.4,                           # kg of opium per hectar
+           'opium_to_heroin': 0.1,                        # kg of heroin per kg of opium
+           'poppy_straw_yield': 411.1297071129707,        # kg of morphine per hectar of poppy straw
+           'heroin_to_morphine_potency': 3,               # heroin is assumed 3 times as potent as morphine
+           'morphine_dose': 1e-4,                         # kg per dose of morphine
+           'cannabis_dose': 0.0005,                       # kg per dose of cannabis
+           'cannabis_yield': 42.5,                        # kg per hectar, rough estimate for large range (15-70)
+           'cannabis_plant_weight': 0.1,                  # kg per plant
+           'cannabis_dry_share': 0.33,                    # share of the weight left after drying
+           'amphetamine_dose': 0.00025,                   # kg per dose of amphetamine
+           'amphetamine_hundred_units': 0.025,            # kg per hundred units
+           'amphetamine_thousand_doses': 0.25,            # kg per thousand doses
+           'ecstasy_dose': 0.00027,                       # kg per tablet of ecstasy
+           'ecstasy_thousand_tablets': 0.27               # kg per thousand tablets
+          }
+
+def get_factor_value(key):
+    '''
+    Parameters
+    ----------
+    key : str or tuple
+        Name in factors, or ('unit_to_kg', unit).
+    Returns
+    -------
+    float
+        Current value of the conversion factor.
+    '''
+    if isinstance(key, tuple):
+        return unit_to_kg[key[1]]
+    return factors[key]
+
+def get_factor_name(key):
+    '''
+    Parameters
+    ----------
+    key : str or tuple
+    Returns
+    -------
+    str
+        Readable name of the conversion factor, e.g. 'opium_yield' or 'unit_to_kg[Litre]'.
+    '''
+    if isinstance(key, tuple):
+        return f'{key[0]}[{key[1]}]'
+    return key
+
+def get_cocaine_path(drug_type, unit):
     '''
     Parameters
     ----------
-    q : float
-       drug quantity
     drug_type : str
     unit : str
     Returns
     -------
-    float
-        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    path : list of tuples
+        Conversion path of cocaine and its derivatives to kg, as (factor key, +1 to multiply or -1 to divide) steps.
     '''
-    
+
+    # Note: the condition is always true (the string literals are truthy), so every form, coca leaf included, takes this branch
     if drug_type == 'Cocaine' or 'Cocaine HCL' or 'Crack' or 'Coca paste':
-        
+
         # Translate small doses of cocaine or equivalent derivatives to kilograms
         if unit == 'Tablet' or unit == 'Unit' or unit == 'Capsule':
-            return q * 1e-4
-        
+            return [('cocaine_dose', 1)]
+
         # Translate unit to kg
-        return q * unit_to_kg[unit]
-    
+        return [(('unit_to_kg', unit), 1)]
+
     if drug_type == 'Coca leaf':
-        
+        path = []
+
         # Translate small doses of coca leafs to kilograms
         if unit == 'Unit':
-            q *= 1e-4
+            path.append(('coca_leaf_dose', 1))
             unit = 'Kilogram'
-        
+
         # Translate unit to kg
-        q *= unit_to_kg[unit]
-        
+        path.append((('unit_to_kg', unit), 1))
+
         # Translate coca leaf to cocaine HCL
-        return q / 220
-    
+        path.append(('coca_leaf_per_cocaine', -1))
+        return path
+
     raise Exception('Unknown drug form for Cocaine: {drug_type}')
-    
 
-def convert_heroin(drug_type, q, unit):
+def get_heroin_path(drug_type, unit):
     '''
     Parameters
     ----------
-    q : float
-       drug quantity
     drug_type : str
     unit : str
     Returns
     -------
-    float
-        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    path : list of tuples
+        Conversion path of heroin and its derivatives to kg.
     '''
-    
+
     if drug_type == 'Heroin':
-        
+
         # Translate small doses of heroin to kilograms
         if unit == 'Tablet' or unit == 'Unit' or unit == 'Ampoule' or unit == 'Piece' or unit == 'Capsule':
-            return q * 3e-5
-        
+            return [('heroin_dose', 1)]
+
         # Translate unit to kg
-        return q * unit_to_kg[unit]
-    
+        return [(('unit_to_kg', unit), 1)]
+
     if drug_type == 'Opium' or drug_type == 'Opium Poppy' or drug_type == 'Poppy seeds':
-        
+        path = []
+
         # Translate small doses of opium to kilograms
         if unit == 'Tablet' or unit == 'Unit' or unit == 'Ampoule' or unit == 'Piece' or unit == 'Capsule':
-            q *= 0.0003
+            path.append(('opium_dose', 1))
             unit = 'Kilogram'
-        
+
         # Translate opium plants to hectars
         if unit == 'Plants':
-            q *= 5.263157894736842e-06
+            path.append(('plant_to_hectar', 1))
             unit = 'Hectars'
-        
+
         # Translate acres of opium to hectars
         if unit == 'Acres':
-            q *= 0.404686
+            path.append(('acre_to_hectar', 1))
             unit = 'Hectars'
-        
+
         # Translate hectars of opium to kg of opium
         if unit == 'Hectars' or unit == 'Hectar':
-            q *= 42.4
+            path.append(('opium_yield', 1))
             unit = 'Kilogram'
-        
+
         # Translate unit to kg
-        q *= unit_to_kg[unit]
-        
+        path.append((('unit_to_kg', unit), 1))
+
         # Translate opium to heroin
-        return q * 0.1
-    
+        path.append(('opium_to_heroin', 1))
+        return path
+
     if drug_type == 'Poppy straw':
-        
+        path = []
+
         # Translate poppy straw plants to hectars
         if unit == 'Plants' or unit == 'Bush':
-            q *= 5.263157894736842e-06
+            path.append(('plant_to_hectar', 1))
             unit = 'Hectars'
-        
+
         # Translate acres of poppy straw to hectars
         if unit == 'Acres':
-            q *= 0.404686
+            path.append(('acre_to_hectar', 1))
             unit = 'Hectars'
-        
+
         # Translate hectars of poppy straw to kg of morphine
         if unit == 'Hectars' or unit == 'Hectar':
-            q *= 411.1297071129707
+            path.append(('poppy_straw_yield', 1))
             unit = 'Kilogram'
-        
+
         # Translate unit to kg (morphine)
-        q *= unit_to_kg[unit]
-        
+        path.append((('unit_to_kg', unit), 1))
+
         # Translate kg of morphine to kg of heroin (assuming heroin is 3 times as potent as morphine)
-        q /= 3 
-        
-        # Return the final quantity
-        return q
-    
+        path.append(('heroin_to_morphine_potency', -1))
+        return path
+
     if drug_type == 'Morphine':
-        
+        path = []
+
         # Translate small doses of morphine to kilograms
         if unit == 'Tablet' or unit == 'Unit' or unit == 'Ampoule' or unit == 'Dose' or unit == 'Vials' or unit == 'Injection' or unit == 'Bottles':
-            q *= 1e-4
+            path.append(('morphine_dose', 1))
             unit = 'Kilogram'
-        
+
         # Translate unit to kg, assuming 1:1 ratio
-        q *= unit_to_kg[unit]
-        
-        # Return the final quantity
-        return q
-    
+        path.append((('unit_to_kg', unit), 1))
+        return path
+
     raise Exception('Unknown drug form for Heroin: {drug_type}')
 
-def convert_cannabis(drug_type, q, unit):
+def get_cannabis_path(drug_type, unit):
     '''
     Parameters
     ----------
-    q : float
-       drug quantity
     drug_type : str
     unit : str
     Returns
     -------
-    float
-        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    path : list of tuples
+        Conversion path of cannabis and its derivatives to kg.
     '''
-        
+    path = []
+
     # Translate small doses of cannabis to kilograms
     if unit == 'Tablet' or unit == 'Unit' or unit == 'Piece' or unit == 'Ampoule' or unit == 'Capsule' or unit == 'Dose' or unit == 'Vials' or unit == 'Injection' or unit == 'Bottles' or unit == 'Seed' or unit == 'Cigarette' or unit == 'Pill':
-        q *= 0.0005
+        path.append(('cannabis_dose', 1))
         unit = 'Kilogram'
 
     # Translate acres of cannabis to hectars
     if unit == 'Acres':
-        q *= 0.404686
+        path.append(('acre_to_hectar', 1))
         unit = 'Hectars'
 
     # Translate hectars of cannabis to kg
     if unit == 'Hectars' or unit == 'Hectar':
-        q *= 42.5 # Rough estimate for large range (15-70)
+        path.append(('cannabis_yield', 1))
         unit = 'Kilogram'
 
     # Translate plants to kilograms of cannabis
     if unit == 'Plants' or unit == 'Bush':
-        q *= 0.1 # asssuming the average weight of a plant is 100 grams
+        path.append(('cannabis_plant_weight', 1))
         # Translate plant weight to cannabis assuming only around 33% of the initial weight remains after drying
-        q *= 0.33
+        path.append(('cannabis_dry_share', 1))
         unit = 'Kilogram'
 
-    # Translate unit to kg 
-    q *= unit_to_kg[unit]
+    # Translate unit to kg
+    path.append((('unit_to_kg', unit), 1))
+    return path
 
-    # Return the quantity
-    return q
-    
-    raise Exception('Unknown drug form for Cannabis: {drug_type}')
-    
-def convert_amphetamine(drug_type, q, unit):
+def get_amphetamine_path(drug_type, unit):
     '''
     Parameters
     ----------
-    q : float
-       drug quantity
     drug_type : str
     unit : str
     Returns
     -------
-    float
-        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    path : list of tuples
+        Conversion path of amphetamine-type stimulants to kg.
     '''
-        
+    path = []
+
     # Translate small doses of amphetamine to kilograms
     if unit == 'Tablet' or unit == 'Unit' or unit == 'Pill' or unit == 'Capsule':
-        q *= 0.00025
+        path.append(('amphetamine_dose', 1))
         unit = 'Kilogram'
-    
+
     # Translate hundred of units to kg
     if unit == 'Hundred of units':
-        q *= 0.025
+        path.append(('amphetamine_hundred_units', 1))
         unit = 'Kilogram'
-    
+
     # Translate thousand of doses to kg
     if unit == 'Thousand of doses':
-        q *= 0.25
+        path.append(('amphetamine_thousand_doses', 1))
         unit = 'Kilogram'
-    
-    # Translate unit to kg 
-    q *= unit_to_kg[unit]
-    
-    # Return the quantity
-    return q
-    
-def convert_ecstasy(drug_type, q, unit):
+
+    # Translate unit to kg
+    path.append((('unit_to_kg', unit), 1))
+    return path
+
+def get_ecstasy_path(drug_type, unit):
     '''
     Parameters
     ----------
-    q : float
-       drug quantity
     drug_type : str
     unit : str
     Returns
     -------
-    float
-        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    path : list of tuples
+        Conversion path of ecstasy-type substances to kg.
     '''
-    
+    path = []
+
     # Translate small doses of amphetamine to kilograms
     if unit == 'Tablet' or unit == 'Unit' or unit == 'Pill' or unit == 'Capsule' or unit == 'Piece' or unit == 'Barette':
-        q *= 0.00027
+        path.append(('ecstasy_dose', 1))
         unit = 'Kilogram'
-        
+
     if unit == 'Thousand of tablets':
-        q *= 0.27
+        path.append(('ecstasy_thousand_tablets', 1))
         unit = 'Kilogram'
-    
-    # Translate unit to kg 
-    q *= unit_to_kg[unit]
-    
-    # Return the quantity
+
+    # Translate unit to kg
+    path.append((('unit_to_kg', unit), 1))
+    return path
+
+# Conversion path function of each drug
+path_functions = {
+                  'Cocaine': get_cocaine_path,
+                  'Heroin': get_heroin_path,
+                  'Cannabis': get_cannabis_path,
+                  'Amphetamine': get_amphetamine_path,
+                  'Ecstasy': get_ecstasy_path
+                 }
+
+def get_conversion_path(drug_type, drug_form, unit):
+    '''
+    Parameters
+    ----------
+    drug_type : str
+        'Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'
+    drug_form : str
+        specific variation of the drug
+    unit : str
+    Returns
+    -------
+    path : list of tuples
+        Conversion path as (factor key, +1 or -1) steps.
+    '''
+    if drug_type not in path_functions:
+        # Raise an exception is drug is not found
+        raise Exception('Unknown drug type: {drug_type}')
+    return path_functions[drug_type](drug_form, unit)
+
+def apply_path(q, path):
+    '''
+    Parameters
+    ----------
+    q : float
+        drug quantity
+    path : list of tuples
+    Returns
+    -------
+    float
+        Applies the factors of the conversion path in order.
+    '''
+    for key, exponent in path:
+        if exponent > 0:
+            q *= get_factor_value(key)
+        else:
+            q /= get_factor_value(key)
     return q
 
+def convert_cocaine(drug_type, q, unit):
+    '''
+    Parameters
+    ----------
+    q : float
+       drug quantity
+    drug_type : str
+    unit : str
+    Returns
+    -------
+    float
+        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    '''
+    return apply_path(q, get_cocaine_path(drug_type, unit))
+
+def convert_heroin(drug_type, q, unit):
+    '''
+    Parameters
+    ----------
+    q : float
+       drug quantity
+    drug_type : str
+    unit : str
+    Returns
+    -------
+    float
+        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    '''
+    return apply_path(q, get_heroin_path(drug_type, unit))
+
+def convert_cannabis(drug_type, q, unit):
+    '''
+    Parameters
+    ----------
+    q : float
+       drug quantity
+    drug_type : str
+    unit : str
+    Returns
+    -------
+    float
+        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    '''
+    return apply_path(q, get_cannabis_path(drug_type, unit))
+
+def convert_amphetamine(drug_type, q, unit):
+    '''
+    Parameters
+    ----------
+    q : float
+       drug quantity
+    drug_type : str
+    unit : str
+    Returns
+    -------
+    float
+        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    '''
+    return apply_path(q, get_amphetamine_path(drug_type, unit))
+
+def convert_ecstasy(drug_type, q, unit):
+    '''
+    Parameters
+    ----------
+    q : float
+       drug quantity
+    drug_type : str
+    unit : str
+    Returns
+    -------
+    float
+        Converts the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
+    '''
+    return apply_path(q, get_ecstasy_path(drug_type, unit))
+
 def convert(drug_type, q, drug_form, unit):
     '''
     Parameters
@@ -280,23 +443,4 @@ def convert(drug_type, q, drug_form, unit):
     float
         Geeric function to convert the quantity of drug to kg, taking into account different adjustment and conversion factors present in the literature.
     '''
-    
-    #Call the respective conversion function
-    
-    if drug_type == 'Cocaine':
-        return convert_cocaine(drug_form, q, unit)
-    
-    if drug_type == 'Heroin':
-        return convert_heroin(drug_form, q, unit)
-    
-    if drug_type == 'Cannabis':
-        return convert_cannabis(drug_form, q, unit)
-    
-    if drug_type == 'Amphetamine':
-        return convert_amphetamine(drug_form, q, unit)
-    
-    if drug_type == 'Ecstasy':
-        return convert_ecstasy(drug_form, q, unit)
-    
-    # Raise an exception is drug is not found
-    raise Exception('Unknown drug type: {drug_type}')
+    return apply_path(q, get_conversion_path(drug_type, drug_form, unit))
@@ -4,18 +4,54 @@
 # The drugs of interest are: cocaine, opioids, cannabis, amphetamines, and ecstasy;
 # Source of data: https://www.unodc.org/unodc/en/data-and-analysis/statistics/drugs/seizures_cases.html
 
+import weakref
 import numpy as np
 import pandas as pd
 import networkx as nx
+import Countries
 from Quantity_Conversion import convert
 
-def read_xlsx(file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/IDS_Report.xlsx', start_year = 2006, end_year = 2017): 
+# Declared schema of the IDS sheets: only these columns are read, low-cardinality strings are stored as categoricals
+# (filters then run on the integer codes) and amounts stay float64, since they are summed over many seizures
+ids_schema = {
+    'REGION_OF_SEIZURE': 'category',
+    'SUBREGION_OF_SEIZURE': 'category',
+    'COUNTRY_OF_SEIZURE': 'category',
+    'DRUG_NAME': 'category',
+    'AMOUNT_OF_DRUG': 'float64',
+    'DRUG_UNIT': 'category',
+    'PRODUCING_COUNTRY': 'category',
+    'DEPARTURE_COUNTRY': 'category',
+    'DESTINATION_COUNTRY': 'category'
+}
+
+# Locations which do not identify a country
+invalid_locations = ['Unknown', 'Other']
+
+def apply_schema(df, schema = ids_schema):
+    '''
+    Parameters
+    ----------
+    df : pd.DataFrame
+    schema : dict, optional
+        {column: dtype}. The default is ids_schema.
+    Returns
+    -------
+    df : pd.DataFrame
+        Keeps only the columns of the schema (those present) and casts them to the declared dtypes.
+    '''
+    columns = [column for column in schema if column in df.columns]
+    return df[columns].astype({column: schema[column] for column in columns})
+
+def read_xlsx(file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/IDS_Report.xlsx', start_year = 2006, end_year = 2017, schema = ids_schema): 
     '''
     Parameters
     ----------
     file : str, optional
     start_year : int, optional
     end_year : int, optional
+    schema : dict or None, optional
+        Columns to read and their dtypes; None reads every column with the default dtypes (e.g. for the purity sheets).
     Returns
     -------
     df : dict of pd.DataFrames
@@ -29,7 +65,11 @@ def read_xlsx(file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/source
     xlsx = pd.ExcelFile(file)
     df = dict()
     for year in range(start_year, end_year + 1):
-        df[year] = pd.read_excel(xlsx, str(year))
+        if schema is None:
+            df[year] = pd.read_excel(xlsx, str(year))
+        else:
+            # Unused columns are pruned at read time
+            df[year] = apply_schema(pd.read_excel(xlsx, str(year), usecols = lambda column: column in schema), schema = schema)
     return df
 
 def create_output_df(start_year = 2006, end_year = 2017):
@@ -54,11 +94,23 @@ def create_output_df(start_year = 2006, end_year = 2017):
         seiz_df[i] = pd.DataFrame(columns=['Region', 'SubRegion', 'Country', 'Drug', 'Quantity(kg)'])
     return seiz_df
 
+# Memoized outputs of get_ids_locations, keyed by the ids of the yearly frames, the drugs and the period;
+# the frames are not referenced by the cache: an entry is evicted as soon as one of its frames is garbage collected,
+# so that cached results never outlive their data (and the ids cannot be reused while cached)
+locations_cache = dict()
+
+def clear_locations_cache():
+    '''
+    Empties the cache of get_ids_locations, e.g. after modifying the IDS frames in place.
+    '''
+    locations_cache.clear()
+
 def get_ids_locations(df_ids, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'], start_year = 2006, end_year = 2017):
     '''
     Parameters
     ----------
     df_ids : dict of pd.DataFrame
+    drug_list : list of str, optional
     start_year : int, optional
     end_year : int, optional
     Returns
@@ -67,184 +119,54 @@ def get_ids_locations(df_ids, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amp
     sub_region_dict : dict
     region_dict : dict
         Obtains the countries, regions and sub-regions present among the countries of seizure across the period of time.
+        The location columns of all years are concatenated once; the (sub-)region of a country is that of its first appearance as country of seizure.
+        Results are memoized per (frames, drug_list, period) and copies are returned; see clear_locations_cache.
     '''
-    
-    # Dict for missing sub-regions
-    missing_sub_region_map = {
-    'Albania': 'East Europe',
-    'Antigua and Barbuda': 'Caribbean',
-    'Aruba': 'Caribbean',
-    'Australia': 'Oceania',
-    'Bahrain': 'Near and Middle East /South-West Asia',
-    'Barbados': 'Caribbean',
-    'Bermuda': 'Caribbean',
-    'Burundi': 'East Africa',
-    'Cameroon': 'West and Central Africa',
-    'Congo, the Democratic Republic of the': 'West and Central Africa',
-    'Cook Islands': 'Oceania',
-    'Costa Rica': 'Central America',
-    'Curaçao': 'Caribbean',
-    'Dominica': 'Caribbean',
-    'Equatorial Guinea': 'West and Central Africa',
-    'Eritrea': 'East Africa',
-    'Estonia': 'East Europe',
-    'Faroe Islands': 'West & Central Europe',
-    'Fiji': 'Oceania',
-    'Gabon': 'West and Central Africa',
-    'Grenada': 'Caribbean',
-    'Guadeloupe': 'Caribbean',
-    'Guernsey': 'West & Central Europe',
-    'Guyana': 'South America',
-    'Haiti': 'Caribbean',
-    'Hong Kong': 'South Asia',
-    'Iraq':'Near and Middle East /South-West Asia',
-    'Isle of Man': 'West & Central Europe',
-    'Israel': 'Near and Middle East /South-West Asia',
-    'Jamaica': 'Caribbean',
-    'Jordan': 'Near and Middle East /South-West Asia',
-    "Korea, Democratic People's Republic of": 'East and South-East Asia',
-    'Kosovo under UNSCR 1244': 'East Europe',
-    'Kuwait': 'Near and Middle East /South-West Asia',
-    'Liberia': 'West and Central Africa',
-    'Madagascar': 'East Africa',
-    'Mongolia': 'East and South-East Asia',
-    'Namibia': 'Southern Africa',
-    'Netherlands Antilles': 'Caribbean',
-    'Nicaragua': 'Central America',
-    'Niger': 'West and Central Africa',
-    'Oman': 'Near and Middle East /South-West Asia',
-    'Panama': 'Central America',
-    'Papua New Guinea': 'Oceania',
-    'Puerto Rico': 'Caribbean',
-    'Qatar': 'Near and Middle East /South-West Asia',
-    'Rwanda': 'East Africa',
-    'Réunion': 'South Asia',
-    'Saint Pierre and Miquelon': 'North America',
-    'Samoa': 'Oceania',
-    'Sao Tome and Principe': 'West and Central Africa',
-    'Seychelles': 'East Africa',
-    'St. Lucia': 'Caribbean',
-    'Suriname': 'South America',
-    'Taiwan, Province of China': 'East and South-East Asia',
-    'Turks and Caicos Islands': 'North America',
-    'Viet Nam': 'East and South-East Asia',
-    'Yemen': 'Near and Middle East /South-West Asia'
-    }
-    
-    # Dict for missing regions
-    missing_region_map = {
-    'Albania': 'Europe',
-    'Antigua and Barbuda': 'Americas',
-    'Aruba': 'Americas',
-    'Australia': 'Oceania',
-    'Bahrain': 'Asia',
-    'Barbados': 'Americas',
-    'Bermuda': 'Americas',
-    'Burundi': 'Africa',
-    'Cameroon': 'Africa',
-    'Congo, the Democratic Republic of the': 'Africa',
-    'Cook Islands': 'Oceania',
-    'Costa Rica': 'Americas',
-    'Curaçao': 'Americas',
-    'Dominica': 'Americas',
-    'Equatorial Guinea': 'Africa',
-    'Eritrea': 'Africa',
-    'Estonia': 'Europe',
-    'Faroe Islands': 'Europe',
-    'Fiji': 'Oceania',
-    'Gabon': 'Africa',
-    'Grenada': 'Americas',
-    'Guadeloupe': 'Americas',
-    'Guernsey': 'Europe',
-    'Guyana': 'Americas',
-    'Haiti': 'Americas',
-    'Hong Kong': 'Asia',
-    'Iraq':'Asia',
-    'Isle of Man': 'Europe',
-    'Israel': 'Asia',
-    'Jamaica': 'Americas',
-    'Jordan': 'Asia',
-    "Korea, Democratic People's Republic of": 'Asia',
-    'Kosovo under UNSCR 1244': 'Europe',
-    'Kuwait': 'Asia',
-    'Liberia': 'Africa',
-    'Madagascar': 'Africa',
-    'Mongolia': 'Asia',
-    'Namibia': 'Africa',
-    'Netherlands Antilles': 'Americas',
-    'Nicaragua': 'Americas',
-    'Niger': 'Africa',
-    'Oman': 'Asia',
-    'Panama': 'Americas',
-    'Papua New Guinea': 'Oceania',
-    'Puerto Rico': 'Americas',
-    'Qatar': 'Asia',
-    'Rwanda': 'Africa',
-    'Réunion': 'Asia',
-    'Saint Pierre and Miquelon': 'Americas',
-    'Samoa': 'Oceania',
-    'Sao Tome and Principe': 'Africa',
-    'Seychelles': 'Africa',
-    'St. Lucia': 'Americas',
-    'Suriname': 'Americas',
-    'Taiwan, Province of China': 'Asia',
-    'Turks and Caicos Islands': 'Americas',
-    'Viet Nam': 'Asia',
-    'Yemen': 'Asia'
-    }
-    
-    # Initialize an empty set
-    countries_set = set()
-    
-    # Iterate over the period of time
-    for year in range(start_year, end_year + 1):
-        
-        # Iterte over the drug list
+
+    years = list(range(start_year, end_year + 1))
+    frames = tuple(df_ids[year] for year in years)
+    key = (tuple(id(frame) for frame in frames), tuple(drug_list), start_year, end_year)
+
+    if key not in locations_cache:
+        # Seizures of any of the drugs and their derivatives
         for drug in drug_list:
-            # Get the approriate filtering function
-            drug_filter = get_drug_selector_function(drug)
-            # Filter the dataset for the given drug
-            df_year_drug = drug_filter(df_ids[year])
-        
-            # Add the countries corresponding to every year
-            countries_set = countries_set.union(set(df_year_drug['COUNTRY_OF_SEIZURE'].unique()))
-            countries_set = countries_set.union(set(df_year_drug['DEPARTURE_COUNTRY'].unique()))
-            countries_set = countries_set.union(set(df_year_drug['DESTINATION_COUNTRY'].unique()))
-            countries_set = countries_set.union(set(df_year_drug['PRODUCING_COUNTRY'].unique()))
-    
-    # Remove irrelevant values
-    countries_set.remove(np.nan)
-    countries_set.remove('Unknown')
-    countries_set.remove('Other')
-    
-    # Convert the set to a list
-    countries_list = sorted(list(countries_set))
+            if drug not in drug_derivatives:
+                raise Exception('Invalid drug type!')
+        drug_names = [name for drug in drug_list for name in drug_derivatives[drug]]
+
+        # All locations of all years, in a single column; invalid ones (nan, 'Unknown', 'Other') are dropped
+        location_columns = ['COUNTRY_OF_SEIZURE', 'DEPARTURE_COUNTRY', 'DESTINATION_COUNTRY', 'PRODUCING_COUNTRY']
+        locations = np.concatenate([get_valid_locations(frame.loc[frame['DRUG_NAME'].isin(drug_names), column])
+                                    for frame in frames for column in location_columns])
+        countries_list = sorted(pd.unique(locations[locations != None]))
+
+        # First appearance of every country of seizure (across all drugs): rows are concatenated in (year, row) order
+        df_first = pd.concat([frame[['COUNTRY_OF_SEIZURE', 'SUBREGION_OF_SEIZURE', 'REGION_OF_SEIZURE']].astype(object) for frame in frames], ignore_index = True)
+        df_first = df_first.drop_duplicates('COUNTRY_OF_SEIZURE', keep = 'first').set_index('COUNTRY_OF_SEIZURE')
+        first_sub_region = df_first['SUBREGION_OF_SEIZURE'].to_dict()
+        first_region = df_first['REGION_OF_SEIZURE'].to_dict()
+
+        # Countries never seized are 'Unknown', and the manual maps take precedence
+        sub_region_dict = {country: Countries.missing_sub_region_map.get(country, first_sub_region.get(country, 'Unknown')) for country in countries_list}
+        region_dict = {country: Countries.missing_region_map.get(country, first_region.get(country, 'Unknown')) for country in countries_list}
+        locations_cache[key] = (countries_list, sub_region_dict, region_dict)
+        for frame in {id(frame): frame for frame in frames}.values():
+            weakref.finalize(frame, locations_cache.pop, key, None)
+
+    countries_list, sub_region_dict, region_dict = locations_cache[key]
 
-    # Initialize empty dicts for sub-regions and regions
-    sub_region_dict = dict()
-    region_dict = dict()
-    
-    # Get the sub-regions and regions
-    for country in countries_list:
-        # Add 'Unknown' for all countries initially
-        sub_region_dict[country] = 'Unknown'
-        region_dict[country] = 'Unknown'
-        # Look for the country's first appearence in the yearly seizures
-        for year in range(start_year, end_year + 1):
-            df_temp = df_ids[year][df_ids[year]['COUNTRY_OF_SEIZURE'] == country]
-            # If found, exract the sub-region and region and break, no need to look any further
-            if len(df_temp) > 0:
-                sub_region_dict[country] = df_temp['SUBREGION_OF_SEIZURE'].unique()[0]
-                region_dict[country] = df_temp['REGION_OF_SEIZURE'].unique()[0]
-                break
-        if country in missing_sub_region_map:
-            sub_region_dict[country] = missing_sub_region_map[country]
-        if country in missing_region_map:
-            region_dict[country] = missing_region_map[country]
-    
     # Return a sorted list of countries present in the IDS dataset, as well as the corresponding sub-regions and regions dictionaries
-    return countries_list, sub_region_dict, region_dict
+    return list(countries_list), dict(sub_region_dict), dict(region_dict)
           
+# Drug names (in the IDS data) of each drug and its derivatives
+drug_derivatives = {
+    'Cocaine': ['Cocaine', 'Cocaine HCL', 'Coca paste', 'Coca leaf', 'Crack'],
+    'Heroin': ['Heroin', 'Opium', 'Opium Poppy', 'Poppy seeds', 'Poppy straw', 'Morphine'],
+    'Cannabis': ['Cannabis', 'Cannabis resin', 'Cannabis Oil', 'Cannabis Pollen', 'Cannabis seeds', 'Cannabis Plants', 'Cannabis Herb (Marijuana)', 'THC'],
+    'Amphetamine': ['Amphetamine', 'Methamphetamine', '4-Fluoroamphetamine', 'MDA'],
+    'Ecstasy': ['Ecstasy', 'MDP2P']
+}
+
 def get_drug_selector_function(drug_name):
     '''
     Parameters
@@ -254,51 +176,58 @@ def get_drug_selector_function(drug_name):
     -------
     function
         Function generator for filtering functions used to extract seizures corresponding to a given drug and its derivatives.
+        On categorical DRUG_NAME columns the membership test runs on the codes.
     '''
     
-    if drug_name == 'Cocaine':
-        
-        def get_cocaine_seizures(df):
-            df_cocaine = df[(df['DRUG_NAME'] == 'Cocaine') | (df['DRUG_NAME'] == 'Cocaine HCL') | (df['DRUG_NAME'] == 'Coca paste') | (df['DRUG_NAME'] == 'Coca leaf') | (df['DRUG_NAME'] == 'Crack')]
-            return df_cocaine
-            
-        return get_cocaine_seizures
+    if drug_name not in drug_derivatives:
+        raise Exception('Invalid drug type!')
     
-    elif drug_name == 'Heroin':
-        
-        def get_heroin_seizures(df):
-            df_heroin = df[(df['DRUG_NAME'] == 'Heroin') | (df['DRUG_NAME'] == 'Opium') | (df['DRUG_NAME'] == 'Opium Poppy') | (df['DRUG_NAME'] == 'Poppy seeds') | (df['DRUG_NAME'] == 'Poppy straw') | (df['DRUG_NAME'] == 'Morphine')]
-            return df_heroin
-            
-        return get_heroin_seizures
+    drug_names = drug_derivatives[drug_name]
     
-    elif drug_name == 'Cannabis':
-        
-        def get_cannabis_seizures(df):
-            df_cannabis = df[(df['DRUG_NAME'] == 'Cannabis') | (df['DRUG_NAME'] == 'Cannabis resin') | (df['DRUG_NAME'] == 'Cannabis Oil') | (df['DRUG_NAME'] == 'Cannabis Pollen') | (df['DRUG_NAME'] == 'Cannabis seeds') | (df['DRUG_NAME'] == 'Cannabis Plants') | (df['DRUG_NAME'] == 'Cannabis Herb (Marijuana)') | (df['DRUG_NAME'] == 'THC')]
-            return df_cannabis
-            
-        return get_cannabis_seizures
-    
-    elif drug_name == 'Amphetamine':
-        
-        def get_amphetamine_seizures(df):
-            df_amphetamine = df[(df['DRUG_NAME'] == 'Amphetamine') | (df['DRUG_NAME'] == 'Methamphetamine') | (df['DRUG_NAME'] == '4-Fluoroamphetamine') | (df['DRUG_NAME'] == 'MDA')]
-            return df_amphetamine
-            
-        return get_amphetamine_seizures
-    
-    elif drug_name == 'Ecstasy':
-        
-        def get_ecstasy_seizures(df):
-            df_ecstasy = df[(df['DRUG_NAME'] == 'Ecstasy') | (df['DRUG_NAME'] == 'MDP2P')]
-            return df_ecstasy
-            
-        return get_ecstasy_seizures
+    def get_drug_seizures(df):
+        return df[df['DRUG_NAME'].isin(drug_names)]
     
-    else:
-        raise Exception('Invalid drug type!')            
-          
+    return get_drug_seizures
+
+def get_valid_locations(column):
+    '''
+    Parameters
+    ----------
+    column : pd.Series
+        A location column of the IDS data.
+    Returns
+    -------
+    locations : np.ndarray of objects
+        The locations, with None in place of non-string values (including nan), 'Unknown' and 'Other'.
+        On categorical columns the check is done once per category and broadcast through the codes.
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        categories = np.asarray(column.cat.categories, dtype = object)
+        # The extra last entry maps the missing code (-1) to None
+        categories = np.append(np.where([isinstance(c, str) and c not in invalid_locations for c in categories], categories, None), None)
+        return categories[column.cat.codes.to_numpy()]
+    values = column.to_numpy(dtype = object)
+    return np.where([isinstance(v, str) and v not in invalid_locations for v in values], values, None)
+
+def get_seizure_totals(df_year_drug, drug, registry):
+    '''
+    Parameters
+    ----------
+    df_year_drug : pd.DataFrame
+        Seizures of the drug and its derivatives, e.g. the output of the selector function of get_drug_selector_function.
+    drug : str
+    registry : pd.DataFrame
+        Output of Countries.get_country_registry.
+    Returns
+    -------
+    drug_total : np.ndarray
+        Converts the seizures to kg of the drug and sums them by country of seizure, indexed by registry ID (before any purity adjustment).
+    '''
+    codes = Countries.get_country_codes(df_year_drug['COUNTRY_OF_SEIZURE'], registry)
+    amounts = np.array([convert(drug, amount, name, unit) for amount, name, unit in
+                        zip(df_year_drug['AMOUNT_OF_DRUG'], df_year_drug['DRUG_NAME'], df_year_drug['DRUG_UNIT'])], dtype = float)
+    return np.bincount(codes[codes >= 0], weights = amounts[codes >= 0], minlength = len(registry))
+
 def get_purity_adjusted_seizures(df_ids, countries_list = None, sub_region_dict = None, region_dict = None, 
                                  drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'], 
                                  purity_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Purity.xlsx', 
@@ -318,15 +247,21 @@ def get_purity_adjusted_seizures(df_ids, countries_list = None, sub_region_dict
     '''
     
     # Create output df
-    output_df = create_output_df() # dict of pd.DataFrames
+    output_df = create_output_df(start_year = start_year, end_year = end_year) # dict of pd.DataFrames
     
     # Obtain the purity levels 
-    df_pure = read_xlsx(file = purity_file)
+    df_pure = read_xlsx(file = purity_file, start_year = start_year, end_year = end_year, schema = None)
     
     # Get the list of countries
     if countries_list is None:
-        countries_list, sub_region_dict, region_dict = get_ids_locations(df_ids)
+        countries_list, sub_region_dict, region_dict = get_ids_locations(df_ids, start_year = start_year, end_year = end_year)
     
+    # Countries are matched by their registry IDs
+    registry = Countries.get_country_registry(countries_list)
+    country_codes = Countries.get_country_codes(countries_list, registry)
+    regions = [region_dict.get(country, 'Unknown') if region_dict is not None else 'Unknown' for country in countries_list]
+    sub_regions = [sub_region_dict.get(country, 'Unknown') if sub_region_dict is not None else 'Unknown' for country in countries_list]
+
     # Get the seizures corresponding to each drug
     for drug in drug_list:
         
@@ -336,38 +271,16 @@ def get_purity_adjusted_seizures(df_ids, countries_list = None, sub_region_dict
         # Iterate over the period of time
         for year in range(start_year, end_year + 1):
             
-            # Obtain drug and drug derivatives seizures for the given year for all countries
-            df_year_drug = get_drug_seizures(df_ids[year])
-            
-            # Iterate over the country list
-            for country in countries_list:
-                
-                # Initialize container for total drug seizures
-                drug_total = 0
-                
-                # Obtain region and sub-region
-                try:
-                    region = region_dict[country]
-                except:
-                    region = 'Unknown'
-                try:
-                    sub_region = sub_region_dict[country]
-                except:
-                    sub_region = 'Unknown'
-                
-                # Obtain drug and drug derivatives seizures for the given year and country
-                df_year_drug_country = df_year_drug[df_year_drug['COUNTRY_OF_SEIZURE'] == country]
-                
-                # Conversion for drug derivatives
-                for i in df_year_drug_country.index:
-                    drug_total += convert(drug, df_year_drug_country['AMOUNT_OF_DRUG'][i], df_year_drug_country['DRUG_NAME'][i], df_year_drug_country['DRUG_UNIT'][i]) 
-                
-                # Adjust total seized quantity by the average purity level in each country
-                drug_total *= float(df_pure[year][(df_pure[year]['Location'] == country) & (df_pure[year]['Drug'] == drug)]['Purity'])
-                
-                # Add the new row to target_df
-                new_row = {'Region': region, 'SubRegion': sub_region, 'Country': country, 'Drug': drug, 'Quantity(kg)': drug_total}
-                output_df[year].loc[len(output_df[year])] = new_row
+            # Total seizures of drug and drug derivatives of every country by ID
+            drug_total = get_seizure_totals(get_drug_seizures(df_ids[year]), drug, registry)
+
+            # Adjust total seized quantity by the average purity level in each country
+            purity = Countries.get_country_values(df_pure[year], 'Location', 'Purity', registry, mask = df_pure[year]['Drug'] == drug)
+            drug_total = (drug_total * purity)[country_codes]
+
+            # Add the new rows to target_df
+            new_rows = pd.DataFrame({'Region': regions, 'SubRegion': sub_regions, 'Country': list(countries_list), 'Drug': drug, 'Quantity(kg)': drug_total})
+            output_df[year] = pd.concat([output_df[year], new_rows], ignore_index = True)
     
     # Sort each df alphabetically by country
     for year in range(start_year, end_year + 1):
@@ -412,7 +325,24 @@ def get_relative_weights(network):
         network[prev][curr]['relative_weight'] = network[prev][curr]['weight'] / d[curr]
     return network
 
-def get_market_values(network, year, drug, file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Markets.xlsx'):
+def update_relative_weights(network, nodes):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    nodes : iterable
+    Returns
+    -------
+    network : nx.DiGraph
+        Recomputes the 'relative_weight' attribute of the incoming edges of the given nodes only.
+    '''
+    for curr in nodes:
+        total = sum(network[prev][curr]['weight'] for prev in network.predecessors(curr))
+        for prev in network.predecessors(curr):
+            network[prev][curr]['relative_weight'] = network[prev][curr]['weight'] / total
+    return network
+
+def get_market_values(network, year, drug, file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Markets.xlsx', nodes = None):
     '''
     Parameters
     ----------
@@ -422,6 +352,8 @@ def get_market_values(network, year, drug, file = '/Users/mateicosa/Bocconi/BIDS
     drug : str
     file : str, optional
         The default is 'Markets.xlsx'.
+    nodes : iterable, optional
+        The default is None (all nodes).
     Returns
     -------
     network : nx.DiGraph
@@ -429,11 +361,81 @@ def get_market_values(network, year, drug, file = '/Users/mateicosa/Bocconi/BIDS
     '''
     xlsx = pd.ExcelFile(file)
     df_markets = pd.read_excel(xlsx, str(year))
-    for node in network.nodes:
+    if nodes is None:
+        nodes = network.nodes
+    for node in nodes:
         network.nodes[node]['market'] = float(df_markets[(df_markets['Drug'] == drug) & (df_markets['Country'] == node)]['Market(kg)'])
     return network 
 
-def get_drug_network_by_year(drug_name, df_ids, start_year = 2006, end_year = 2017):
+def add_seizures_to_network(network, drug_name, df_year_drug):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    drug_name : str
+    df_year_drug : pd.DataFrame
+        Seizures of the given drug (and its derivatives) for a single year.
+    Returns
+    -------
+    affected_nodes : set
+        Adds the seizures to the network in place (nodes, 'producer' flags and edge weights) and returns the nodes whose incoming edges changed.
+    '''
+    
+    # Keep track of the nodes whose relative weights must be recomputed
+    affected_nodes = set()
+    
+    # Validate the location columns once, on the codes where possible
+    columns = zip(get_valid_locations(df_year_drug['COUNTRY_OF_SEIZURE']), df_year_drug['DRUG_NAME'],
+                  get_valid_locations(df_year_drug['PRODUCING_COUNTRY']), get_valid_locations(df_year_drug['DEPARTURE_COUNTRY']),
+                  get_valid_locations(df_year_drug['DESTINATION_COUNTRY']), df_year_drug['AMOUNT_OF_DRUG'], df_year_drug['DRUG_UNIT'])
+    
+    # Iterate over the results
+    for country_of_seizure, drug_type, producing_country, departure_country, destination_country, drug_amount, drug_unit in columns:
+        
+        # Skip seizures without a valid country of seizure
+        if country_of_seizure is None:
+            continue
+        
+        # Convert the amount of drug to pure subtance in kilograms
+        drug_amount = convert(drug_name, drug_amount, drug_type, drug_unit)
+        
+        # Check is drug amount is positive, else continue
+        if drug_amount <= 0:
+            continue
+            
+        # Add the nodes if not present already
+        if not (country_of_seizure in network.nodes):
+            network.add_node(country_of_seizure, producer = False)
+        if (not (departure_country in network.nodes)) and (not (departure_country is None)):
+            network.add_node(departure_country, producer = False)
+        if not (destination_country in network.nodes) and (not (destination_country is None)):
+            network.add_node(destination_country, producer = False)
+        if not (producing_country is None):
+            if not (producing_country in network.nodes):
+                network.add_node(producing_country, producer = True)
+            else:
+                # Update the profucer status
+                network.nodes[producing_country]['producer'] = True
+        
+        # Add the edges
+        if (not (departure_country is None)) and (departure_country != country_of_seizure) and (departure_country != 'Unknown'):
+            
+            if (departure_country, country_of_seizure) in network.edges:
+                network.edges[departure_country, country_of_seizure]['weight'] += drug_amount
+            else:
+                network.add_edge(departure_country, country_of_seizure, weight = drug_amount)
+            affected_nodes.add(country_of_seizure)
+        if (not (destination_country is None)) and (destination_country != country_of_seizure) and (destination_country != 'Unknown'):
+            
+            if (country_of_seizure, destination_country) in network.edges:
+                network.edges[country_of_seizure, destination_country]['weight'] += drug_amount
+            else:
+                network.add_edge(country_of_seizure, destination_country, weight = drug_amount)
+            affected_nodes.add(destination_country)
+    
+    return affected_nodes
+
+def get_drug_network_by_year(drug_name, df_ids, start_year = 2006, end_year = 2017, markets_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Markets.xlsx'):
     '''
     Parameters
     ----------
@@ -441,6 +443,7 @@ def get_drug_network_by_year(drug_name, df_ids, start_year = 2006, end_year = 20
     df_ids : dict of pd.DataFrames
     start_year : int, optional
     end_year : int, optional
+    markets_file : str, optional
     Returns
     -------
     network_by_year : dict of nx.DiGraphs
@@ -464,82 +467,150 @@ def get_drug_network_by_year(drug_name, df_ids, start_year = 2006, end_year = 20
         # Select the drug
         df_year_drug = get_drug_seizures(df_year)
         
-        # Iterate over the results
-        for ind in df_year_drug.index:
-            
-            # Check for non-string values (including nan) and 'Unknown' or 'Other'
-            if not isinstance(df_year_drug['COUNTRY_OF_SEIZURE'][ind], str) or df_year_drug['COUNTRY_OF_SEIZURE'][ind] == 'Unknown' or df_year_drug['COUNTRY_OF_SEIZURE'][ind] == 'Other':
-                continue 
-            else:
-                country_of_seizure = df_year_drug['COUNTRY_OF_SEIZURE'][ind]
-                
-            # Get the specific drug type
-            drug_type = df_year_drug['DRUG_NAME'][ind]
-            
-            # Check for non-string values (including nan) and 'Unknown' or 'Other'
-            if isinstance(df_year_drug['PRODUCING_COUNTRY'][ind], str) and df_year_drug['PRODUCING_COUNTRY'][ind] != 'Unknown' and df_year_drug['PRODUCING_COUNTRY'][ind] != 'Other':
-                producing_country = df_year_drug['PRODUCING_COUNTRY'][ind]
-            else:
-                producing_country = None
-            
-            # Check for non-string values (including nan) and 'Unknown' or 'Other'
-            if isinstance(df_year_drug['DEPARTURE_COUNTRY'][ind], str) and df_year_drug['DEPARTURE_COUNTRY'][ind] != 'Unknown' and df_year_drug['DEPARTURE_COUNTRY'][ind] != 'Other':
-                departure_country = df_year_drug['DEPARTURE_COUNTRY'][ind]
-            else:
-                departure_country = None
-            
-            # Check for non-string values (including nan) and 'Unknown' or 'Other'
-            if isinstance(df_year_drug['DESTINATION_COUNTRY'][ind], str) and df_year_drug['DESTINATION_COUNTRY'][ind] != 'Unknown' and df_year_drug['DESTINATION_COUNTRY'][ind] != 'Other':
-                destination_country = df_year_drug['DESTINATION_COUNTRY'][ind]
-            else:
-                destination_country = None
-            
-            # Get the drug amount
-            drug_amount = df_year_drug['AMOUNT_OF_DRUG'][ind]
-            
-            # Get the drug unit
-            drug_unit = df_year_drug['DRUG_UNIT'][ind]
+        # Add the nodes and edges
+        add_seizures_to_network(network_by_year[year], drug_name, df_year_drug)
+    
+        # Add the relative weights of each edge for the current year
+        network_by_year[year] = get_relative_weights(network_by_year[year])    
+        
+        # Add the national market value to each node
+        network_by_year[year] = get_market_values(network_by_year[year], year, drug_name, file = markets_file)
+    
+    # Return the dictionary of networks
+    return network_by_year
+
+def get_seizure_chunks(new_seizures, year = None, year_column = 'YEAR'):
+    '''
+    Parameters
+    ----------
+    new_seizures : pd.DataFrame or iterator of pd.DataFrames
+        New IDS rows, in the same layout as the yearly sheets.
+    year : int, optional
+        Year of all the new rows; if None, the year is read from year_column.
+    year_column : str, optional
+    Returns
+    -------
+    generator of (year, pd.DataFrame)
+        Splits a batch (or a stream of chunks) of new seizures by year.
+    '''
+    
+    if isinstance(new_seizures, pd.DataFrame):
+        new_seizures = [new_seizures]
+    
+    for chunk in new_seizures:
+        if year is not None:
+            yield year, chunk
+        else:
+            for chunk_year, df_chunk_year in chunk.groupby(year_column):
+                yield int(chunk_year), df_chunk_year
+
+def update_drug_network_by_year(network_by_year, drug_name, new_seizures, year = None, year_column = 'YEAR',
+                                markets_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Markets.xlsx'):
+    '''
+    Parameters
+    ----------
+    network_by_year : dict of nx.DiGraphs
+        Output of get_drug_network_by_year, updated in place.
+    drug_name : str
+    new_seizures : pd.DataFrame or iterator of pd.DataFrames
+    year : int, optional
+        Year of all the new rows; if None, the year is read from year_column.
+    year_column : str, optional
+    markets_file : str, optional
+    Returns
+    -------
+    network_by_year : dict of nx.DiGraphs
+        Applies new seizures as deltas: edge weights and producer flags are updated, relative weights are recomputed only for the nodes 
+        whose incoming edges changed, and market values are read only for new nodes. The cost is proportional to the size of the delta.
+    '''
+    
+    # Get the selector function for the given drug-type
+    get_drug_seizures = get_drug_selector_function(drug_name)
+    
+    for chunk_year, df_chunk in get_seizure_chunks(new_seizures, year = year, year_column = year_column):
+        
+        # Create the network if the year is new
+        if chunk_year not in network_by_year:
+            network_by_year[chunk_year] = nx.DiGraph()
+        network = network_by_year[chunk_year]
+        
+        # Add the nodes and edges
+        nodes_before = set(network.nodes)
+        affected_nodes = add_seizures_to_network(network, drug_name, get_drug_seizures(df_chunk))
+        
+        # Update the relative weights of the incoming edges of the affected nodes
+        update_relative_weights(network, affected_nodes)
+        
+        # Add the national market value to the new nodes
+        new_nodes = set(network.nodes) - nodes_before
+        if len(new_nodes) > 0:
+            get_market_values(network, chunk_year, drug_name, file = markets_file, nodes = new_nodes)
+    
+    return network_by_year
+
+def update_purity_adjusted_seizures(output_df, new_seizures, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'], 
+                                    year = None, year_column = 'YEAR', sub_region_dict = None, region_dict = None,
+                                    purity_file = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/Purity.xlsx'):
+    '''
+    Parameters
+    ----------
+    output_df : dict of pd.DataFrame
+        Output of get_purity_adjusted_seizures, updated in place.
+    new_seizures : pd.DataFrame or iterator of pd.DataFrames
+    drug_list : list of str, optional
+    year : int, optional
+        Year of all the new rows; if None, the year is read from year_column.
+    year_column : str, optional
+    sub_region_dict : dict, optional
+    region_dict : dict, optional
+    purity_file : str, optional
+    Returns
+    -------
+    output_df : dict of pd.DataFrame
+        Adds the purity-adjusted quantities of the new seizures to the national totals of the affected countries only.
+    '''
+    
+    # Purity levels are read once per year
+    df_pure = dict()
+    
+    for chunk_year, df_chunk in get_seizure_chunks(new_seizures, year = year, year_column = year_column):
+        
+        if chunk_year not in df_pure:
+            df_pure[chunk_year] = pd.read_excel(purity_file, str(chunk_year))
+        if chunk_year not in output_df:
+            output_df[chunk_year] = create_output_df(start_year = chunk_year, end_year = chunk_year)[chunk_year]
+        
+        new_rows = False
+        for drug in drug_list:
             
-            # Convert the amount of drug to pure subtance in kilograms
-            drug_amount = convert(drug_name, drug_amount, drug_type, drug_unit)
+            # Obtain drug and drug derivatives seizures for the given chunk
+            df_chunk_drug = get_drug_selector_function(drug)(df_chunk)
             
-            # Check is drug amount is positive, else continue
-            if drug_amount <= 0:
-                continue
-                
-            # Add the nodes if not present already
-            if not (country_of_seizure in network_by_year[year].nodes):
-                network_by_year[year].add_node(country_of_seizure, producer = False)
-            if (not (departure_country in network_by_year[year].nodes)) and (not (departure_country is None)):
-                network_by_year[year].add_node(departure_country, producer = False)
-            if not (destination_country in network_by_year[year].nodes) and (not (destination_country is None)):
-                network_by_year[year].add_node(destination_country, producer = False)
-            if not (producing_country is None):
-                if not (producing_country in network_by_year[year].nodes):
-                    network_by_year[year].add_node(producing_country, producer = True)
-                else:
-                    # Update the profucer status
-                    network_by_year[year].nodes[producing_country]['producer'] = True
+            # Conversion for drug derivatives, then total per country of seizure
+            totals = dict()
+            for country, amount, name, unit in zip(get_valid_locations(df_chunk_drug['COUNTRY_OF_SEIZURE']), df_chunk_drug['AMOUNT_OF_DRUG'],
+                                                   df_chunk_drug['DRUG_NAME'], df_chunk_drug['DRUG_UNIT']):
+                if country is None:
+                    continue
+                totals[country] = totals.get(country, 0) + convert(drug, amount, name, unit)
             
-            # Add the edges
-            if (not (departure_country is None)) and (departure_country != country_of_seizure) and (departure_country != 'Unknown'):
+            for country, drug_total in totals.items():
                 
-                if (departure_country, country_of_seizure) in network_by_year[year].edges:
-                    network_by_year[year].edges[departure_country, country_of_seizure]['weight'] += drug_amount
-                else:
-                    network_by_year[year].add_edge(departure_country, country_of_seizure, weight = drug_amount)
-            if (not (destination_country is None)) and (destination_country != country_of_seizure) and (destination_country != 'Unknown'):
+                # Adjust total seized quantity by the average purity level in the country
+                drug_total *= float(df_pure[chunk_year][(df_pure[chunk_year]['Location'] == country) & (df_pure[chunk_year]['Drug'] == drug)]['Purity'])
                 
-                if (country_of_seizure, destination_country) in network_by_year[year].edges:
-                    network_by_year[year].edges[country_of_seizure, destination_country]['weight'] += drug_amount
+                mask = (output_df[chunk_year]['Country'] == country) & (output_df[chunk_year]['Drug'] == drug)
+                if mask.any():
+                    output_df[chunk_year].loc[mask, 'Quantity(kg)'] += drug_total
                 else:
-                    network_by_year[year].add_edge(country_of_seizure, destination_country, weight = drug_amount)
-    
-        # Add the relative weights of each edge for the current year
-        network_by_year[year] = get_relative_weights(network_by_year[year])    
+                    region = region_dict.get(country, 'Unknown') if region_dict is not None else 'Unknown'
+                    sub_region = sub_region_dict.get(country, 'Unknown') if sub_region_dict is not None else 'Unknown'
+                    new_row = {'Region': region, 'SubRegion': sub_region, 'Country': country, 'Drug': drug, 'Quantity(kg)': drug_total}
+                    output_df[chunk_year].loc[len(output_df[chunk_year])] = new_row
+                    new_rows = True
         
-        # Add the national market value to each node
-        network_by_year[year] = get_market_values(network_by_year[year], year, drug_name)
+        # Keep the alphabetical order if new countries were added
+        if new_rows:
+            output_df[chunk_year] = output_df[chunk_year].sort_values(['Region', 'SubRegion', 'Country', 'Drug']).reset_index(drop = True)
     
-    # Return the dictionary of networks
-    return network_by_year
\ No newline at end of file
+    return output_df
@@ -0,0 +1,260 @@
+
+# Collection of functions for the sensitivity of the networks and markets to the conversion factors of Quantity_Conversion;
+# The seizures are parsed once: their converted quantities are grouped by conversion path and by edge (and by country of seizure);
+# A scenario multiplies some of the factors, which rescales every path by prod(multiplier ** exponent),
+# so all scenarios are evaluated at once as a (scenarios x paths) @ (paths x edges) product.
+
+import itertools
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+import Countries
+import Seizures
+import Quantity_Conversion
+
+def get_factor_keys():
+    '''
+    Returns
+    -------
+    factor_keys : dict
+        All the conversion factors that can be perturbed, keyed by name (e.g. 'opium_yield', 'unit_to_kg[Litre]').
+    '''
+    keys = list(Quantity_Conversion.factors.keys()) + [('unit_to_kg', unit) for unit in Quantity_Conversion.unit_to_kg.keys() if isinstance(unit, str)]
+    return {Quantity_Conversion.get_factor_name(key): key for key in keys}
+
+def get_seizure_groups(drug, df_ids, countries_list = None, start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    drug : str
+    df_ids : dict of pd.DataFrames
+    countries_list : list of str, optional
+        Countries of the seizure totals; by default those of Seizures.get_ids_locations.
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    groups : dict
+        'paths' (conversion paths), 'factors' (names of the factors they use) and 'exponents' (paths x factors);
+        'edges' (Year, Source, Target) and 'edge_amounts' (paths x edges), with the same edges and weights as Seizures.get_drug_network_by_year;
+        'seizure_amounts' (paths x (years * countries)), with the totals of Seizures.get_seizure_totals.
+    '''
+    if countries_list is None:
+        countries_list, _, _ = Seizures.get_ids_locations(df_ids, drug_list = [drug], start_year = start_year, end_year = end_year)
+    registry = Countries.get_country_registry(countries_list)
+    n = len(countries_list)
+    # Position of every country ID in countries_list (-1 if absent), whatever the order of the list
+    position = np.full(len(registry), -1)
+    position[Countries.get_country_codes(countries_list, registry)] = np.arange(n)
+
+    get_drug_seizures = Seizures.get_drug_selector_function(drug)
+    path_index, paths = dict(), []
+    edge_index, edges = dict(), []
+    edge_rows, edge_cols, edge_vals = [], [], []
+    total_rows, total_cols, total_vals = [], [], []
+
+    for t, year in enumerate(range(start_year, end_year + 1)):
+        df_year_drug = get_drug_seizures(df_ids[year])
+        seizure = Seizures.get_valid_locations(df_year_drug['COUNTRY_OF_SEIZURE'])
+        departure = Seizures.get_valid_locations(df_year_drug['DEPARTURE_COUNTRY'])
+        destination = Seizures.get_valid_locations(df_year_drug['DESTINATION_COUNTRY'])
+        codes = Countries.get_country_codes(df_year_drug['COUNTRY_OF_SEIZURE'], registry)
+        quantities = df_year_drug['AMOUNT_OF_DRUG'].to_numpy(dtype = float)
+
+        # Convert all the seizures of each (form, unit) pair at once, along its conversion path
+        amounts = np.zeros(len(df_year_drug))
+        row_paths = np.zeros(len(df_year_drug), dtype = int)
+        pairs = pd.DataFrame({'form': df_year_drug['DRUG_NAME'].astype(object).to_numpy(), 'unit': df_year_drug['DRUG_UNIT'].astype(object).to_numpy()})
+        for (form, unit), rows in pairs.groupby(['form', 'unit'], dropna = False, sort = False).indices.items():
+            unit = np.nan if isinstance(unit, float) and np.isnan(unit) else unit
+            path = tuple(Quantity_Conversion.get_conversion_path(drug, form, unit))
+            if path not in path_index:
+                path_index[path] = len(paths)
+                paths.append(path)
+            row_paths[rows] = path_index[path]
+            amounts[rows] = Quantity_Conversion.apply_path(quantities[rows].copy(), path)
+
+        # Seizure totals by country of seizure
+        columns = np.where(codes >= 0, position[codes], -1)
+        valid = columns >= 0
+        total_rows.append(row_paths[valid])
+        total_cols.append(t * n + columns[valid])
+        total_vals.append(amounts[valid])
+
+        # Edges, with the rules of Seizures.add_seizures_to_network
+        for p, amount, c, d, s in zip(row_paths, amounts, seizure, departure, destination):
+            if c is None or not amount > 0:
+                continue
+            for u, v, endpoint in [(d, c, d), (c, s, s)]:
+                if endpoint is None or endpoint == c or endpoint == 'Unknown':
+                    continue
+                key = (year, u, v)
+                if key not in edge_index:
+                    edge_index[key] = len(edges)
+                    edges.append(key)
+                edge_rows.append(p)
+                edge_cols.append(edge_index[key])
+                edge_vals.append(amount)
+
+    factor_names = sorted(set(Quantity_Conversion.get_factor_name(key) for path in paths for key, _ in path))
+    factor_position = {name: k for k, name in enumerate(factor_names)}
+    exponents = np.zeros((len(paths), len(factor_names)))
+    for p, path in enumerate(paths):
+        for key, exponent in path:
+            exponents[p, factor_position[Quantity_Conversion.get_factor_name(key)]] += exponent
+
+    num_paths = len(paths)
+    edge_amounts = sp.csr_matrix((np.array(edge_vals, dtype = float), (np.array(edge_rows, dtype = int), np.array(edge_cols, dtype = int))),
+                                 shape = (num_paths, len(edges)))
+    seizure_amounts = sp.csr_matrix((np.concatenate(total_vals), (np.concatenate(total_rows), np.concatenate(total_cols))),
+                                    shape = (num_paths, (end_year - start_year + 1) * n))
+
+    return {'drug': drug, 'countries': list(countries_list), 'start_year': start_year, 'end_year': end_year,
+            'paths': paths, 'factors': factor_names, 'exponents': exponents,
+            'edges': pd.DataFrame(edges, columns = ['Year', 'Source', 'Target']), 'edge_amounts': edge_amounts,
+            'seizure_amounts': seizure_amounts}
+
+def get_scenarios(factor_names, method = 'grid', levels = (0.5, 0.75, 1.0, 1.5, 2.0), num_samples = 1000, low = 0.5, high = 2.0, seed = 0):
+    '''
+    Parameters
+    ----------
+    factor_names : list of str
+        Factors to perturb, see get_factor_keys.
+    method : str, optional
+        'grid' for all combinations of levels, 'random' for log-uniform draws in [low, high]. The default is 'grid'.
+    levels : tuple of float, optional
+        Multipliers of the grid.
+    num_samples : int, optional
+    low : float, optional
+    high : float, optional
+    seed : int, optional
+    Returns
+    -------
+    scenarios : pd.DataFrame
+        One row per scenario and one column per factor, holding the multiplier of the factor.
+    '''
+    factor_keys = get_factor_keys()
+    unknown = [name for name in factor_names if name not in factor_keys]
+    if len(unknown) > 0:
+        raise Exception(f'Unknown conversion factors: {unknown}')
+    if method == 'grid':
+        return pd.DataFrame(list(itertools.product(levels, repeat = len(factor_names))), columns = list(factor_names), dtype = float)
+    if method == 'random':
+        rng = np.random.default_rng(seed)
+        return pd.DataFrame(np.exp(rng.uniform(np.log(low), np.log(high), size = (num_samples, len(factor_names)))), columns = list(factor_names))
+    raise Exception("Invalid method, choose from ['grid', 'random']!")
+
+def get_path_multipliers(groups, scenarios):
+    '''
+    Parameters
+    ----------
+    groups : dict
+        Output of get_seizure_groups.
+    scenarios : pd.DataFrame
+        Output of get_scenarios.
+    Returns
+    -------
+    multipliers : np.ndarray (scenarios x paths)
+        Rescaling of every conversion path in every scenario; factors that no path uses have no effect.
+    '''
+    if (scenarios.to_numpy() <= 0).any():
+        raise Exception('Multipliers must be positive!')
+    log_multipliers = np.zeros((len(scenarios), len(groups['factors'])))
+    for k, name in enumerate(groups['factors']):
+        if name in scenarios.columns:
+            log_multipliers[:, k] = np.log(scenarios[name].to_numpy(dtype = float))
+    return np.exp(log_multipliers @ groups['exponents'].T)
+
+def get_market_inputs(drug, countries_list, sources_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/', start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    drug : str
+    countries_list : list of str
+    sources_path : str, optional
+        Directory containing Purity.xlsx and Markets.xlsx.
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    (purity, consumption) : tuple of np.ndarrays (countries x years)
+        The inputs of the markets which do not depend on the conversion factors.
+    '''
+    years = list(range(start_year, end_year + 1))
+    registry = Countries.get_country_registry(countries_list)
+    codes = Countries.get_country_codes(countries_list, registry)
+    xlsx_pure, xlsx_markets = pd.ExcelFile(sources_path + 'Purity.xlsx'), pd.ExcelFile(sources_path + 'Markets.xlsx')
+    purity, consumption = [], []
+    for year in years:
+        df_pure, df_markets = pd.read_excel(xlsx_pure, str(year)), pd.read_excel(xlsx_markets, str(year))
+        purity.append(Countries.get_country_values(df_pure, 'Location', 'Purity', registry, mask = df_pure['Drug'] == drug)[codes])
+        consumption.append(Countries.get_country_values(df_markets, 'Country', 'Consumption(kg)', registry, mask = df_markets['Drug'] == drug)[codes])
+    return np.column_stack(purity), np.column_stack(consumption)
+
+def run_sensitivity(groups, scenarios, purity = None, consumption = None):
+    '''
+    Parameters
+    ----------
+    groups : dict
+        Output of get_seizure_groups.
+    scenarios : pd.DataFrame
+        Output of get_scenarios.
+    purity : np.ndarray (countries x years), optional
+    consumption : np.ndarray (countries x years), optional
+        With purity, see get_market_inputs; if given, the markets are recomputed as well.
+    Returns
+    -------
+    output : dict
+        'edge_weights' (scenarios x edges), 'seizures' (scenarios x countries x years) and, optionally, 'markets' (scenarios x countries x years),
+        i.e. consumption plus purity-adjusted seizures, as in Aggregation.get_national_markets_df.
+    '''
+    multipliers = get_path_multipliers(groups, scenarios)
+    n, T = len(groups['countries']), groups['end_year'] - groups['start_year'] + 1
+    output = {'scenarios': scenarios, 'edges': groups['edges'],
+              'edge_weights': np.asarray((groups['edge_amounts'].T @ multipliers.T).T),
+              'seizures': np.asarray((groups['seizure_amounts'].T @ multipliers.T).T).reshape(len(scenarios), T, n).transpose(0, 2, 1)}
+    if purity is not None and consumption is not None:
+        output['markets'] = consumption + purity * output['seizures']
+    return output
+
+def get_edge_ranges(groups, output):
+    '''
+    Parameters
+    ----------
+    groups : dict
+    output : dict
+        Output of run_sensitivity.
+    Returns
+    -------
+    df_edges : pd.DataFrame
+        Baseline, minimum and maximum weight of every edge across the scenarios, sorted by relative range.
+    '''
+    df_edges = groups['edges'].copy()
+    df_edges['Baseline'] = np.asarray(groups['edge_amounts'].sum(axis = 0)).ravel()
+    df_edges['Min'] = output['edge_weights'].min(axis = 0)
+    df_edges['Max'] = output['edge_weights'].max(axis = 0)
+    df_edges['Relative_Range'] = np.divide(df_edges['Max'] - df_edges['Min'], df_edges['Baseline'],
+                                           out = np.zeros(len(df_edges)), where = df_edges['Baseline'].to_numpy() > 0)
+    return df_edges.sort_values('Relative_Range', ascending = False).reset_index(drop = True)
+
+def get_edge_elasticities(groups):
+    '''
+    Parameters
+    ----------
+    groups : dict
+        Output of get_seizure_groups.
+    Returns
+    -------
+    df_elasticities : pd.DataFrame
+        (Year, Source, Target, Factor, Elasticity, Weight) rows for every edge and every factor that moves it;
+        the elasticity d log(weight) / d log(factor) is the share of the edge weight converted through the factor (negative for divisors).
+    '''
+    weights = np.asarray(groups['edge_amounts'].sum(axis = 0)).ravel()
+    shares = np.asarray(groups['edge_amounts'].T @ groups['exponents'])
+    shares = np.divide(shares, weights[:, None], out = np.zeros_like(shares), where = weights[:, None] > 0)
+    rows, cols = np.nonzero(shares)
+    df_elasticities = groups['edges'].iloc[rows].reset_index(drop = True)
+    df_elasticities['Factor'] = np.array(groups['factors'], dtype = object)[cols]
+    df_elasticities['Elasticity'] = shares[rows, cols]
+    df_elasticities['Weight'] = weights[rows]
+    return df_elasticities
@@ -0,0 +1,289 @@
+
+# Collection of functions for computing descriptive network statistics over all yearly networks;
+# Each network is converted to a sparse matrix once and every metric is computed with sparse/dense array operations;
+# The output is a single tidy (Drug, Year, Country, Metric, Value) table, optionally cached on disk.
+
+import os
+import hashlib
+import numpy as np
+import pandas as pd
+import networkx as nx
+import scipy.sparse as sp
+
+def get_matrix(network, weight = 'weight'):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    weight : str, optional
+    Returns
+    -------
+    (nodes, W, A) : tuple
+        Converts the network to a weighted (W) and a binary (A) sparse adjacency matrix in CSR format.
+    '''
+    nodes = list(network.nodes)
+    W = nx.to_scipy_sparse_array(network, nodelist = nodes, weight = weight, format = 'csr').astype(float)
+    A = W.copy()
+    A.data[:] = 1.0
+    # Edges with zero weight are still edges
+    if A.nnz != network.number_of_edges():
+        A = nx.to_scipy_sparse_array(network, nodelist = nodes, weight = None, format = 'csr').astype(float)
+    return nodes, W, A
+
+def get_pagerank(W, alpha = 0.85, tol = 1e-6, max_iter = 100):
+    '''
+    Parameters
+    ----------
+    W : scipy.sparse matrix
+    alpha : float, optional
+    tol : float, optional
+    max_iter : int, optional
+    Returns
+    -------
+    x : np.ndarray
+        Computes weighted PageRank by power iteration (same conventions as nx.pagerank: uniform teleport and dangling redistribution).
+    '''
+    n = W.shape[0]
+    if n == 0:
+        return np.zeros(0)
+    out_strength = np.asarray(W.sum(axis = 1)).ravel()
+    dangling = out_strength == 0
+    inv = np.divide(1.0, out_strength, out = np.zeros(n), where = ~dangling)
+    P = sp.diags(inv) @ W
+    x = np.full(n, 1.0 / n)
+    for _ in range(max_iter):
+        x_last = x
+        x = alpha * (P.T @ x + x[dangling].sum() / n) + (1 - alpha) / n
+        if np.abs(x - x_last).sum() < n * tol:
+            break
+    return x
+
+def get_betweenness(A, k = None, seed = 0, batch_size = 256):
+    '''
+    Parameters
+    ----------
+    A : scipy.sparse matrix
+        Binary adjacency matrix.
+    k : int, optional
+        Number of sampled sources for approximate betweenness; None computes it exactly.
+    seed : int, optional
+    batch_size : int, optional
+        Number of sources processed together.
+    Returns
+    -------
+    betweenness : np.ndarray
+        Computes normalized, unweighted directed betweenness with Brandes' algorithm expressed as sparse matrix products,
+        running the breadth-first searches of a whole batch of sources at once.
+    '''
+    n = A.shape[0]
+    betweenness = np.zeros(n)
+    if n < 3:
+        return betweenness
+
+    sources = np.arange(n)
+    if k is not None and k < n:
+        sources = np.random.default_rng(seed).choice(n, size = k, replace = False)
+
+    AT = A.T.tocsr()
+    for start in range(0, len(sources), batch_size):
+        batch = sources[start:start + batch_size]
+        S = len(batch)
+
+        # Forward phase: level-synchronous BFS, counting shortest paths
+        frontier = np.zeros((n, S))
+        frontier[batch, np.arange(S)] = 1.0
+        sigma = frontier.copy()
+        visited = frontier > 0
+        levels = [visited.copy()]
+        while True:
+            counts = AT @ frontier
+            counts[visited] = 0.0
+            new = counts > 0
+            if not new.any():
+                break
+            sigma += counts
+            visited |= new
+            levels.append(new)
+            frontier = counts
+
+        # Backward phase: dependency accumulation, from the deepest level up
+        delta = np.zeros((n, S))
+        for depth in range(len(levels) - 1, 0, -1):
+            coeff = np.where(levels[depth], (1.0 + delta) / np.where(sigma > 0, sigma, 1.0), 0.0)
+            delta += levels[depth - 1] * sigma * (A @ coeff)
+
+        # Sources do not count towards their own betweenness
+        delta[batch, np.arange(S)] = 0.0
+        betweenness += delta.sum(axis = 1)
+
+    # Same normalization as nx.betweenness_centrality for directed graphs
+    scale = 1.0 / ((n - 1) * (n - 2))
+    if k is not None and k < n:
+        scale *= n / k
+    return betweenness * scale
+
+def get_clustering(A):
+    '''
+    Parameters
+    ----------
+    A : scipy.sparse matrix
+        Binary adjacency matrix.
+    Returns
+    -------
+    clustering : np.ndarray
+        Computes the unweighted directed clustering coefficient of every node (Fagiolo, 2007), as in nx.clustering.
+    '''
+    S = A + A.T
+    triangles = np.asarray((S @ S).multiply(S).sum(axis = 1)).ravel() / 2
+    total_degree = np.asarray(S.sum(axis = 1)).ravel()
+    reciprocal_degree = A.multiply(A.T).sum(axis = 1)
+    reciprocal_degree = np.asarray(reciprocal_degree).ravel()
+    denominator = total_degree * (total_degree - 1) - 2 * reciprocal_degree
+    return np.divide(triangles, denominator, out = np.zeros(len(triangles)), where = denominator > 0)
+
+def get_assortativity(A, codes):
+    '''
+    Parameters
+    ----------
+    A : scipy.sparse matrix
+    codes : np.ndarray of int
+        Category code of every node.
+    Returns
+    -------
+    r : float
+        Computes the attribute assortativity coefficient of the categories from the edge mixing matrix (as nx.attribute_assortativity_coefficient).
+    '''
+    rows, cols = A.nonzero()
+    if len(rows) == 0:
+        return np.nan
+    num_codes = codes.max() + 1
+    e = np.bincount(codes[rows] * num_codes + codes[cols], minlength = num_codes ** 2).reshape(num_codes, num_codes).astype(float)
+    e /= e.sum()
+    ab = (e.sum(axis = 1) * e.sum(axis = 0)).sum()
+    if ab == 1:
+        return np.nan
+    return (np.trace(e) - ab) / (1 - ab)
+
+def get_network_statistics(network, sub_region_dict = None, region_dict = None, betweenness_k = None, seed = 0):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    sub_region_dict : dict, optional
+        Used when the nodes carry no 'Sub_Region' attribute.
+    region_dict : dict, optional
+        Used when the nodes carry no 'Region' attribute.
+    betweenness_k : int, optional
+        Number of sampled sources for approximate betweenness; None computes it exactly.
+    seed : int, optional
+    Returns
+    -------
+    (node_df, graph_df) : tuple of pd.DataFrames
+        Computes all node-level metrics (one column per metric) and graph-level metrics (one row per metric) of a single network.
+    '''
+    nodes, W, A = get_matrix(network)
+    n = len(nodes)
+
+    node_df = pd.DataFrame({'Country': nodes,
+                            'in_degree': np.asarray(A.sum(axis = 0)).ravel(),
+                            'out_degree': np.asarray(A.sum(axis = 1)).ravel(),
+                            'in_strength': np.asarray(W.sum(axis = 0)).ravel(),
+                            'out_strength': np.asarray(W.sum(axis = 1)).ravel(),
+                            'pagerank': get_pagerank(W),
+                            'betweenness': get_betweenness(A, k = betweenness_k, seed = seed),
+                            'clustering': get_clustering(A)})
+
+    # Category codes for assortativity
+    def _get_codes(attribute, mapping):
+        values = [network.nodes[node].get(attribute, mapping.get(node, 'Unknown') if mapping is not None else 'Unknown') for node in nodes]
+        return pd.factorize(pd.Series(values, dtype = object))[0]
+
+    edges = A.nnz
+    graph = {'nodes': n,
+             'edges': edges,
+             'density': edges / (n * (n - 1)) if n > 1 else 0.0,
+             'reciprocity': A.multiply(A.T).nnz / edges if edges > 0 else np.nan,
+             'total_weight': W.sum(),
+             'region_assortativity': get_assortativity(A, _get_codes('Region', region_dict)) if n > 0 else np.nan,
+             'sub_region_assortativity': get_assortativity(A, _get_codes('Sub_Region', sub_region_dict)) if n > 0 else np.nan}
+    graph_df = pd.DataFrame({'Metric': list(graph.keys()), 'Value': list(graph.values())})
+
+    return node_df, graph_df
+
+def get_cache_parameters(networks, sub_region_dict, region_dict, betweenness_k, seed):
+    '''
+    Parameters
+    ----------
+    networks : dict
+        {drug: {year: nx.DiGraph}}.
+    sub_region_dict : dict or None
+    region_dict : dict or None
+    betweenness_k : int or None
+    seed : int
+    Returns
+    -------
+    parameters : dict
+        The parameters of get_statistics, with a digest of the networks (drugs, years, nodes, edges and total weight)
+        and of the region dicts, stored with the cached table so that a cache computed differently is not reused.
+    '''
+    digest = hashlib.md5()
+    for drug in networks.keys():
+        for year, network in networks[drug].items():
+            total_weight = sum(weight for _, _, weight in network.edges(data = 'weight', default = 0.0))
+            digest.update(f'{drug}:{year}:{network.number_of_nodes()}:{network.number_of_edges()}:{total_weight!r};'.encode())
+    for mapping in [sub_region_dict, region_dict]:
+        digest.update(repr(sorted(mapping.items()) if mapping is not None else None).encode())
+    return {'betweenness_k': betweenness_k, 'seed': seed, 'digest': digest.hexdigest()}
+
+def get_statistics(networks, sub_region_dict = None, region_dict = None, betweenness_k = None, seed = 0,
+                   cache_file = None, overwrite = False):
+    '''
+    Parameters
+    ----------
+    networks : dict
+        Either {year: nx.DiGraph} or {drug: {year: nx.DiGraph}}.
+    sub_region_dict : dict, optional
+    region_dict : dict, optional
+    betweenness_k : int, optional
+        Number of sampled sources for approximate betweenness; None computes it exactly.
+    seed : int, optional
+    cache_file : str, optional
+        Pickle file where the table is cached, together with the parameters it was computed with (see get_cache_parameters);
+        if it exists with the same parameters (and overwrite is False), it is read instead of recomputed.
+    overwrite : bool, optional
+    Returns
+    -------
+    output_df : pd.DataFrame
+        Computes the standard battery of node- and graph-level metrics for every network, as a tidy (Drug, Year, Country, Metric, Value) table.
+        Graph-level metrics have a missing Country.
+    '''
+    # Accept a single dict of yearly networks as well
+    if all(isinstance(value, nx.DiGraph) for value in networks.values()):
+        networks = {None: networks}
+
+    parameters = get_cache_parameters(networks, sub_region_dict, region_dict, betweenness_k, seed)
+    if cache_file is not None and os.path.exists(cache_file) and not overwrite:
+        cached_df = pd.read_pickle(cache_file)
+        if cached_df.attrs.get('parameters', None) == parameters:
+            return cached_df
+
+    frames = []
+    for drug in networks.keys():
+        for year in networks[drug].keys():
+            node_df, graph_df = get_network_statistics(networks[drug][year], sub_region_dict = sub_region_dict, region_dict = region_dict,
+                                                       betweenness_k = betweenness_k, seed = seed)
+            node_df = node_df.melt(id_vars = 'Country', var_name = 'Metric', value_name = 'Value')
+            graph_df.insert(0, 'Country', None)
+            df_year = pd.concat([node_df, graph_df], ignore_index = True)
+            df_year.insert(0, 'Year', year)
+            df_year.insert(0, 'Drug', drug)
+            frames.append(df_year)
+
+    output_df = pd.concat(frames, ignore_index = True)
+    output_df['Metric'] = output_df['Metric'].astype('category')
+    output_df.attrs['parameters'] = parameters
+
+    if cache_file is not None:
+        output_df.to_pickle(cache_file)
+
+    return output_df
@@ -0,0 +1,319 @@
+
+# Collection of functions for generating synthetic IDS-shaped seizure tables and matching source tables;
+# The default period is 2006-2017;
+# The drugs of interest are: cocaine, opioids, cannabis, amphetamines, and ecstasy;
+# The output mimics the column names, drug forms and units of the real data, so that every data_prep stage can be run at arbitrary scale.
+
+import numpy as np
+import pandas as pd
+import Seizures
+
+# Drug forms and the units they are reported in (only combinations handled by Quantity_Conversion)
+drug_forms = {
+    'Cocaine': {
+        'Cocaine': ['Kilogram', 'Gram', 'Unit', 'Tablet', 'Pound'],
+        'Cocaine HCL': ['Kilogram', 'Gram', 'Unit'],
+        'Coca paste': ['Kilogram', 'Gram'],
+        'Coca leaf': ['Kilogram', 'Gram', 'Ton'],
+        'Crack': ['Kilogram', 'Gram', 'Unit', 'Capsule']
+        },
+    'Heroin': {
+        'Heroin': ['Kilogram', 'Gram', 'Unit', 'Capsule', 'Piece'],
+        'Opium': ['Kilogram', 'Gram', 'Hectars', 'Plants', 'Acres'],
+        'Opium Poppy': ['Kilogram', 'Plants', 'Hectars'],
+        'Poppy seeds': ['Kilogram', 'Gram'],
+        'Poppy straw': ['Kilogram', 'Plants', 'Hectars'],
+        'Morphine': ['Kilogram', 'Gram', 'Ampoule', 'Litre']
+        },
+    'Cannabis': {
+        'Cannabis': ['Kilogram', 'Gram', 'Plants'],
+        'Cannabis resin': ['Kilogram', 'Gram'],
+        'Cannabis Oil': ['Litre', 'Millilitre', 'Kilogram'],
+        'Cannabis Pollen': ['Kilogram', 'Gram'],
+        'Cannabis seeds': ['Seed', 'Kilogram'],
+        'Cannabis Plants': ['Plants', 'Bush', 'Hectars'],
+        'Cannabis Herb (Marijuana)': ['Kilogram', 'Gram', 'Cigarette'],
+        'THC': ['Gram', 'Tablet']
+        },
+    'Amphetamine': {
+        'Amphetamine': ['Kilogram', 'Gram', 'Tablet'],
+        'Methamphetamine': ['Kilogram', 'Gram', 'Tablet', 'Thousand of doses'],
+        '4-Fluoroamphetamine': ['Gram', 'Pill'],
+        'MDA': ['Gram', 'Tablet', 'Hundred of units']
+        },
+    'Ecstasy': {
+        'Ecstasy': ['Tablet', 'Pill', 'Kilogram', 'Thousand of tablets'],
+        'MDP2P': ['Kilogram', 'Litre']
+        }
+    }
+
+# Sub-regions of the IDS dataset and the region they belong to
+sub_region_to_region = {
+    'East Africa': 'Africa',
+    'North Africa': 'Africa',
+    'Southern Africa': 'Africa',
+    'West and Central Africa': 'Africa',
+    'Caribbean': 'Americas',
+    'Central America': 'Americas',
+    'North America': 'Americas',
+    'South America': 'Americas',
+    'Central Asia and Transcaucasian countries': 'Asia',
+    'East and South-East Asia': 'Asia',
+    'Near and Middle East /South-West Asia': 'Asia',
+    'South Asia': 'Asia',
+    'East Europe': 'Europe',
+    'South-East Europe': 'Europe',
+    'West & Central Europe': 'Europe',
+    'Oceania': 'Oceania'
+    }
+
+# Drug names used by the raw purity and prevalence sources
+purity_drug_groups = ['“Ecstasy”-type substances', 'Amphetamine-type stimulants', 'Cocaine-type', 'Opioids', 'Cannabis-type']
+prevalence_drugs = ['Cocaine', 'Opioids', 'Amphetamines', 'Ecstasy', 'Cannabis']
+
+def get_locations(n_locations, seed = 0):
+    '''
+    Parameters
+    ----------
+    n_locations : int
+    seed : int, optional
+    Returns
+    -------
+    df_loc : pd.DataFrame
+        Creates synthetic locations with a sub-region, a region and a popularity weight (heavy-tailed, so that a few hubs dominate the traffic).
+    '''
+
+    if n_locations < 2:
+        raise Exception('At least two locations are required!')
+
+    rng = np.random.default_rng(seed)
+
+    # The UK is always present since Prevalence.get_prevalence_values adjusts it explicitly
+    names = ['United Kingdom'] + [f'Country_{i:05d}' for i in range(1, n_locations)]
+    sub_regions = np.array(list(sub_region_to_region.keys()))[rng.integers(0, len(sub_region_to_region), n_locations)]
+    regions = [sub_region_to_region[sub_region] for sub_region in sub_regions]
+
+    # Zipf-like popularity of each location
+    weights = 1 / np.arange(1, n_locations + 1) ** 0.8
+    weights = rng.permutation(weights)
+
+    df_loc = pd.DataFrame({'Country': names, 'SubRegion': sub_regions, 'Region': regions, 'Weight': weights / weights.sum()})
+    return df_loc
+
+def get_seizures(df_loc, n_rows, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'],
+                 producer_share = 0.05, seed = 0, start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    df_loc : pd.DataFrame
+    n_rows : int
+        Total number of seizure records across the whole period.
+    drug_list : list of str, optional
+    producer_share : float, optional
+        Share of locations acting as producers.
+    seed : int, optional
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    df_ids : dict of pd.DataFrames
+        Creates a synthetic IDS dataset with the same layout as Seizures.read_xlsx (one dataframe per year).
+    '''
+
+    if start_year > end_year:
+        raise Exception('Invalid years!')
+    if not (isinstance(start_year, int) and isinstance(end_year, int)):
+        raise Exception('Invalid years!')
+
+    rng = np.random.default_rng(seed)
+    names = df_loc['Country'].to_numpy(dtype = object)
+    weights = df_loc['Weight'].to_numpy()
+    n_locations = len(names)
+    n_years = end_year - start_year + 1
+
+    # Producers are drawn among the locations once for the whole period
+    producers = rng.choice(n_locations, size = max(1, int(producer_share * n_locations)), replace = False)
+
+    # Helper that replaces a share of the values with missing, 'Unknown' and 'Other' entries, as in the real data
+    def _add_missing(values, p_nan, p_unknown = 0.05, p_other = 0.02):
+        u = rng.random(len(values))
+        values[u < p_nan] = np.nan
+        values[(u >= p_nan) & (u < p_nan + p_unknown)] = 'Unknown'
+        values[(u >= p_nan + p_unknown) & (u < p_nan + p_unknown + p_other)] = 'Other'
+        return values
+
+    df_ids = dict()
+    rows_per_year = np.full(n_years, n_rows // n_years)
+    rows_per_year[:n_rows % n_years] += 1
+
+    for i, year in enumerate(range(start_year, end_year + 1)):
+        n = int(rows_per_year[i])
+
+        # Drug, drug form and unit of each record
+        drug_idx = rng.integers(0, len(drug_list), n)
+        drug_names = np.empty(n, dtype = object)
+        drug_units = np.empty(n, dtype = object)
+        for d, drug in enumerate(drug_list):
+            mask = drug_idx == d
+            forms = list(drug_forms[drug].keys())
+            form_idx = rng.integers(0, len(forms), mask.sum())
+            drug_names[mask] = np.array(forms, dtype = object)[form_idx]
+            for f, form in enumerate(forms):
+                form_mask = np.flatnonzero(mask)[form_idx == f]
+                units = np.array(drug_forms[drug][form], dtype = object)
+                drug_units[form_mask] = units[rng.integers(0, len(units), len(form_mask))]
+
+        # Locations involved in each record; the seizure (sub-)region is consistent with the country of seizure
+        seizure_idx = rng.choice(n_locations, size = n, p = weights)
+        departure = _add_missing(names[rng.choice(n_locations, size = n, p = weights)], p_nan = 0.4)
+        destination = _add_missing(names[rng.choice(n_locations, size = n, p = weights)], p_nan = 0.4)
+        producing = _add_missing(names[rng.choice(producers, size = n)], p_nan = 0.6)
+
+        df_year = pd.DataFrame({
+            'REGION_OF_SEIZURE': df_loc['Region'].to_numpy()[seizure_idx],
+            'SUBREGION_OF_SEIZURE': df_loc['SubRegion'].to_numpy()[seizure_idx],
+            'COUNTRY_OF_SEIZURE': names[seizure_idx],
+            'DRUG_NAME': drug_names,
+            'AMOUNT_OF_DRUG': np.round(rng.lognormal(mean = 1.0, sigma = 2.0, size = n), 3),
+            'DRUG_UNIT': drug_units,
+            'PRODUCING_COUNTRY': producing,
+            'DEPARTURE_COUNTRY': departure,
+            'DESTINATION_COUNTRY': destination
+            })
+
+        df_ids[year] = df_year
+
+    return df_ids
+
+def get_sources(df_loc, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'],
+                observed_share = 0.3, seed = 0, start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    df_loc : pd.DataFrame
+    drug_list : list of str, optional
+    observed_share : float, optional
+        Share of (location, drug, year) triples present in the raw purity and prevalence tables; the rest is left for imputation.
+    seed : int, optional
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    sources : dict
+        Creates the tables matching the synthetic locations:
+        'purity', 'prevalence', 'population', 'markets' (dict of pd.DataFrames in the layout of the .xlsx sources),
+        'production' (pd.DataFrame), 'raw_purity' and 'raw_prevalence' (pd.DataFrames in the layout returned by Purity.prepare_data and Prevalence.prepare_data).
+    '''
+
+    if start_year > end_year:
+        raise Exception('Invalid years!')
+    if not (isinstance(start_year, int) and isinstance(end_year, int)):
+        raise Exception('Invalid years!')
+
+    rng = np.random.default_rng(seed)
+    names = df_loc['Country'].to_numpy(dtype = object)
+    n_locations = len(names)
+    years = list(range(start_year, end_year + 1))
+
+    sources = {'purity': dict(), 'prevalence': dict(), 'population': dict(), 'markets': dict()}
+
+    # Population is persistent across years with a small growth rate
+    population = rng.lognormal(mean = 15.0, sigma = 1.5, size = n_locations)
+
+    for year in years:
+        population *= 1 + rng.normal(0.01, 0.005, n_locations)
+        sources['population'][year] = pd.DataFrame({'Location': names, 'Population': population.copy()})
+
+        # Long format: one row per (location, drug)
+        location_col = np.repeat(names, len(drug_list))
+        drug_col = np.tile(np.array(drug_list, dtype = object), n_locations)
+        sources['purity'][year] = pd.DataFrame({'Location': location_col, 'Drug': drug_col,
+                                                'Purity': rng.uniform(0.2, 0.9, len(location_col))})
+        sources['prevalence'][year] = pd.DataFrame({'Location': location_col, 'Drug': drug_col,
+                                                    'Prevalence': rng.uniform(0.001, 0.03, len(location_col))})
+
+        seizures = rng.lognormal(mean = 2.0, sigma = 2.0, size = len(location_col))
+        consumption = rng.lognormal(mean = 5.0, sigma = 2.0, size = len(location_col))
+        sources['markets'][year] = pd.DataFrame({'SubRegion': np.repeat(df_loc['SubRegion'].to_numpy(), len(drug_list)),
+                                                 'Country': location_col, 'Drug': drug_col,
+                                                 'Seizures(kg)': seizures, 'Consumption(kg)': consumption,
+                                                 'Market(kg)': seizures + consumption})
+
+    # Global production per drug and year
+    sources['production'] = pd.DataFrame({'Drug': np.repeat(np.array(drug_list, dtype = object), len(years)),
+                                          'Year': np.tile(years, len(drug_list)),
+                                          'Quantity(kg)': rng.uniform(1e5, 1e6, len(drug_list) * len(years))})
+
+    # Raw purity observations (only a share of triples is observed)
+    def _get_observed(drugs):
+        loc_idx, drug_idx, year_idx = np.meshgrid(np.arange(n_locations), np.arange(len(drugs)), np.arange(len(years)), indexing = 'ij')
+        mask = rng.random(loc_idx.shape) < observed_share
+        return loc_idx[mask], np.array(drugs, dtype = object)[drug_idx[mask]], np.array(years)[year_idx[mask]]
+
+    loc_idx, drugs, obs_years = _get_observed(purity_drug_groups)
+    typical = rng.uniform(0.2, 0.9, len(loc_idx))
+    sources['raw_purity'] = pd.DataFrame({'Country/Territory': names[loc_idx],
+                                          'SubRegion': df_loc['SubRegion'].to_numpy()[loc_idx],
+                                          'Region': df_loc['Region'].to_numpy()[loc_idx],
+                                          'DrugGroup': drugs, 'Year': obs_years,
+                                          'Typical': typical,
+                                          'Minimum': typical * rng.uniform(0.5, 1.0, len(loc_idx)),
+                                          'Maximum': np.minimum(typical * rng.uniform(1.0, 1.5, len(loc_idx)), 1.0),
+                                          'Measurement': '% (percent)', 'LevelOfSale': 'Wholesale'})
+
+    loc_idx, drugs, obs_years = _get_observed(prevalence_drugs)
+    sources['raw_prevalence'] = pd.DataFrame({'Country/Territory': names[loc_idx],
+                                              'Sub-region': df_loc['SubRegion'].to_numpy()[loc_idx],
+                                              'Region': df_loc['Region'].to_numpy()[loc_idx],
+                                              'Drug': drugs, 'Year': obs_years,
+                                              'Best': rng.uniform(0.001, 0.03, len(loc_idx))})
+
+    return sources
+
+def write_sources(sources, target_path):
+    '''
+    Parameters
+    ----------
+    sources : dict
+    target_path : str
+        Directory where the .xlsx files are written (with a trailing '/').
+    Returns
+    -------
+    None; Writes Purity.xlsx, Prevalence.xlsx, Population.xlsx, Markets.xlsx (one spreadsheet per year) and Production.xlsx, as expected by Seizures and Aggregation.
+    '''
+
+    file_names = {'purity': 'Purity.xlsx', 'prevalence': 'Prevalence.xlsx', 'population': 'Population.xlsx', 'markets': 'Markets.xlsx'}
+    for key, file_name in file_names.items():
+        with pd.ExcelWriter(target_path + file_name) as writer:
+            for year in sources[key].keys():
+                sources[key][year].to_excel(writer, sheet_name = str(year))
+    sources['production'].to_excel(target_path + 'Production.xlsx', index = False)
+
+def get_synthetic_data(n_rows = 10000, n_locations = 200, drug_list = ['Cocaine', 'Heroin', 'Cannabis', 'Amphetamine', 'Ecstasy'],
+                       seed = 0, start_year = 2006, end_year = 2017, typed = True):
+    '''
+    Parameters
+    ----------
+    n_rows : int, optional
+        The default is 10000.
+    n_locations : int, optional
+        The default is 200.
+    drug_list : list of str, optional
+    seed : int, optional
+    start_year : int, optional
+    end_year : int, optional
+    typed : bool, optional
+        If True, the seizures follow Seizures.ids_schema, as returned by Seizures.read_xlsx.
+    Returns
+    -------
+    df_loc : pd.DataFrame
+    df_ids : dict of pd.DataFrames
+    sources : dict
+        Generates a consistent set of synthetic locations, seizures and source tables.
+    '''
+    df_loc = get_locations(n_locations, seed = seed)
+    df_ids = get_seizures(df_loc, n_rows, drug_list = drug_list, seed = seed, start_year = start_year, end_year = end_year)
+    if typed:
+        df_ids = {year: Seizures.apply_schema(df_ids[year]) for year in df_ids.keys()}
+    sources = get_sources(df_loc, drug_list = drug_list, seed = seed, start_year = start_year, end_year = end_year)
+    return df_loc, df_ids, sources
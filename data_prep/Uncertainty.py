@@ -0,0 +1,308 @@
+
+# Collection of functions for propagating the uncertainty of the source data to the market estimates;
+# Purity, prevalence and price are drawn from triangular distributions spanning their source ranges (minimum, typical, maximum),
+# as (samples x countries x years) arrays, and pushed through the market computation of Aggregation.get_national_markets_df;
+# The result is a set of quantile bands per country and year, which can be attached to the exported networks.
+
+import numpy as np
+import pandas as pd
+import Countries
+import Seizures
+import Purity
+import Prevalence
+import Features
+
+# Raw sources of the ranges: drug column and names, (typical, low, high) columns and sub-region column
+range_sources = {
+    'purity': {'file': 'Drug_Purities.xlsx', 'drug_column': 'DrugGroup', 'drug_names': Purity.drug_name_change,
+               'columns': ('Typical', 'Minimum', 'Maximum'), 'sub_region_column': 'SubRegion'},
+    'prevalence': {'file': 'Drug_prevalence.xlsx', 'drug_column': 'Drug', 'drug_names': Prevalence.drug_name_change,
+                   'columns': ('Best', 'Lower', 'Upper'), 'sub_region_column': 'Sub-region'},
+    'price': {'file': 'Drug_prices.xlsx', 'drug_column': 'Drug', 'drug_names': {'Cocaine salts': 'Cocaine', 'Cocaine hydrochloride': 'Cocaine'},
+              'columns': ('Typical_USD', 'Minimum_USD', 'Maximum_USD'), 'sub_region_column': 'SubRegion'}
+}
+
+# Node attribute names of the estimated quantities (gml keys cannot contain brackets)
+attribute_names = {
+    'Seizures(kg)': 'seizures',
+    'Consumption(kg)': 'consumption',
+    'Market(kg)': 'market',
+    'Price(USD)': 'price',
+    'Market(USD)': 'market_value'
+}
+
+def read_range_source(source, sources_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/'):
+    '''
+    Parameters
+    ----------
+    source : str
+        'purity', 'prevalence' or 'price'.
+    sources_path : str, optional
+    Returns
+    -------
+    df_raw : pd.DataFrame
+        Reads the raw source with the same filters as Purity.prepare_data, Prevalence.prepare_data and Features.get_drug_prices,
+        keeping the range columns; the 'Drug' column holds the drug names used elsewhere (e.g. 'Heroin').
+    '''
+    info = range_sources[source]
+    file = sources_path + info['file']
+    if source == 'purity':
+        # The bounds are rescaled together with the typical values reported in percent
+        df_raw = Purity.prepare_data(file = file)
+    elif source == 'prevalence':
+        df_raw = Prevalence.prepare_data(file = file)
+        # Same scale as the best estimate
+        for column in info['columns'][1:]:
+            if column in df_raw.columns:
+                df_raw[column] = df_raw[column] / 100
+    elif source == 'price':
+        df_raw = pd.read_excel(file)
+        df_raw = df_raw[(df_raw['Unit'] == 'Kilogram') & (df_raw['LevelOfSale'] == 'Wholesale')]
+    else:
+        raise Exception(f'Invalid source, choose from {list(range_sources.keys())}!')
+    df_raw = df_raw.copy()
+    df_raw['Drug'] = df_raw[info['drug_column']].replace(info['drug_names'])
+    return df_raw
+
+def get_relative_ranges(df_raw, source, drug, countries_list, sub_region_dict, region_dict, start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    df_raw : pd.DataFrame
+        Output of read_range_source.
+    source : str
+    drug : str
+    countries_list : list of str
+    sub_region_dict : dict
+    region_dict : dict
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    (low, high) : tuple of np.ndarrays
+        Ratios of the lower and upper bounds to the typical value, per (country, year). Where a country has no observation,
+        the average ratios of its sub-region, region or of the world in that year are used (as in the imputation of the typical values);
+        bounds that are never reported give no spread (ratio 1).
+    '''
+    typical, low, high = range_sources[source]['columns']
+    years = np.arange(start_year, end_year + 1)
+    df = df_raw[(df_raw['Drug'] == drug) & df_raw['Year'].isin(years)]
+    df = df[df[typical] > 0]
+
+    ratios = pd.DataFrame({'Sub_Region': df[range_sources[source]['sub_region_column']].to_numpy(), 'Region': df['Region'].to_numpy(),
+                           'Year': df['Year'].to_numpy(dtype = int)})
+    ratios['low'] = (df[low] / df[typical]).clip(upper = 1).to_numpy() if low in df.columns else np.nan
+    ratios['high'] = (df[high] / df[typical]).clip(lower = 1).to_numpy() if high in df.columns else np.nan
+    registry = Countries.get_country_registry(countries_list)
+    ratios['Code'] = Countries.get_country_codes(df['Country/Territory'], registry)
+
+    # Targets: every (country, year), in countries_list order
+    n, T = len(countries_list), len(years)
+    targets = {'Code': np.repeat(Countries.get_country_codes(countries_list, registry), T),
+               'Sub_Region': np.repeat([sub_region_dict.get(c) for c in countries_list], T),
+               'Region': np.repeat([region_dict.get(c) for c in countries_list], T),
+               'Year': np.tile(years, n)}
+
+    # Most specific level first; each level only fills what is still missing
+    output = np.full((2, n * T), np.nan)
+    for level in [['Code', 'Year'], ['Sub_Region', 'Year'], ['Region', 'Year'], ['Year']]:
+        means = ratios[ratios['Code'] >= 0].groupby(level)[['low', 'high']].mean() if level[0] == 'Code' else ratios.groupby(level)[['low', 'high']].mean()
+        index = pd.MultiIndex.from_arrays([targets[key] for key in level]) if len(level) > 1 else pd.Index(targets['Year'])
+        values = means.reindex(index).to_numpy().T
+        output = np.where(np.isnan(output), values, output)
+    output = np.where(np.isnan(output), 1.0, output)
+    return output[0].reshape(n, T), output[1].reshape(n, T)
+
+def sample_triangular(typical, low, high, num_samples, rng, persistent = True, upper_bound = None):
+    '''
+    Parameters
+    ----------
+    typical : np.ndarray (countries x years)
+    low : np.ndarray (countries x years)
+        Ratio of the lower bound to the typical value.
+    high : np.ndarray (countries x years)
+        Ratio of the upper bound to the typical value.
+    num_samples : int
+    rng : np.random.Generator
+    persistent : bool, optional
+        If True, a country keeps the same position within its ranges in every year (systematic source error);
+        otherwise the years are drawn independently.
+    upper_bound : float, optional
+        Cap of the samples, e.g. 1 for shares.
+    Returns
+    -------
+    samples : np.ndarray (samples x countries x years)
+        Draws from triangular distributions with mode at the typical value, by inverse transform sampling.
+    '''
+    a, b, c = typical * low, typical * high, typical
+    shape = (num_samples,) + typical.shape[:1] + ((1,) if persistent else typical.shape[1:])
+    u = rng.random(shape)
+    width = b - a
+    split = np.divide(c - a, width, out = np.zeros_like(width), where = width > 0)
+    with np.errstate(invalid = 'ignore'):
+        samples = np.where(u < split, a + np.sqrt(u * width * (c - a)), b - np.sqrt((1 - u) * width * (b - c)))
+    samples = np.where(width > 0, samples, c)
+    if upper_bound is not None:
+        samples = np.minimum(samples, upper_bound)
+    return samples
+
+def get_market_samples(population, prevalence, purity, seizures, production, price = None):
+    '''
+    Parameters
+    ----------
+    population : np.ndarray (countries x years)
+    prevalence : np.ndarray (samples x countries x years)
+    purity : np.ndarray (samples x countries x years)
+    seizures : np.ndarray (countries x years)
+        Seizures in kg, before the purity adjustment.
+    production : np.ndarray (years)
+        Global production in kg.
+    price : np.ndarray (samples x countries x years), optional
+    Returns
+    -------
+    samples : dict of np.ndarrays
+        Same computation as Aggregation.get_national_markets_df, for all samples at once: the global production is shared among
+        the countries by number of users, and the market is the consumption plus the purity-adjusted seizures.
+    '''
+    users = population * prevalence
+    consumption = users * (production / np.nansum(users, axis = 1, keepdims = True))
+    seizures = seizures * purity
+    samples = {'Seizures(kg)': seizures, 'Consumption(kg)': consumption, 'Market(kg)': consumption + seizures}
+    if price is not None:
+        samples['Price(USD)'] = price
+        samples['Market(USD)'] = samples['Market(kg)'] * price
+    return samples
+
+def get_quantile_bands(samples, countries_list, drug, quantiles = (0.05, 0.5, 0.95), start_year = 2006, end_year = 2017, aggregate_over_time_period = True):
+    '''
+    Parameters
+    ----------
+    samples : dict of np.ndarrays
+        Output of get_market_samples.
+    countries_list : list of str
+    drug : str
+    quantiles : tuple of float, optional
+    start_year : int, optional
+    end_year : int, optional
+    aggregate_over_time_period : bool, optional
+        If True, adds the bands of the average over the period under the key 'total' (as Features.aggregate_yearly_features).
+    Returns
+    -------
+    output_df : dict of pd.DataFrames
+        One dataframe per year with a '<quantity>_q<percent>' column per quantity and quantile, e.g. 'Market(kg)_q05'.
+    '''
+    periods = list(range(start_year, end_year + 1)) + (['total'] if aggregate_over_time_period else [])
+    output_df = {period: pd.DataFrame({'Country': list(countries_list), 'Drug': drug}) for period in periods}
+    for quantity, values in samples.items():
+        if aggregate_over_time_period:
+            values = np.concatenate([values, values.mean(axis = 2, keepdims = True)], axis = 2)
+        bands = np.nanquantile(values, quantiles, axis = 0)
+        for q, band in zip(quantiles, bands):
+            for t, period in enumerate(periods):
+                output_df[period][f'{quantity}_q{round(q * 100):02d}'] = band[:, t]
+    return output_df
+
+def get_market_bands(drug, countries_list, sub_region_dict, region_dict, df_ids, num_samples = 1000, quantiles = (0.05, 0.5, 0.95),
+                     persistent = True, include_price = True, seed = 0,
+                     sources_path = '/Users/mateicosa/Bocconi/BIDSA/Network_Science/data/sources/',
+                     start_year = 2006, end_year = 2017):
+    '''
+    Parameters
+    ----------
+    drug : str
+    countries_list : list of str
+    sub_region_dict : dict
+    region_dict : dict
+    df_ids : dict of pd.DataFrames
+    num_samples : int, optional
+        The default is 1000.
+    quantiles : tuple of float, optional
+    persistent : bool, optional
+        See sample_triangular.
+    include_price : bool, optional
+        If True, the wholesale price and the market value (USD) are sampled as well.
+    seed : int, optional
+    sources_path : str, optional
+        Directory containing the processed sources (Purity.xlsx, Prevalence.xlsx, Population.xlsx, Production.xlsx) and the raw ones.
+    start_year : int, optional
+    end_year : int, optional
+    Returns
+    -------
+    output_df : dict of pd.DataFrames
+        Quantile bands of seizures, consumption, market (and price and market value) per country, for every year and the whole period.
+    '''
+    years = list(range(start_year, end_year + 1))
+    registry = Countries.get_country_registry(countries_list)
+    codes = Countries.get_country_codes(countries_list, registry)
+
+    def _read_sheets(file):
+        xlsx = pd.ExcelFile(sources_path + file)
+        return {year: pd.read_excel(xlsx, str(year)) for year in years}
+
+    # Typical values as (countries x years) arrays
+    df_pop, df_prev, df_pure = _read_sheets('Population.xlsx'), _read_sheets('Prevalence.xlsx'), _read_sheets('Purity.xlsx')
+    population = np.column_stack([Countries.get_country_values(df_pop[year], 'Location', 'Population', registry)[codes] for year in years])
+    prevalence = np.column_stack([Countries.get_country_values(df_prev[year], 'Location', 'Prevalence', registry, mask = df_prev[year]['Drug'] == drug)[codes] for year in years])
+    purity = np.column_stack([Countries.get_country_values(df_pure[year], 'Location', 'Purity', registry, mask = df_pure[year]['Drug'] == drug)[codes] for year in years])
+    df_prod = pd.read_excel(sources_path + 'Production.xlsx')
+    production = df_prod[df_prod['Drug'] == drug].set_index('Year')['Quantity(kg)'].reindex(years).to_numpy(dtype = float)
+
+    # Seizures before the purity adjustment
+    get_drug_seizures = Seizures.get_drug_selector_function(drug)
+    seizures = np.column_stack([Seizures.get_seizure_totals(get_drug_seizures(df_ids[year]), drug, registry)[codes] for year in years])
+
+    # Joint draws of all uncertain inputs
+    rng = np.random.default_rng(seed)
+    def _sample(source, typical, upper_bound = None):
+        low, high = get_relative_ranges(read_range_source(source, sources_path = sources_path), source, drug, countries_list,
+                                        sub_region_dict, region_dict, start_year = start_year, end_year = end_year)
+        return sample_triangular(typical, low, high, num_samples, rng, persistent = persistent, upper_bound = upper_bound)
+
+    price = None
+    if include_price:
+        df_price = Features.get_drug_prices(file = sources_path + range_sources['price']['file'], drug_list = [drug], countries_list = countries_list,
+                                            sub_region_dict = sub_region_dict, region_dict = region_dict, start_year = start_year, end_year = end_year)
+        price = np.column_stack([df_price[year].set_index('Country')['Price(USD)'].reindex(countries_list).to_numpy(dtype = float) for year in years])
+        price = _sample('price', price)
+
+    samples = get_market_samples(population, _sample('prevalence', prevalence, upper_bound = 1.0), _sample('purity', purity, upper_bound = 1.0),
+                                 seizures, production, price = price)
+    return get_quantile_bands(samples, countries_list, drug, quantiles = quantiles, start_year = start_year, end_year = end_year)
+
+def get_band_attributes(bands):
+    '''
+    Parameters
+    ----------
+    bands : dict of pd.DataFrames
+        Output of get_market_bands.
+    Returns
+    -------
+    node_attributes : dict of pd.DataFrames
+        The bands with attribute names that can be written to .gml files (e.g. 'Market(kg)_q05' becomes 'market_q05'),
+        as expected by the node_attributes argument of Features.get_network_data.
+    '''
+    node_attributes = dict()
+    for period, df_bands in bands.items():
+        columns = {column: attribute_names.get(column.rsplit('_q', 1)[0], column.rsplit('_q', 1)[0]) + '_q' + column.rsplit('_q', 1)[1]
+                   for column in df_bands.columns if '_q' in column}
+        node_attributes[period] = df_bands[['Country'] + list(columns.keys())].rename(columns = columns)
+    return node_attributes
+
+def add_bands_to_network(network, df_bands):
+    '''
+    Parameters
+    ----------
+    network : nx.DiGraph
+    df_bands : pd.DataFrame
+        One period of the output of get_market_bands.
+    Returns
+    -------
+    network : nx.DiGraph
+        Populates node attributes such as 'market_q05' and 'market_q95' for the countries of the network.
+    '''
+    df_attributes = get_band_attributes({None: df_bands})[None]
+    names = list(df_attributes.columns[1:])
+    for country, values in zip(df_attributes['Country'], df_attributes[names].to_numpy(dtype = float)):
+        if country in network:
+            network.nodes[country].update(zip(names, values))
+    return network